@@ -0,0 +1,278 @@
+"""
+Time the reader and analysis hot paths on
+synthetic data of growing size.
+
+Every case runs in its own forked process, so its
+peak RSS is not hidden by an earlier, larger case.
+Results are written as JSON for comparing runs.
+"""
+
+import click
+import numpy as np
+
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from queue import Empty
+from typing import Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from daq_utils.dbscan import TAMaker, cluster_dbscan
+from daq_utils.synthetic import make_run
+from daq_utils.tp_keys import setdiff_tps, unique_tps
+
+
+EPS = 10
+MIN_PTS = 2
+DATA_MEMBERS = ["adc_integral", "adc_peak", "channel", "time_over_threshold", "time_peak"]
+
+
+def load_script(path: str):
+    """
+    Import a script by its path, e.g. one with a '-' in its name.
+    """
+    name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MB.
+    """
+    # ru_maxrss is in kB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Each case is setup(tps, tas, taps) -> (func, args, items).
+# Only func(*args) is timed, and items / seconds is the throughput.
+
+def discrepant_count(tps, tas, taps):
+    script = load_script("daq-runs-analysis/tp-discrepancy-histogram.py")
+
+    def run():
+        for ta_taps in taps:
+            for data_member in DATA_MEMBERS:
+                script.get_discrepant_count(tps, ta_taps, ['time_start', data_member])
+    return run, (), len(taps.taps)
+
+
+def discrepant_counts(tps, tas, taps):
+    script = load_script("daq-runs-analysis/tp-discrepancy-histogram.py")
+    return script.get_discrepant_counts, (tps, taps.taps, taps.offsets, DATA_MEMBERS), len(taps.taps)
+
+
+def setdiff1d(tps, tas, taps):
+    fields = ['time_start', 'channel', 'adc_peak']
+    return np.setdiff1d, (taps.taps[fields], tps[fields]), len(tps)
+
+
+def packed_setdiff(tps, tas, taps):
+    return setdiff_tps, (taps.taps, tps, ['time_start', 'channel', 'adc_peak']), len(tps)
+
+
+def unique(tps, tas, taps):
+    return np.unique, (tps[['time_start', 'channel']],), len(tps)
+
+
+def packed_unique(tps, tas, taps):
+    return unique_tps, (tps, ['time_start', 'channel']), len(tps)
+
+
+def merge_links(tps, tas, taps):
+    script = load_script("daq-runs-analysis/readout-trigger-comparison.py")
+    return script.merge_links, ([tps[link::4] for link in range(4)],), len(tps)
+
+
+def peak_time_check(tps, tas, taps):
+    script = load_script("trgtools/tp-ta-time-check.py")
+    return script.peak_time_check, (tas, taps), len(taps.taps)
+
+
+def start_time_check(tps, tas, taps):
+    script = load_script("trgtools/tp-ta-time-check.py")
+    return script.start_time_check, (tas, taps), len(taps.taps)
+
+
+def check_dbscan(tps, tas, taps):
+    script = load_script("ta-analysis/dbscan-definition-check.py")
+
+    def run():
+        for ta_taps in taps:
+            script.check_dbscan(ta_taps, EPS, MIN_PTS)
+    return run, (), len(taps.taps)
+
+
+def dbscan_clustering(tps, tas, taps):
+    return cluster_dbscan, (tps, EPS, MIN_PTS), len(tps)
+
+
+def ta_maker(tps, tas, taps):
+    def run():
+        maker = TAMaker(EPS, MIN_PTS)
+        for start in range(0, len(tps), 10000):
+            maker.add(tps[start:start+10000])
+        maker.flush()
+    return run, (), len(tps)
+
+
+CASES = {
+    "discrepant_count": discrepant_count,
+    "discrepant_counts": discrepant_counts,
+    "setdiff1d": setdiff1d,
+    "packed_setdiff": packed_setdiff,
+    "unique": unique,
+    "packed_unique": packed_unique,
+    "merge_links": merge_links,
+    "peak_time_check": peak_time_check,
+    "start_time_check": start_time_check,
+    "check_dbscan": check_dbscan,
+    "dbscan_clustering": dbscan_clustering,
+    "ta_maker": ta_maker,
+}
+
+
+def read_fragment(file):
+    import trgtools
+    data = trgtools.TPReader(file)
+    paths = data.get_fragment_paths()
+
+    def run():
+        for path in paths:
+            data.read_fragment(path)
+            data.clear_data()
+    return run, (), len(paths)
+
+
+def read_all_fragments(file):
+    import trgtools
+    data = trgtools.TAReader(file)
+    return data.read_all_fragments, (), len(data.get_fragment_paths())
+
+
+# Cases on a real file. Throughput is in fragments per second.
+FILE_CASES = {
+    "read_fragment": read_fragment,
+    "read_all_fragments": read_all_fragments,
+}
+
+
+def time_case(setup, setup_args: tuple, repeat: int) -> dict:
+    """
+    Set up a case and time it.
+
+    Returns the best and mean time, the throughput at the best time,
+    and the peak RSS before and after the timed calls.
+    """
+    func, args, items = setup(*setup_args)
+    setup_rss = peak_rss_mb()
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - start)
+
+    best = min(seconds)
+    return {
+        "items": items,
+        "best_seconds": best,
+        "mean_seconds": float(np.mean(seconds)),
+        "items_per_second": items / best if best > 0 else float('inf'),
+        "setup_rss_mb": setup_rss,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _run_case(queue, setup, setup_args: tuple, repeat: int) -> None:
+    try:
+        queue.put(time_case(setup, setup_args, repeat))
+    except Exception as exc:
+        queue.put({"error": repr(exc)})
+
+
+def run_isolated(setup, setup_args: tuple, repeat: int, timeout: Optional[float] = None) -> dict:
+    """
+    Run time_case in a forked process.
+
+    A case whose process exits without a result, or runs past timeout
+    seconds, is reported with an "error" instead of blocking the benchmark.
+    """
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_run_case, args=(queue, setup, setup_args, repeat))
+    process.start()
+    start = time.perf_counter()
+
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            if not process.is_alive():
+                # The result may have been sent just before the process exited.
+                try:
+                    result = queue.get(timeout=1)
+                except Empty:
+                    result = {"error": f"Case process exited with code {process.exitcode} without a result."}
+            elif timeout is not None and time.perf_counter() - start > timeout:
+                process.terminate()
+                result = {"error": f"Case timed out after {timeout:g} s."}
+    process.join()
+    return result
+
+
+@click.command()
+@click.option("--sizes", '-s', default="1e4,1e5,1e6")
+@click.option("--rate", type=click.FLOAT, default=1e6)
+@click.option("--cases", '-c', default=None)
+@click.option("--repeat", '-r', type=click.INT, default=3)
+@click.option("--seed", type=click.INT, default=0)
+@click.option("--file", '-f', type=click.Path(exists=True), default=None)
+@click.option("--output", '-o', type=click.Path(), default="benchmarks.json")
+@click.option("--timeout", type=click.FLOAT, default=None)
+def main(sizes, rate, cases, repeat, seed, file, output, timeout):
+    sizes = [int(float(size)) for size in sizes.split(',')]
+    case_names = list(CASES) + list(FILE_CASES) if cases is None else cases.split(',')
+    unknown = [name for name in case_names if name not in CASES and name not in FILE_CASES]
+    if unknown:
+        raise click.BadParameter(f"Unknown cases: {', '.join(unknown)}.")
+
+    results = []
+    for num_tps in sizes:
+        # Made once per size. The forked cases share it without copying.
+        fixture = make_run(num_tps, rate, seed=seed)
+        print(f"{num_tps} TPs, {len(fixture[1])} TAs")
+        for name in case_names:
+            if name not in CASES:
+                continue
+            result = run_isolated(CASES[name], fixture, repeat, timeout)
+            result.update({"case": name, "num_tps": num_tps, "rate": rate})
+            results.append(result)
+            print(f"  {name}: {result.get('items_per_second', 0):.3g} items/s, "
+                  f"{result.get('peak_rss_mb', 0):.0f} MB peak", result.get("error", ""))
+        del fixture
+
+    if file is not None:
+        for name in case_names:
+            if name not in FILE_CASES:
+                continue
+            result = run_isolated(FILE_CASES[name], (file,), repeat, timeout)
+            result.update({"case": name, "file": os.path.abspath(file)})
+            results.append(result)
+            print(f"  {name}: {result.get('items_per_second', 0):.3g} fragments/s", result.get("error", ""))
+
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print("Results written to", output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Run an analysis script on a synthetic run file.
+
+The script's trgtools readers are swapped for the
+synthetic readers before it is run, so it needs
+no changes. Everything after the script path is
+passed on to the script, e.g.
+
+    python benchmarks/load-test.py tp-analysis/hot_channel.py run.npz -a
+"""
+
+import os
+import runpy
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.synthetic_run import SyntheticTAReader, SyntheticTCReader, SyntheticTPReader
+
+
+def install_readers() -> None:
+    """
+    Make 'import trgtools' give the synthetic readers.
+    """
+    trgtools = types.ModuleType("trgtools")
+    trgtools.TPReader = SyntheticTPReader
+    trgtools.TAReader = SyntheticTAReader
+    trgtools.TCReader = SyntheticTCReader
+    sys.modules["trgtools"] = trgtools
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    script = sys.argv[1]
+    sys.argv = sys.argv[1:]
+
+    install_readers()
+    start = time.perf_counter()
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as exc:
+        # click exits when the command finishes.
+        if exc.code not in (None, 0):
+            raise
+    print(f"{script} took {time.perf_counter() - start:.2f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Write a synthetic run file for load testing
+the analysis scripts without detector data.
+
+Read it back with load-test.py.
+"""
+
+import click
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.synthetic_run import HOT_RATE, NOISE_RATE, TRACK_RATE, generate_run, write_run
+
+
+@click.command()
+@click.argument("file")
+@click.option("--records", '-n', type=click.INT, default=10)
+@click.option("--channels", type=click.INT, default=3072)
+@click.option("--noise-rate", type=click.FLOAT, default=NOISE_RATE)
+@click.option("--hot-channel", type=click.INT, multiple=True)
+@click.option("--hot-rate", type=click.FLOAT, default=HOT_RATE)
+@click.option("--track-rate", type=click.FLOAT, default=TRACK_RATE)
+@click.option("--links", type=click.INT, default=1)
+@click.option("--duplication", type=click.FLOAT, default=0.0)
+@click.option("--scale", type=click.FLOAT, default=1.0)
+@click.option("--eps", type=click.FLOAT, default=10)
+@click.option("--min-pts", type=click.INT, default=20)
+@click.option("--seed", type=click.INT, default=0)
+def main(file, records, channels, noise_rate, hot_channel, hot_rate, track_rate, links, duplication, scale, eps, min_pts, seed):
+    run = generate_run(num_records=records, num_channels=channels, noise_rate=noise_rate, hot_channels=hot_channel,
+                       hot_rate=hot_rate, track_rate=track_rate, num_links=links, duplication=duplication,
+                       scale=scale, eps=eps, min_pts=min_pts, seed=seed)
+    write_run(file, run)
+
+    num_tps = sum(len(tps) for path, tps in run["tp"].items() if "Trigger_0x" in path)
+    num_tas = sum(len(tas) for tas, _ in run["ta"].values())
+    print(f"Wrote {records} records with {num_tps} TPs and {num_tas} TAs to {file}")
+    return
+
+
+if __name__ == "__main__":
+    main()
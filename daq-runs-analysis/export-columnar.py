@@ -0,0 +1,39 @@
+"""
+Export a run file's TPs, TAs, and TCs into
+memory-mappable columnar tables, so later
+analyses don't need to decode the HDF5 file.
+"""
+
+import trgtools
+
+import click
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.columnar import export_run
+from daq_utils.fragment_cache import open_reader
+from daq_utils.profiling import phase, profile_option
+
+
+@click.command()
+@click.argument("file")
+@click.argument("out_dir")
+@click.option("--prefetch", '-p', type=click.INT, default=0)
+@profile_option
+def main(file, out_dir, prefetch):
+    with phase("open"):
+        tp_data = open_reader(trgtools.TPReader, file)
+        ta_data = open_reader(trgtools.TAReader, file)
+        tc_data = open_reader(trgtools.TCReader, file)
+
+    with phase("export"):
+        manifest = export_run(file, out_dir, tp_data, ta_data, tc_data, depth=prefetch)
+    for name, table in manifest["tables"].items():
+        print(f"{name}: {table['length']} rows")
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -7,13 +7,21 @@ start and end point.
 
 import trgtools
 
-import daqdataformats
-
 import click
 import matplotlib.pyplot as plt
 import numpy as np
 
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.fragment_cache import open_reader
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.header_index import get_header_index
+from daq_utils.profiling import phase, profile_option, profiled
+
 
+@profiled("plot")
 def plot_png_fragment_window_difference(tp_windows: np.ndarray, ta_windows: np.ndarray) -> None:
     plt.figure(figsize=(6, 4), dpi=200)
     plt.plot(ta_windows[:, 0] - tp_windows[:, 0], 'ok', ms=3, label="TA - TP Window Begin")
@@ -41,6 +49,7 @@ def plot_png_fragment_window_difference(tp_windows: np.ndarray, ta_windows: np.n
     return
 
 
+@profiled("plot")
 def plot_png_fragment_window_width(tp_windows: np.ndarray, ta_windows: np.ndarray) -> None:
     plt.figure(figsize=(6, 4), dpi=200)
     plt.plot(tp_windows[:, 1] - tp_windows[:, 0], '-o', color="#63ACBE", ms=3, label="TP Fragments", alpha=0.5)
@@ -59,26 +68,26 @@ def plot_png_fragment_window_width(tp_windows: np.ndarray, ta_windows: np.ndarra
 
 @click.command()
 @click.argument("file")
-def main(file):
-    tp_data = trgtools.TPReader(file)
-    ta_data = trgtools.TAReader(file)
-
-    tp_windows = []
-    for path in tp_data.get_fragment_paths():
-        tp_frag = tp_data._h5_file.get_frag(path)
-        window_begin = tp_frag.get_window_begin()
-        window_end = tp_frag.get_window_end()
-        tp_windows.append((window_begin, window_end))
-
-    ta_windows = []
-    for path in ta_data.get_fragment_paths():
-        ta_frag = ta_data._h5_file.get_frag(path)
-        window_begin = ta_frag.get_window_begin()
-        window_end = ta_frag.get_window_end()
-        ta_windows.append((window_begin, window_end))
-
-    tp_windows = np.array(tp_windows)
-    ta_windows = np.array(ta_windows)
+@click.option("--rebuild-index", default=False, is_flag=True)
+@profile_option
+def main(file, rebuild_index):
+    with phase("open"):
+        tp_data = open_reader(trgtools.TPReader, file)
+        ta_data = open_reader(trgtools.TAReader, file)
+
+    # Only the fragment headers are needed, and they are cached after the first run.
+    with phase("decode"):
+        tp_index = get_header_index(file, tp_data, rebuild=rebuild_index)
+        ta_index = get_header_index(file, ta_data, rebuild=rebuild_index)
+
+    tp_rows = {path: row for row, path in enumerate(tp_index['path'])}
+    ta_rows = {path: row for row, path in enumerate(ta_index['path'])}
+    pairs = FragmentIndex.from_readers(tp_data, ta_data).join("trigger_tp", "ta")
+    tp_index = tp_index[[tp_rows[tp_path] for tp_path, _ in pairs]]
+    ta_index = ta_index[[ta_rows[ta_path] for _, ta_path in pairs]]
+
+    tp_windows = np.array([tp_index['window_begin'], tp_index['window_end']]).T.astype(np.int64)
+    ta_windows = np.array([ta_index['window_begin'], ta_index['window_end']]).T.astype(np.int64)
     plot_png_fragment_window_difference(tp_windows, ta_windows)
     plot_png_fragment_window_width(tp_windows, ta_windows)
     return
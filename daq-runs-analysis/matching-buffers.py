@@ -4,6 +4,14 @@ both contain the same number of TPs.
 
 Maybe check later that they are actually
 the same TPs.
+
+With --jobs 1, fragments are read in this process and --prefetch
+decodes them ahead on background threads. With more jobs, records are
+spread over worker processes.
+
+With --online, records are streamed and only running statistics of
+the counts are kept, so long runs can be checked in constant memory.
+Records whose counts are outliers are printed as they are read.
 """
 
 import trgtools
@@ -12,7 +20,20 @@ import click
 import matplotlib.pyplot as plt
 import numpy as np
 
+from collections import defaultdict
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.mapreduce import map_fragments, open_readers, to_columns
+from daq_utils.profiling import phase, profile_option, profiled
+from daq_utils.running_stats import RunningStats
+from daq_utils.streaming import group_records, stream_ta_fragments, stream_tc_fragments, stream_tp_fragments
+
 
+@profiled("plot")
 def plot_tp_fragment_counts(tp_fragment_counts: np.ndarray, ta_fragment_counts: np.ndarray):
     """
     Plot the count of TPs in each fragment.
@@ -50,6 +71,7 @@ def plot_tp_fragment_counts(tp_fragment_counts: np.ndarray, ta_fragment_counts:
     return
 
 
+@profiled("plot")
 def plot_ta_fragment_counts(ta_fragment_counts: np.ndarray, tc_fragment_counts: np.ndarray):
     """
     Plot the count of TAs in each fragment.
@@ -71,47 +93,187 @@ def plot_ta_fragment_counts(ta_fragment_counts: np.ndarray, tc_fragment_counts:
     return
 
 
+def count_record(tp_count: int, tas: np.ndarray, tcs: np.ndarray) -> dict:
+    """
+    Count the contents of one record's fragments.
+
+    Parameters:
+        tp_count (int): Number of TPs in the record's TP fragments.
+        tas (np.ndarray): TAs in the record's TA fragments.
+        tcs (np.ndarray): TCs in the record's TC fragments.
+
+    Returns a dictionary of the counts.
+    """
+    return {
+            "tp_fragment_count": tp_count,                  # Number of TPs in TP fragments
+            "ta_fragment_count": np.sum(tas['num_tps']),    # Number of TPs in TA fragments
+            "ta_ta_count": len(tas),                        # Number of TAs in TA fragments
+            "tc_fragment_count": np.sum(tcs['num_tas']),    # Number of TAs in TC fragments
+    }
+
+
+def count_fragment(readers: tuple, paths: tuple[tuple[str, ...], ...]) -> dict:
+    """
+    Count the contents of one record's TP, TA, and TC fragments.
+
+    Parameters:
+        readers (tuple): TP, TA, and TC readers.
+        paths (tuple[tuple[str, ...], ...]): The record's TP, TA, and TC fragment paths.
+            Every TP link of the record is counted.
+
+    Returns a dictionary of the counts.
+    """
+    tp_reader, ta_reader, tc_reader = readers
+    tp_paths, ta_paths, tc_paths = paths
+
+    with phase("decode"):
+        tp_count = sum(len(tp_reader.read_fragment(tp_path)) for tp_path in tp_paths)
+        for ta_path in ta_paths:
+            _ = ta_reader.read_fragment(ta_path)
+        for tc_path in tc_paths:
+            _ = tc_reader.read_fragment(tc_path)
+
+    return count_record(tp_count, ta_reader.ta_data, tc_reader.tc_data)
+
+
+def stream_records(readers: tuple, index: FragmentIndex, tp_kind: str, prefetch: int):
+    """
+    Stream the TP, TA, and TC fragments of every record that has all three.
+
+    Parameters:
+        readers (tuple): TP, TA, and TC readers.
+        index (FragmentIndex): Index of the readers' fragments.
+        tp_kind (str): Kind of TP fragments to read, "readout_tp" or "trigger_tp".
+        prefetch (int): Number of fragments to prefetch per reader.
+
+    Yields (record, TP fragments, TA fragments, TC fragments) per record,
+    with the fragments as given by the stream_*_fragments generators.
+    """
+    tp_reader, ta_reader, tc_reader = readers
+    records = index.records_with(tp_kind, "ta", "tc")
+    streams = zip(group_records(stream_tp_fragments(tp_reader, index.paths(tp_kind, records), depth=prefetch), index),
+                  group_records(stream_ta_fragments(ta_reader, index.paths("ta", records), depth=prefetch), index),
+                  group_records(stream_tc_fragments(tc_reader, index.paths("tc", records), depth=prefetch), index))
+    for (record, tp_fragments), (_, ta_fragments), (_, tc_fragments) in streams:
+        yield record, tp_fragments, ta_fragments, tc_fragments
+
+
+def count_streamed(readers: tuple, index: FragmentIndex, tp_kind: str, prefetch: int) -> dict[str, np.ndarray]:
+    """
+    Count every record's fragments in this process, decoding ahead with prefetch.
+
+    Returns the count_record columns.
+    """
+    counts = []
+    for _, tp_fragments, ta_fragments, tc_fragments in stream_records(readers, index, tp_kind, prefetch):
+        tp_count = sum(len(tps) for _, tps in tp_fragments)
+        tas = np.concatenate([tas for _, tas, _ in ta_fragments])
+        tcs = np.concatenate([tcs for _, tcs, _ in tc_fragments])
+        counts.append(count_record(tp_count, tas, tcs))
+    return to_columns(counts)
+
+
+def reconcile_online(readers: tuple, index: FragmentIndex, tp_kind: str, threshold: float,
+                     warmup: int, prefetch: int) -> tuple[dict[str, RunningStats], dict[str, int]]:
+    """
+    Stream every record's TP, TA, and TC fragments and keep running statistics of their counts.
+
+    A record is printed as soon as one of its counts is more than threshold
+    standard deviations from the mean of the records before it.
+
+    Parameters:
+        readers (tuple): TP, TA, and TC readers.
+        index (FragmentIndex): Index of the readers' fragments.
+        tp_kind (str): Kind of TP fragments to count, "readout_tp" or "trigger_tp".
+        threshold (float): Outlier threshold in standard deviations.
+        warmup (int): Number of records read before flagging starts.
+        prefetch (int): Number of fragments to prefetch per reader.
+
+    Returns the statistics and the totals of each count.
+    """
+    stats = defaultdict(RunningStats)
+    totals = defaultdict(int)
+    num_records = 0
+    num_flagged = 0
+    for record, tp_fragments, ta_fragments, tc_fragments in stream_records(readers, index, tp_kind, prefetch):
+        num_records += 1
+        counts = {}
+        for path, tps in tp_fragments:
+            counts[f"link_0x{index.parse(path)['source_id']:x}_tp_count"] = len(tps)
+        tp_count = sum(counts.values())
+        ta_fragments = [tas for _, tas, _ in ta_fragments]
+        ta_tp_count = int(sum(np.sum(tas['num_tps']) for tas in ta_fragments))
+        ta_ta_count = sum(len(tas) for tas in ta_fragments)
+        tc_ta_count = int(sum(np.sum(tcs['num_tas']) for _, tcs, _ in tc_fragments))
+        counts.update({
+            "tp_fragment_count": tp_count,                  # Number of TPs in TP fragments
+            "ta_fragment_count": ta_tp_count,               # Number of TPs in TA fragments
+            "ta_ta_count": ta_ta_count,                     # Number of TAs in TA fragments
+            "tc_fragment_count": tc_ta_count,               # Number of TAs in TC fragments
+            "ta_tp_difference": ta_tp_count - tp_count,     # TA - TP
+            "tc_ta_difference": tc_ta_count - ta_ta_count,  # TC - TA
+        })
+
+        flags = []
+        for name, count in counts.items():
+            zscore = stats[name].zscore(count)
+            if stats[name].count >= warmup and abs(zscore) > threshold:
+                flags.append(f"{name} = {count} (mean {stats[name].mean:.4g}, std {stats[name].std:.4g}, z {zscore:.3g})")
+            stats[name].update(count)
+            totals[name] += count
+        if len(flags) > 0:
+            num_flagged += 1
+            print(f"TriggerRecord {record[0]}.{record[1]:04}: " + "; ".join(flags))
+
+    print(f"{num_flagged} of {num_records} records flagged.")
+    return dict(stats), dict(totals)
+
+
 @click.command()
 @click.argument("file")
-def main(file):
-    tp_data = trgtools.TPReader(file)
-    ta_data = trgtools.TAReader(file)
-    tc_data = trgtools.TCReader(file)
-
-    tp_paths = tp_data.get_fragment_paths()
-    ta_paths = ta_data.get_fragment_paths()
-    tc_paths = tc_data.get_fragment_paths()
-
-    tp_fragment_counts = []  # Number of TPs in TP fragments
-    ta_fragment_counts = []  # Number of TPs in TA fragments
-    ta_ta_counts = []        # Number of TAs in TA fragments (lazy naming)
-    tc_fragment_counts = []  # Number of TAs in TC fragments
-    for tp_path, ta_path, tc_path in zip(tp_paths, ta_paths, tc_paths):
-        # Collect fragment contents
-        tp_datum = tp_data.read_fragment(tp_path)
-        _ = ta_data.read_fragment(ta_path)
-        _ = tc_data.read_fragment(tc_path)
-
-        # Calculate counts
-        tp_fragment_counts.append(len(tp_datum))
-        ta_fragment_counts.append(np.sum(ta_data.ta_data['num_tps']))
-        ta_ta_counts.append(len(ta_data.ta_data))
-        tc_fragment_counts.append(np.sum(tc_data.tc_data['num_tas']))
-
-        # Reset for next fragment
-        tp_data.clear_data()
-        ta_data.clear_data()
-        tc_data.clear_data()
+@click.option("--readout", '-r', default=False, is_flag=True)
+@click.option("--jobs", '-j', type=click.INT, default=1)
+@click.option("--online", '-o', default=False, is_flag=True)
+@click.option("--threshold", type=click.FLOAT, default=5.0)
+@click.option("--warmup", type=click.INT, default=20)
+@click.option("--prefetch", '-p', type=click.INT, default=0)
+@profile_option
+def main(file, readout, jobs, online, threshold, warmup, prefetch):
+    reader_types = (trgtools.TPReader, trgtools.TAReader, trgtools.TCReader)
+    readers = open_readers(file, reader_types)
+    tp_kind = "readout_tp" if readout else "trigger_tp"
+    index = FragmentIndex.from_readers(*readers)
+
+    if online:
+        stats, totals = reconcile_online(readers, index, tp_kind, threshold, warmup, prefetch)
+        for name in sorted(stats):
+            summary = ", ".join(f"{key} {value:.4g}" for key, value in stats[name].summary().items())
+            print(f"{name}: {summary}")
+        print("TP Fragment TPs:", totals.get("tp_fragment_count", 0))
+        print("TA Fragment TPs:", totals.get("ta_fragment_count", 0))
+        if totals.get("ta_fragment_count", 0) > 0:
+            print("Proportion:", totals["tp_fragment_count"] / totals["ta_fragment_count"])
+        return
+
+    path_tuples = index.group(tp_kind, "ta", "tc")
+    if len(path_tuples) == 0:
+        print("No records with TP, TA, and TC fragments.")
+        return
+
+    if jobs <= 1:
+        counts = count_streamed(readers, index, tp_kind, prefetch)
+    else:
+        counts = map_fragments(count_fragment, file, reader_types, path_tuples, jobs=jobs)
 
     # Plot the TP-TA relations
-    plot_tp_fragment_counts(np.array(tp_fragment_counts), np.array(ta_fragment_counts))
+    plot_tp_fragment_counts(counts["tp_fragment_count"], counts["ta_fragment_count"])
 
     # Plot the TA-TC relations
-    plot_ta_fragment_counts(np.array(ta_ta_counts), np.array(tc_fragment_counts))
+    plot_ta_fragment_counts(counts["ta_ta_count"], counts["tc_fragment_count"])
 
     # Calculate the proportion
-    tp_total_count = np.sum(tp_fragment_counts)
-    ta_total_count = np.sum(ta_fragment_counts)
+    tp_total_count = np.sum(counts["tp_fragment_count"])
+    ta_total_count = np.sum(counts["ta_fragment_count"])
 
     print("TP Fragment TPs:", tp_total_count)
     print("TA Fragment TPs:", ta_total_count)
@@ -8,6 +8,9 @@ have the same start TP.
 
 I'll also count the number of TPs that are
 contained in these windows.
+
+Takes one or more files, glob patterns, or run IDs. The files of a run
+are measured in parallel, one per worker, and merged in record order.
 """
 
 import trgtools
@@ -16,7 +19,20 @@ import click
 import matplotlib.pyplot as plt
 import numpy as np
 
+from functools import partial
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.mapreduce import map_files, map_fragments, open_readers, to_columns
+from daq_utils.profiling import phase, profile_option, profiled
+from daq_utils.run_files import find_files
+from daq_utils.streaming import group_records, stream_ta_fragments, stream_tp_fragments
 
+
+@profiled("plot")
 def plot_png_time_windows(tp_window: np.ndarray, ta_window: np.ndarray) -> None:
     """
     Plot the width of the time windows and their differences.
@@ -52,39 +68,165 @@ def plot_png_time_windows(tp_window: np.ndarray, ta_window: np.ndarray) -> None:
     return None
 
 
-@click.command()
-@click.argument("file")
-def main(file):
-    tp_data = trgtools.TPReader(file)
-    ta_data = trgtools.TAReader(file)
-
-    tp_window_width = []            # Time window width for TP fragments.
-    ta_window_width = []            # Time window width for TA fragments.
-    ta_tp_start_difference = []     # Difference in TA-TP first TP start_time.
-    tp_window_tp_count = []         # Number of TPs in TP window.
-    ta_window_tp_count = []         # Number of TPs in TA window.
-    for tp_path, ta_path in zip(tp_data.get_fragment_paths(), ta_data.get_fragment_paths()):
-        tps = tp_data.read_fragment(tp_path)
-        _ = ta_data.read_fragment(ta_path)
-
-        tp_window_tp_count.append(len(tps))
-        ta_window_tp_count.append(np.sum(ta_data.ta_data['num_tps']))
-
-        tp_window_width.append(tps['time_start'][-1] - tps['time_start'][0])
+def measure_record(tp_times: np.ndarray, tas: np.ndarray, taps: list[np.ndarray]) -> dict:
+    """
+    Measure the time window of one record's TPs and TAs.
+
+    Parameters:
+        tp_times (np.ndarray): time_start of the TPs in the record's TP fragments.
+        tas (np.ndarray): TAs in the record's TA fragments.
+        taps (list[np.ndarray]): TPs of each TA.
+
+    Returns a dictionary of the window measurements. A record whose TP
+    fragments have no TPs has no TP window, and one whose TA fragments
+    have no TAs, or a TA with no TPs, has no TA window. Their windows are
+    0, and has_tps or has_tas is False.
+    """
+    tp_times = tp_times.astype(int)
+    has_tps = len(tp_times) > 0
+    has_tas = len(taps) > 0 and all(len(ta_taps) > 0 for ta_taps in taps)
+    tp_window_width = np.max(tp_times) - np.min(tp_times) if has_tps else 0
+    ta_window_width = ta_tp_start_difference = 0
+    if has_tas:
         # There may be more than one TA in the fragment.
         # Assume that the first TA is earliest in time and the last TA is latest in time.
-        ta_window_width.append(ta_data.tp_data[-1]['time_start'][-1].astype(int) - ta_data.tp_data[0]['time_start'][0].astype(int))
+        ta_window_width = taps[-1]['time_start'][-1].astype(int) - taps[0]['time_start'][0].astype(int)
+        if has_tps:
+            ta_tp_start_difference = taps[0]['time_start'][0].astype(int) - np.min(tp_times)
+    return {
+            "tp_window_tp_count": len(tp_times),                            # Number of TPs in TP window.
+            "ta_window_tp_count": np.sum(tas['num_tps']),                   # Number of TPs in TA window.
+            "tp_window_width": tp_window_width,                             # Time window width for TP fragments.
+            "ta_window_width": ta_window_width,                             # Time window width for TA fragments.
+            "ta_tp_start_difference": ta_tp_start_difference,               # Difference in TA-TP first TP start_time.
+            "has_tps": has_tps,                                             # False if the TP fragments are empty.
+            "has_tas": has_tas,                                             # False if the TA fragments are empty.
+    }
+
+
+def measure_fragment(readers: tuple, paths: tuple[tuple[str, ...], tuple[str, ...]]) -> dict:
+    """
+    Measure the time window of one record's TP and TA fragments.
+
+    Parameters:
+        readers (tuple): TP and TA readers.
+        paths (tuple[tuple[str, ...], tuple[str, ...]]): The record's TP and TA fragment paths.
+            The TPs of every TP link make up the TP window.
+
+    Returns a dictionary of the window measurements.
+    """
+    tp_reader, ta_reader = readers
+    tp_paths, ta_paths = paths
+
+    with phase("decode"):
+        for tp_path in tp_paths:
+            _ = tp_reader.read_fragment(tp_path)
+        for ta_path in ta_paths:
+            _ = ta_reader.read_fragment(ta_path)
+    return measure_record(tp_reader.tp_data['time_start'], ta_reader.ta_data, ta_reader.tp_data)
+
+
+def measure_streamed(readers: tuple, index: FragmentIndex, tp_kind: str, prefetch: int) -> dict[str, np.ndarray]:
+    """
+    Measure every record's time windows in this process, decoding ahead with prefetch.
+
+    Returns the measure_record columns.
+    """
+    tp_reader, ta_reader = readers
+    records = index.records_with(tp_kind, "ta")
+    streams = zip(group_records(stream_tp_fragments(tp_reader, index.paths(tp_kind, records), depth=prefetch), index),
+                  group_records(stream_ta_fragments(ta_reader, index.paths("ta", records), depth=prefetch), index))
+    windows = []
+    for (_, tp_fragments), (_, ta_fragments) in streams:
+        tp_times = np.concatenate([tps['time_start'] for _, tps in tp_fragments])
+        tas = np.concatenate([tas for _, tas, _ in ta_fragments])
+        taps = [ta_taps for _, _, fragment_taps in ta_fragments for ta_taps in fragment_taps]
+        windows.append(measure_record(tp_times, tas, taps))
+    return to_columns(windows)
+
+
+def measure_file(file: str, readout: bool = False, jobs: int = 1, prefetch: int = 0) -> dict[str, np.ndarray]:
+    """
+    Measure the time windows of every record in a file.
 
-        ta_tp_start_difference.append(ta_data.tp_data[0]['time_start'][0].astype(int) - tps['time_start'][0].astype(int))
+    Parameters:
+        file (str): HDF5 file to read.
+        readout (bool): Compare TAs with readout TPs instead of trigger TPs.
+        jobs (int): Number of worker processes for this file.
+        prefetch (int): Number of fragments to prefetch per reader when jobs is 1.
 
-        # Prepare for the next fragment.
-        tp_data.clear_data()
-        ta_data.clear_data()
+    Returns the measure_record columns with each record's run_id,
+    record, and sequence number. Empty if no record has both fragments.
+    """
+    reader_types = (trgtools.TPReader, trgtools.TAReader)
+    readers = open_readers(file, reader_types)
+    tp_kind = "readout_tp" if readout else "trigger_tp"
+    index = FragmentIndex.from_readers(*readers)
+    path_tuples = index.group(tp_kind, "ta")
+    if len(path_tuples) == 0:
+        return {}
+
+    if jobs <= 1:
+        windows = measure_streamed(readers, index, tp_kind, prefetch)
+    else:
+        windows = map_fragments(measure_fragment, file, reader_types, path_tuples, jobs=jobs)
+    records = np.array([index.record_of(ta_paths[0]) for _, ta_paths in path_tuples], dtype=np.int64)
+    windows["run_id"] = np.full(len(records), readers[0].run_id, dtype=np.int64)
+    windows["record"] = records[:, 0]
+    windows["sequence"] = records[:, 1]
+    return windows
+
+
+def merge_windows(file_windows: list[dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    """
+    Merge the measure_file columns of several files into record order.
+    """
+    file_windows = [windows for windows in file_windows if len(windows) > 0]
+    if len(file_windows) == 0:
+        return {}
+    windows = {key: np.concatenate([columns[key] for columns in file_windows]) for key in file_windows[0]}
+    order = np.lexsort((windows["sequence"], windows["record"], windows["run_id"]))
+    return {key: column[order] for key, column in windows.items()}
 
-    print("Min Time Start Difference:", np.min(ta_tp_start_difference))
-    print("Max Time Start Difference:", np.max(ta_tp_start_difference))
 
-    plot_png_time_windows(np.array(tp_window_width), np.array(ta_window_width))
+@click.command()
+@click.argument("files", nargs=-1, required=True)
+@click.option("--data-dir", '-d', type=click.Path(exists=True, file_okay=False), default=".")
+@click.option("--readout", '-r', default=False, is_flag=True)
+@click.option("--jobs", '-j', type=click.INT, default=1)
+@click.option("--prefetch", '-p', type=click.INT, default=0)
+@profile_option
+def main(files, data_dir, readout, jobs, prefetch):
+    files = find_files(files, data_dir)
+    if len(files) == 0:
+        raise click.BadParameter("No files match the given paths, patterns, or run IDs.")
+
+    if len(files) == 1:
+        windows = measure_file(files[0], readout, jobs, prefetch)
+    else:
+        # One file per worker. Each file is read serially.
+        windows = merge_windows(map_files(partial(measure_file, readout=readout, prefetch=prefetch), files, jobs=jobs))
+    if len(windows) == 0:
+        print("No records with both TP and TA fragments.")
+        return
+
+    # Records with empty TP or TA fragments have no windows to compare.
+    has_tps = windows.pop("has_tps")
+    has_tas = windows.pop("has_tas")
+    print("Records with empty TP fragments skipped:", np.sum(~has_tps))
+    print("Records with empty TA fragments skipped:", np.sum(has_tps & ~has_tas))
+    windows = {key: column[has_tps & has_tas] for key, column in windows.items()}
+    if len(windows["record"]) == 0:
+        print("No records with both TPs and TAs.")
+        return
+
+    print("Files:", len(files))
+    print("Runs:", ", ".join(str(run_id) for run_id in np.unique(windows["run_id"])))
+    print("Records:", len(windows["record"]))
+    print("Min Time Start Difference:", np.min(windows["ta_tp_start_difference"]))
+    print("Max Time Start Difference:", np.max(windows["ta_tp_start_difference"]))
+
+    plot_png_time_windows(windows["tp_window_width"], windows["ta_window_width"])
     return
 
 
@@ -9,10 +9,19 @@ import click
 import matplotlib.pyplot as plt
 import numpy as np
 
-import re
+import os
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.fragment_cache import open_reader
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.plotting import PlotQueue, get_figure, save_figure
+from daq_utils.profiling import phase, profile_option, profiled
+from daq_utils.tp_keys import intersect_tps, setdiff_tps
 
-def plot_taps(good_taps: np.ndarray, bad_taps: np.ndarray, file_id, record_id) -> None:
+
+@profiled("plot")
+def plot_taps(good_taps: np.ndarray, bad_taps: np.ndarray, file_id: str, record_id: str) -> None:
     """
     Plot the TAPs event display with bad TAPs highlighted.
 
@@ -31,7 +40,7 @@ def plot_taps(good_taps: np.ndarray, bad_taps: np.ndarray, file_id, record_id) -
         min_time = np.min(good_taps['time_start'])
     else:
         min_time = np.min((np.min(bad_taps['time_start']), np.min(good_taps['time_start'])))
-    plt.figure(figsize=(6, 4), dpi=200)
+    get_figure(figsize=(6, 4), dpi=200)
 
     plt.plot(good_taps['time_start'] - min_time, good_taps['channel'], 'sk', ms=3, label="Good TAPs")
     plt.plot(bad_taps['time_start'] - min_time, bad_taps['channel'], 'xr', ms=3, label="Bad TAPs")
@@ -42,8 +51,7 @@ def plot_taps(good_taps: np.ndarray, bad_taps: np.ndarray, file_id, record_id) -
     plt.legend()
 
     plt.tight_layout()
-    plt.savefig(f"taps_display_{file_id}-{record_id}.png")
-    plt.close()
+    save_figure(f"taps_display_{file_id}-{record_id}.png")
 
     return
 
@@ -51,22 +59,35 @@ def plot_taps(good_taps: np.ndarray, bad_taps: np.ndarray, file_id, record_id) -
 @click.command()
 @click.argument("file")
 @click.option("--frag", '-f', type=click.INT, default=0)
-def main(file, frag):
-    ta_data = trgtools.TAReader(file)
-    tp_data = trgtools.TPReader(file)
+@click.option("--plot-jobs", type=click.INT, default=1)
+@click.option("--plot-data", type=click.Path(), default=None)
+@profile_option
+def main(file, frag, plot_jobs, plot_data):
+    with phase("open"):
+        ta_data = open_reader(trgtools.TAReader, file)
+        tp_data = open_reader(trgtools.TPReader, file)
 
     file_id = f"{ta_data.run_id}.{ta_data.file_index}"
 
+    index = FragmentIndex.from_readers(ta_data, tp_data)
     path = ta_data.get_fragment_paths()[frag]
-    _ = ta_data.read_fragment(path)
-    tps = tp_data.read_fragment(tp_data.get_fragment_paths()[frag//2 + 1])
-
-    record_regex = re.compile('(\d+\.)')
-    record_id = record_regex.search(path).group()
+    record = index.record_of(path)
+    tp_paths = index.get(record, "trigger_tp")
+    if len(tp_paths) == 0:
+        raise click.BadParameter(f"TriggerRecord {record[0]} has no trigger TP fragment.")
+    with phase("decode"):
+        _ = ta_data.read_fragment(path)
+        tps = np.concatenate([tp_data.read_fragment(tp_path) for tp_path in tp_paths])
+
+    record_id = f"{record[0]:05}."
+    plots = PlotQueue()
     for idx, taps in enumerate(ta_data.tp_data):
-        bad_taps = np.setdiff1d(taps, tps)
-        good_taps = np.setdiff1d(taps, bad_taps)
-        plot_taps(good_taps, bad_taps, file_id, record_id+f"{idx}")
+        with phase("compute"):
+            bad_taps = setdiff_tps(taps, tps)
+            good_taps = intersect_tps(taps, tps)
+        plots.add(plot_taps, good_taps=good_taps, bad_taps=bad_taps, file_id=file_id, record_id=record_id+f"{idx}")
+
+    plots.finish(plot_jobs, plot_data)
 
     return
 
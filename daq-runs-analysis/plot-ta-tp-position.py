@@ -9,7 +9,20 @@ import click
 import numpy as np
 import matplotlib.pyplot as plt
 
+from functools import partial
 
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.browser import FragmentBrowser
+from daq_utils.fragment_cache import open_reader, rereading_cache
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.header_index import get_header_index
+from daq_utils.profiling import phase, profile_option, profiled
+
+
+@profiled("plot")
 def plot_channel_time(taps: np.ndarray, tps: np.ndarray, file_id: str) -> None:
     """
     Plot the location of TPs in the TA fragment and
@@ -44,6 +57,7 @@ def plot_channel_time(taps: np.ndarray, tps: np.ndarray, file_id: str) -> None:
     return
 
 
+@profiled("plot")
 def plot_adc_peak_time(taps: np.ndarray, tps: np.ndarray, file_id: str) -> None:
     """
     Plot the location of TPs in the TA fragment and
@@ -78,38 +92,77 @@ def plot_adc_peak_time(taps: np.ndarray, tps: np.ndarray, file_id: str) -> None:
     return
 
 
+def read_pair(ta_reader: trgtools.TAReader, tp_reader: trgtools.TPReader, paths: tuple[str, str]) -> tuple:
+    """
+    Read a TA fragment and its TP fragment.
+
+    Returns the TAs, the list of TPs per TA, and the TPs of the TP fragment.
+    """
+    ta_path, tp_path = paths
+    with phase("decode"):
+        _ = ta_reader.read_fragment(ta_path)
+        tas, taps = ta_reader.ta_data, ta_reader.tp_data
+        ta_reader.clear_data()
+        tps = tp_reader.read_fragment(tp_path)
+        tp_reader.clear_data()
+    return tas, taps, tps
+
+
 @click.command()
 @click.argument("file")
-def main(file):
-    tp_data = trgtools.TPReader(file)
-    ta_data = trgtools.TAReader(file)
+@click.option("--all-frags", '-a', default=False, is_flag=True)
+@click.option("--rebuild-index", default=False, is_flag=True)
+@click.option("--prefetch", '-p', type=click.INT, default=4)
+@click.option("--cache", type=click.INT, default=32)
+@profile_option
+def main(file, all_frags, rebuild_index, prefetch, cache):
+    with phase("open"):
+        # Browsing back and forth reads the same fragments again.
+        tp_data = open_reader(trgtools.TPReader, file, cache=rereading_cache())
+        ta_data = open_reader(trgtools.TAReader, file, cache=rereading_cache())
     file_id = f"{tp_data.run_id}.{tp_data.file_index}"
 
-    ta_index = -1
-    tp_index = -1
-    while True:
-        ta_index += 1
-        tp_index += 2
-        tp_data.clear_data()
-        ta_data.clear_data()
-
-        _ = ta_data.read_fragment(ta_data.get_fragment_paths()[ta_index])
-        if len(ta_data.ta_data) == 0:
-            print("Empty fragment. Skipping.")
-            continue
-        tps = tp_data.read_fragment(tp_data.get_fragment_paths()[tp_index])
-        taps = ta_data.tp_data[0]
-
-        print(f"TP Fragment has {len(tps)} TPs.")
-        print(f"TA Fragment has {len(taps)} TPs.")
-        print(f"TA Fragment has {len(ta_data.tp_data)} TAs.")
-        prompt = input("Plot? [y/n/q]: ")
-        if prompt.lower() == 'y':
-            plot_channel_time(taps, tps, file_id)
-            plot_adc_peak_time(taps, tps, file_id)
-            return
-        if prompt.lower() == 'q':
-            return
+    index = FragmentIndex.from_readers(tp_data, ta_data)
+    pairs = index.join("ta", "trigger_tp")
+    if not all_frags:
+        # Empty TA fragments have no payload, so the fragment headers are
+        # enough to skip them without decoding any TAs.
+        ta_index = get_header_index(file, ta_data, rebuild=rebuild_index)
+        payload_sizes = dict(zip(ta_index['path'], ta_index['payload_size']))
+        pairs = [pair for pair in pairs if payload_sizes[pair[0]] > 0]
+    positions = {index.record_of(ta_path)[0]: position for position, (ta_path, _) in enumerate(pairs)}
+    print(f"{len(pairs)} TA fragments to browse.")
+
+    with FragmentBrowser(partial(read_pair, ta_data, tp_data), pairs, depth=prefetch, cache_size=cache) as browser:
+        position = 0
+        while 0 <= position < len(browser):
+            tas, taps, tps = browser[position]
+            record = index.record_of(pairs[position][0])[0]
+            if len(tas) == 0:
+                print(f"TriggerRecord {record}: Empty fragment. Skipping.")
+                position += 1
+                continue
+
+            print(f"TriggerRecord {record}:")
+            print(f"TP Fragment has {len(tps)} TPs.")
+            print(f"TA Fragment has {len(taps[0])} TPs.")
+            print(f"TA Fragment has {len(tas)} TAs.")
+            prompt = input("Plot? [y/n/p/q/<record>]: ").strip().lower()
+            if prompt == 'y':
+                plot_channel_time(taps[0], tps, file_id)
+                plot_adc_peak_time(taps[0], tps, file_id)
+                return
+            if prompt == 'q':
+                return
+            if prompt == 'p':
+                position = max(position - 1, 0)
+            elif prompt.isdigit():
+                if int(prompt) not in positions:
+                    print(f"TriggerRecord {prompt} has no TAs to browse.")
+                    continue
+                position = positions[int(prompt)]
+            else:
+                position += 1
 
     return
 
@@ -13,55 +13,128 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from collections import defaultdict
-import re
+from itertools import groupby
 
+import os
+import sys
 
-def get_unique_tps(links: dict[list[np.ndarray]]) -> list[np.ndarray]:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.fragment_cache import open_reader
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.profiling import phase, profile_option, profiled
+from daq_utils.streaming import stream_tp_fragments
+from daq_utils.tp_keys import unique_tps
+
+
+# Fields that identify a TP seen by more than one link.
+MERGE_FIELDS = ['time_start', 'channel']
+
+
+def merge_runs(times0: np.ndarray, times1: np.ndarray) -> np.ndarray:
     """
-    Get the unique TPs per TriggerRecord.
+    Merge two time-ordered runs.
 
-    Parameter:
-        links (dict[list[np.ndarray]]):
-            Dictionary with keys of the link and values
-            of a list per fragment and its contents.
+    Parameters:
+        times0 (np.ndarray): Sorted times of the first run.
+        times1 (np.ndarray): Sorted times of the second run.
 
-    Returns a list of the unique TPs for each fragment.
+    Returns a mask over the merged order that is True where the item
+    comes from the second run. Equal times keep the first run first.
     """
-    unique_tps = []
+    from_second = np.zeros(len(times0) + len(times1), dtype=bool)
+    from_second[np.searchsorted(times0, times1, side='right') + np.arange(len(times1))] = True
+    return from_second
 
-    num_records = len(list(links.values())[0])
-    # All links _should_ have the same number of TriggerRecords.
-    for idx in range(num_records):
-        tps = [link[idx] for link in links.values()]
-        unique_tps.append(np.unique(tps))
-    return unique_tps
 
+def merge_links(link_tps: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merge the TPs of one TriggerRecord's links, removing duplicates.
+
+    Each link is already time ordered, so the links are merged pairwise
+    with merge_runs, O(N log k) for k links, instead of being sorted.
+    A link that is not time ordered is sorted first. TPs are duplicates
+    if they share the MERGE_FIELDS, which needs a time_start shared with
+    a neighbor, so only those ties go through unique_tps.
+
+    Parameter:
+        link_tps (list[np.ndarray]): TPs of each link in the record.
 
-def plot_png_total_link_counts(links: dict[list[np.ndarray]], file_id: str) -> None:
+    Returns:
+        (np.ndarray): The unique TPs, ordered by time_start. Ties keep link order.
+        (np.ndarray): Link by link matrix of the number of unique TPs both links contain.
+            The diagonal is the number of unique TPs in each link.
+    """
+    num_links = len(link_tps)
+    link_tps = [tps if np.all(tps['time_start'][1:] >= tps['time_start'][:-1])
+                else tps[np.argsort(tps['time_start'], kind='stable')] for tps in link_tps]
+
+    # Each run is (times, index into the concatenated links), merged until one is left.
+    starts = np.cumsum([0] + [len(tps) for tps in link_tps])
+    runs = [(tps['time_start'], np.arange(start, start + len(tps))) for tps, start in zip(link_tps, starts)]
+    while len(runs) > 1:
+        merged_runs = []
+        for (times0, idx0), (times1, idx1) in zip(runs[0::2], runs[1::2]):
+            from_second = merge_runs(times0, times1)
+            times = np.empty(len(from_second), dtype=times0.dtype)
+            idx = np.empty(len(from_second), dtype=np.int64)
+            times[~from_second], times[from_second] = times0, times1
+            idx[~from_second], idx[from_second] = idx0, idx1
+            merged_runs.append((times, idx))
+        if len(runs) % 2 == 1:
+            merged_runs.append(runs[-1])
+        runs = merged_runs
+    times, order = runs[0] if num_links > 0 else (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64))
+
+    tps = np.concatenate(link_tps)[order] if num_links > 0 else np.zeros(0)
+    link_idx = np.repeat(np.arange(num_links), np.diff(starts))[order]
+    if len(tps) == 0:
+        return tps, np.zeros((num_links, num_links), dtype=np.int64)
+
+    # Each TP is represented by the first TP with the same MERGE_FIELDS.
+    representative = np.arange(len(tps))
+    same_time = times[1:] == times[:-1]
+    tied = np.zeros(len(tps), dtype=bool)
+    tied[1:] |= same_time
+    tied[:-1] |= same_time
+    tied = np.flatnonzero(tied)
+    if len(tied) > 0:
+        _, tie_id = unique_tps(tps[tied], MERGE_FIELDS, return_inverse=True)
+        first = np.full(np.max(tie_id) + 1, len(tied), dtype=np.int64)
+        np.minimum.at(first, tie_id, np.arange(len(tied)))
+        representative[tied] = tied[first[tie_id]]
+    unique = representative == np.arange(len(tps))
+    unique_id = (np.cumsum(unique) - 1)[representative]
+
+    presence = np.zeros((np.sum(unique), num_links), dtype=np.int64)
+    presence[unique_id, link_idx] = 1
+    return tps[unique], presence.T @ presence
+
+
+@profiled("plot")
+def plot_png_total_link_counts(link_counts: dict[str, list[int]], unique_count: list[int], file_id: str) -> None:
     """
     Plot the total TP count in each of the TP links.
     Each link is likely to have some duplication of TPs.
 
     Parameters:
-        links (dict[list[np.ndarray]]):
+        link_counts (dict[str, list[int]]):
             Dictionary with keys of the link and values
-            of a list per fragment and its contents.
+            of the TP count in each TriggerRecord.
+        unique_count (list[int]):
+            Number of unique TPs in each TriggerRecord.
         file_id (str):
-            String of the file that produced `links`.
+            String of the file that produced `link_counts`.
 
     Returns nothing. Saves a PNG of the associated plot.
     """
     plt.figure(figsize=(6, 4), dpi=200)
 
-    unique_tps = get_unique_tps(links)
-    unique_count = [len(tps) for tps in unique_tps]
     plt.plot(unique_count, '-ok', ms=3, alpha=0.4, label=f"Unique TPs: {np.sum(unique_count)} TPs")
 
-    for link_id, fragments in links.items():
-        tp_count = [len(fragment) for fragment in fragments]
+    for link_id, tp_count in link_counts.items():
         plt.plot(tp_count, '-o', ms=3, alpha=0.4, label=f"Link {link_id}: {np.sum(tp_count)} TPs")
 
-    num_links = len(links.keys())
+    num_links = len(link_counts.keys())
     plt.title("TriggerPrimitive Links:\nTP Count per Link")
     plt.xlabel(f"TriggerRecord ({num_links} Links per TR)")
     plt.ylabel("TP Count")
@@ -75,20 +148,62 @@ def plot_png_total_link_counts(links: dict[list[np.ndarray]], file_id: str) -> N
 
 @click.command()
 @click.argument("file")
-def main(file):
-    tp_data = TPReader(file)
+@click.option("--prefetch", '-p', type=click.INT, default=0)
+@profile_option
+def main(file, prefetch):
+    with phase("open"):
+        tp_data = open_reader(TPReader, file)
     file_id = f"{tp_data.run_id}.{tp_data.file_index:04}"
 
-    links = defaultdict(list)
-    link_regex = re.compile('(\dx\d+)')
-    for path in tp_data.get_fragment_paths():
-        if "Trigger_Primitive" in path:
-            _ = tp_data.read_fragment(path)
-            link_idx = int(link_regex.search(path).group(), 0)
-            links[link_idx].append(tp_data.tp_data)
-            tp_data.clear_data()
-
-    plot_png_total_link_counts(links, file_id)
+    index = FragmentIndex.from_readers(tp_data)
+    paths = [path for record in index for kind in ("readout_tp", "trigger_tp") for path in index.get(record, kind)]
+
+    link_counts = defaultdict(list)      # TP count per record for each link.
+    unique_count = []                    # Unique TP count per record.
+    records = []                         # (record, sequence) of each record.
+    record_overlaps = []                 # Unique TPs shared by each pair of links in each record.
+    fragments = stream_tp_fragments(tp_data, paths, depth=prefetch)
+    for record_idx, (record, record_fragments) in enumerate(groupby(fragments, key=lambda fragment: index.record_of(fragment[0]))):
+        link_ids = []
+        link_tps = []
+        for path, tps in record_fragments:
+            # Readout and trigger links can share a source ID.
+            parsed = index.parse(path)
+            link_ids.append(f"{parsed['subsystem']}_0x{parsed['source_id']:x}")
+            link_tps.append(tps)
+
+        with phase("compute"):
+            merged_tps, record_overlap = merge_links(link_tps)
+        unique_count.append(len(merged_tps))
+        records.append(record)
+        record_overlaps.append({})
+        for idx, link_id in enumerate(link_ids):
+            # Links missing from earlier records have 0 TPs there.
+            link_counts[link_id].extend([0] * (record_idx - len(link_counts[link_id])))
+            link_counts[link_id].append(len(link_tps[idx]))
+            for jdx, other_id in enumerate(link_ids):
+                record_overlaps[-1][(link_id, other_id)] = record_overlap[idx, jdx]
+        del link_tps, merged_tps
+
+    num_records = len(unique_count)
+    for counts in link_counts.values():
+        counts.extend([0] * (num_records - len(counts)))
+
+    link_ids = sorted(link_counts.keys())
+    # Links missing from a record share 0 TPs there.
+    overlaps = np.array([[[record_overlap.get((link_id, other_id), 0) for other_id in link_ids] for link_id in link_ids]
+                         for record_overlap in record_overlaps], dtype=np.int64).reshape(num_records, len(link_ids), len(link_ids))
+    print("Link Overlap (Unique TPs in Both Links):")
+    print("Links:", link_ids)
+    for record, record_overlap in zip(records, overlaps):
+        print(f"Record {record[0]}.{record[1]}:")
+        print(record_overlap)
+    print("Total:")
+    print(overlaps.sum(axis=0))
+    np.savez_compressed(f"link_overlap-{file_id}.npz", records=np.array(records, dtype=np.int64).reshape(num_records, 2),
+                        links=np.array(link_ids), overlap=overlaps, unique_count=np.array(unique_count))
+
+    plot_png_total_link_counts(link_counts, unique_count, file_id)
     return
 
 
@@ -0,0 +1,25 @@
+"""
+Render the plots saved by a script run with --plot-data.
+"""
+
+import click
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.plotting import render_saved
+
+
+@click.command()
+@click.argument("plot_data", nargs=-1, type=click.Path(exists=True))
+@click.option("--jobs", '-j', type=click.INT, default=1)
+def main(plot_data, jobs):
+    for path in plot_data:
+        num_plots = render_saved(path, jobs)
+        print(f"{path}: {num_plots} plots rendered")
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,17 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from collections import defaultdict
+from itertools import groupby
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.fragment_cache import open_reader
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.plotting import PlotQueue, get_figure, save_figure
+from daq_utils.profiling import phase, profile_option, profiled
+from daq_utils.streaming import stream_ta_fragments, stream_tp_fragments
 
 
 DATA_MEMBERS = [
@@ -26,6 +37,7 @@ DATA_MEMBERS = [
                 #"time_start",  # EXPLICIT: Not including as this will be our static dof
                ]
 
+@profiled("plot")
 def plot_png_histogram(data: list[int], data_id: tuple[str, str]) -> None:
     """
     Write a PNG histogram of the given data.
@@ -36,7 +48,7 @@ def plot_png_histogram(data: list[int], data_id: tuple[str, str]) -> None:
 
     Returns nothing. Write a PNG to the CWD.
     """
-    plt.figure(figsize=(6, 4), dpi=200)
+    get_figure(figsize=(6, 4), dpi=200)
 
     plt.hist(data, bins=10, color='k')
 
@@ -47,11 +59,11 @@ def plot_png_histogram(data: list[int], data_id: tuple[str, str]) -> None:
     plt.xlim((-0.1, 1.1))
 
     plt.tight_layout()
-    plt.savefig(f"{data_id[1]}_discrepants_hist.png")
-    plt.close()
+    save_figure(f"{data_id[1]}_discrepants_hist.png")
     return
 
 
+@profiled("plot")
 def plot_png_overlap_histogram(data: dict[list[int]], file_id: str, readout=False) -> None:
     """
     Write a PNG histogram of the given data.
@@ -63,7 +75,7 @@ def plot_png_overlap_histogram(data: dict[list[int]], file_id: str, readout=Fals
 
     Returns nothing. Write a PNG to the CWD.
     """
-    plt.figure(figsize=(6, 4), dpi=200)
+    get_figure(figsize=(6, 4), dpi=200)
 
     for data_member in DATA_MEMBERS:
         plt.hist(data[data_member], bins=10, alpha=0.2, label=data_member)
@@ -79,8 +91,7 @@ def plot_png_overlap_histogram(data: dict[list[int]], file_id: str, readout=Fals
     plt.xlim((-0.1, 1.1))
 
     plt.tight_layout()
-    plt.savefig(f"{prefix}_overlap_discrepants_hist_{file_id}.png")
-    plt.close()
+    save_figure(f"{prefix}_overlap_discrepants_hist_{file_id}.png")
     return
 
 
@@ -88,6 +99,8 @@ def get_discrepant_count(tps: np.ndarray, taps: np.ndarray, data_members: list[s
     """
     Get the number of discrepant TPs using the given data member.
 
+    Reference for a single TA. Use get_discrepant_counts for whole fragments.
+
     Parameters:
         tps (np.ndarray): TPs from a TP fragment.
         taps (np.ndarray): TPs from a TA fragment.
@@ -98,50 +111,120 @@ def get_discrepant_count(tps: np.ndarray, taps: np.ndarray, data_members: list[s
     return len(np.setdiff1d(taps[data_members], tps[data_members]))
 
 
+def get_discrepant_masks(tps: np.ndarray, taps: np.ndarray, data_members: list[str]) -> dict[str, np.ndarray]:
+    """
+    Find the TAPs that have no TP with the same time_start and data member.
+
+    The TPs are sorted by time_start once. Every TAP is then matched
+    against the TPs with the same time_start in a single pass, and
+    each data member is compared on those candidate pairs.
+
+    Parameters:
+        tps (np.ndarray): TPs from a TP fragment.
+        taps (np.ndarray): TAPs of any number of TAs.
+        data_members (list[str]): Data members to check alongside time_start.
+
+    Returns a dictionary of data member to a boolean mask over taps. True if discrepant.
+    """
+    sorted_tps = tps[np.argsort(tps['time_start'], kind='stable')]
+    lo = np.searchsorted(sorted_tps['time_start'], taps['time_start'], side='left')
+    hi = np.searchsorted(sorted_tps['time_start'], taps['time_start'], side='right')
+    counts = hi - lo
+
+    # Expand each TAP into its (TAP, TP) candidate pairs.
+    run_starts = np.cumsum(counts) - counts
+    tap_idx = np.repeat(np.arange(len(taps)), counts)
+    tp_idx = np.arange(np.sum(counts)) - np.repeat(run_starts - lo, counts)
+
+    masks = {}
+    for data_member in data_members:
+        match = sorted_tps[data_member][tp_idx] == taps[data_member][tap_idx]
+        found = np.zeros(len(taps), dtype=bool)
+        found[tap_idx[match]] = True
+        masks[data_member] = ~found
+    return masks
+
+
+def get_discrepant_counts(tps: np.ndarray, taps: np.ndarray, offsets: np.ndarray, data_members: list[str]) -> dict[str, np.ndarray]:
+    """
+    Get the number of discrepant TAPs in every TA of a fragment.
+
+    Counts match get_discrepant_count(tps, taps, ['time_start', data_member])
+    for each TA, including that repeated TAPs are only counted once.
+
+    Parameters:
+        tps (np.ndarray): TPs from a TP fragment.
+        taps (np.ndarray): TAPs of all TAs in the fragment, in TA order.
+        offsets (np.ndarray): TA i owns taps[offsets[i]:offsets[i+1]].
+        data_members (list[str]): Data members to check alongside time_start.
+
+    Returns a dictionary of data member to the discrepant count per TA.
+    """
+    num_tas = len(offsets) - 1
+    ta_index = np.repeat(np.arange(num_tas), np.diff(offsets))
+    masks = get_discrepant_masks(tps, taps, data_members)
+
+    counts = {}
+    for data_member in data_members:
+        bad = np.flatnonzero(masks[data_member])
+        order = np.lexsort((taps[data_member][bad], taps['time_start'][bad], ta_index[bad]))
+        bad = bad[order]
+        unique = np.ones(len(bad), dtype=bool)
+        unique[1:] = ((ta_index[bad][1:] != ta_index[bad][:-1])
+                      | (taps['time_start'][bad][1:] != taps['time_start'][bad][:-1])
+                      | (taps[data_member][bad][1:] != taps[data_member][bad][:-1]))
+        counts[data_member] = np.bincount(ta_index[bad][unique], minlength=num_tas)
+    return counts
+
+
 @click.command()
 @click.argument("file")
 @click.option("--num", '-n', type=click.INT, default=1)
 @click.option("--all-frags", '-a', default=False, is_flag=True)
 @click.option("--readout", '-r', default=False, is_flag=True)
-def main(file, num, all_frags, readout):
-    tp_data = trgtools.TPReader(file)
-    ta_data = trgtools.TAReader(file)
+@click.option("--prefetch", '-p', type=click.INT, default=0)
+@click.option("--plot-jobs", type=click.INT, default=1)
+@click.option("--plot-data", type=click.Path(), default=None)
+@profile_option
+def main(file, num, all_frags, readout, prefetch, plot_jobs, plot_data):
+    with phase("open"):
+        tp_data = open_reader(trgtools.TPReader, file)
+        ta_data = open_reader(trgtools.TAReader, file)
 
     file_id = f"{tp_data.run_id}.{tp_data.file_index:04}"
 
-    # ASSUMPTION: There is only 1 readout unit, so only need to offset the
-    # trigger and readout fragments by 1.
-    tp_idx = 1
-    ta_idx = 0
-    if readout:
-        tp_idx = 0
-
-    tp_paths = tp_data.get_fragment_paths()
-    ta_paths = ta_data.get_fragment_paths()
-    if all_frags:
-        num = len(ta_paths)
+    tp_kind = "readout_tp" if readout else "trigger_tp"
+    index = FragmentIndex.from_readers(tp_data, ta_data)
+    records = index.records_with(tp_kind, "ta")
+    if not all_frags:
+        records = records[:num]
 
+    # Every TP and TA fragment of a record is compared together, however
+    # many readout units and TA makers there are.
     discrepants = defaultdict(list)
-    for _ in range(num):
-        tps = tp_data.read_fragment(tp_paths[tp_idx])
-        _ = ta_data.read_fragment(ta_paths[ta_idx])
-
-        tp_idx += 2
-        ta_idx += 1
-
-        for taps in ta_data.tp_data:
-            num_taps = len(taps)
-            for data_member in DATA_MEMBERS:
-                count = get_discrepant_count(tps, taps, ['time_start', data_member])
-                discrepants[data_member].append(count / num_taps)
-        tp_data.clear_data()
-        ta_data.clear_data()
-
+    tp_fragments = groupby(stream_tp_fragments(tp_data, index.paths(tp_kind, records), depth=prefetch),
+                           key=lambda fragment: index.record_of(fragment[0]))
+    ta_fragments = groupby(stream_ta_fragments(ta_data, index.paths("ta", records), depth=prefetch),
+                           key=lambda fragment: index.record_of(fragment[0]))
+    for (_, record_tps), (_, record_tas) in zip(tp_fragments, ta_fragments):
+        tps = np.concatenate([tps for _, tps in record_tps])
+        tp_list = [taps for _, _, fragment_taps in record_tas for taps in fragment_taps]
+        if len(tp_list) == 0:
+            continue
+        num_taps = np.array([len(taps) for taps in tp_list])
+        offsets = np.concatenate(([0], np.cumsum(num_taps)))
+        with phase("compute"):
+            counts = get_discrepant_counts(tps, np.concatenate(tp_list), offsets, DATA_MEMBERS)
+        for data_member in DATA_MEMBERS:
+            discrepants[data_member].extend(counts[data_member] / num_taps)
+
+    plots = PlotQueue()
     for data_member in DATA_MEMBERS:
         data_id = (f"{data_member}\n{file_id}", f"{data_member}_{file_id}")
-        plot_png_histogram(discrepants[data_member], data_id)
+        plots.add(plot_png_histogram, data=discrepants[data_member], data_id=data_id)
 
-    plot_png_overlap_histogram(discrepants, file_id, readout)
+    plots.add(plot_png_overlap_histogram, data=dict(discrepants), file_id=file_id, readout=readout)
+    plots.finish(plot_jobs, plot_data)
 
     return
 
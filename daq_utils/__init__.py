@@ -0,0 +1,6 @@
+"""
+Helpers shared by the analysis scripts.
+
+Scripts add the repository root to sys.path so this
+package can be imported from any of the script directories.
+"""
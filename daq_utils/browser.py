@@ -0,0 +1,92 @@
+"""
+Random access to decoded fragments for interactive browsing.
+
+A FragmentBrowser reads items (e.g. a TA fragment and its TP fragment)
+by position. After each access, the next few items are read on a
+background thread while the user looks at the current one, and recent
+items are kept in an LRU, so stepping forward, stepping back, and
+revisiting are usually instant.
+
+All reads happen on the one background thread, so a reader is never
+used by two threads at once.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+from typing import Any, Callable
+
+
+class FragmentBrowser:
+    """
+    Items read by position, with read-ahead and an LRU of recent items.
+    """
+
+    def __init__(self, read: Callable[[Any], Any], keys: list, depth: int = 4, cache_size: int = 32) -> None:
+        """
+        Parameters:
+            read (Callable): Called as read(key) on the background thread. Returns the item.
+            keys (list): Key of each item, by position.
+            depth (int): Number of items after the current one to read ahead.
+            cache_size (int): Number of read items to keep. At least depth + 1.
+        """
+        self.read = read
+        self.keys = list(keys)
+        self.depth = depth
+        self.cache_size = max(cache_size, depth + 1)
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="browser")
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __enter__(self) -> "FragmentBrowser":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stop reading ahead. Items not yet started are dropped.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _read(self, position: int) -> Any:
+        item = self.read(self.keys[position])
+        with self._lock:
+            self._cache[position] = item
+            self._cache.move_to_end(position)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self._pending.pop(position, None)
+        return item
+
+    def _request(self, position: int) -> Future:
+        """
+        Get the future of an item, scheduling its read if needed.
+        """
+        with self._lock:
+            if position in self._cache:
+                future = Future()
+                future.set_result(self._cache[position])
+                self._cache.move_to_end(position)
+                return future
+            if position not in self._pending:
+                self._pending[position] = self._executor.submit(self._read, position)
+            return self._pending[position]
+
+    def __getitem__(self, position: int) -> Any:
+        """
+        Get the item at a position and start reading the ones after it.
+        """
+        if position < 0:
+            position += len(self.keys)
+        if not 0 <= position < len(self.keys):
+            raise IndexError(f"Position {position} is out of range for {len(self.keys)} items.")
+        item = self._request(position).result()
+        for ahead in range(position + 1, min(position + 1 + self.depth, len(self.keys))):
+            self._request(ahead)
+        return item
@@ -0,0 +1,172 @@
+"""
+Export a run file's TPs, TAs, and TCs into columnar tables.
+
+Each table is a directory of raw column files (one per field) and the
+run has a manifest.json with every column's dtype and the table
+lengths. Fragments are streamed and appended one at a time, so
+exporting never holds more than a fragment in memory. Loading
+memory-maps each column, so it is instant and zero-copy.
+
+Tables:
+    tps:  Every TP from the TP fragments, with record, fragment, and link columns.
+    tas:  Every TA, with fragment, tp_offset, and tp_count columns.
+          TA i owns taps[tp_offset[i]:tp_offset[i] + tp_count[i]].
+    taps: The TPs of every TA, flat and in TA order.
+    tcs:  Every TC, with a fragment column.
+"""
+
+import json
+import os
+import re
+from typing import Optional
+
+import numpy as np
+
+from daq_utils.streaming import stream_ta_fragments, stream_tc_fragments, stream_tp_fragments
+
+
+MANIFEST = "manifest.json"
+RECORD_REGEX = re.compile(r'(\d+)\.\d+')
+LINK_REGEX = re.compile(r'0x[0-9a-fA-F]+')
+
+
+def get_record_number(path: str) -> int:
+    """
+    Get the record number in a fragment path, or -1 if it has none.
+    """
+    match = RECORD_REGEX.search(path)
+    return int(match.group(1)) if match else -1
+
+
+def get_link(path: str) -> int:
+    """
+    Get the link (source ID) in a fragment path, or -1 if it has none.
+    """
+    match = LINK_REGEX.search(path)
+    return int(match.group(), 0) if match else -1
+
+
+def _append(tables: dict, out_dir: str, name: str, array: np.ndarray, extra: dict) -> None:
+    """
+    Append a structured array and extra columns to a table.
+    """
+    if len(array) == 0:
+        return
+    table = tables.setdefault(name, {"length": 0, "columns": {}, "handles": {}})
+    columns = [(field, array[field]) for field in array.dtype.names]
+    columns += [(field, np.broadcast_to(np.asarray(value), (len(array),))) for field, value in extra.items()]
+    for field, values in columns:
+        if field not in table["handles"]:
+            os.makedirs(os.path.join(out_dir, name), exist_ok=True)
+            table["columns"][field] = values.dtype.str
+            table["handles"][field] = open(os.path.join(out_dir, name, f"{field}.bin"), 'wb')
+        table["handles"][field].write(np.ascontiguousarray(values, dtype=table["columns"][field]).tobytes())
+    table["length"] += len(array)
+
+
+def export_run(file: str, out_dir: str, tp_reader, ta_reader, tc_reader, depth: int = 0) -> dict:
+    """
+    Export every fragment of a run file into columnar tables.
+
+    Parameters:
+        file (str): HDF5 file the readers were opened on.
+        out_dir (str): Directory to write the tables to.
+        tp_reader (trgtools.TPReader): TP reader on file.
+        ta_reader (trgtools.TAReader): TA reader on file.
+        tc_reader (trgtools.TCReader): TC reader on file.
+        depth (int): Number of fragments to prefetch on a background thread.
+
+    Returns the manifest that was written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tables = {}
+    try:
+        for frag_idx, (path, tps) in enumerate(stream_tp_fragments(tp_reader, depth=depth)):
+            _append(tables, out_dir, "tps", tps, {
+                "record": np.int64(get_record_number(path)),
+                "fragment": np.int64(frag_idx),
+                "link": np.int64(get_link(path)),
+            })
+
+        for frag_idx, (path, tas, taps) in enumerate(stream_ta_fragments(ta_reader, depth=depth)):
+            tp_count = np.array([len(tps) for tps in taps], dtype=np.int64)
+            tp_offset = tables.get("taps", {}).get("length", 0) + np.cumsum(tp_count) - tp_count
+            _append(tables, out_dir, "tas", tas, {
+                "fragment": np.int64(frag_idx),
+                "tp_offset": tp_offset,
+                "tp_count": tp_count,
+            })
+            if len(taps) > 0:
+                _append(tables, out_dir, "taps", np.concatenate(taps), {})
+
+        for frag_idx, (path, tcs, _) in enumerate(stream_tc_fragments(tc_reader, depth=depth)):
+            _append(tables, out_dir, "tcs", tcs, {"fragment": np.int64(frag_idx)})
+    finally:
+        for table in tables.values():
+            for handle in table["handles"].values():
+                handle.close()
+
+    manifest = {
+        "source": os.path.abspath(file),
+        "mtime": os.path.getmtime(file),
+        "paths": {
+            "tp": list(tp_reader.get_fragment_paths()),
+            "ta": list(ta_reader.get_fragment_paths()),
+            "tc": list(tc_reader.get_fragment_paths()),
+        },
+        "tables": {name: {"length": table["length"], "columns": table["columns"]} for name, table in tables.items()},
+    }
+    with open(os.path.join(out_dir, MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def load_manifest(out_dir: str) -> dict:
+    """
+    Load the manifest of an exported run.
+    """
+    with open(os.path.join(out_dir, MANIFEST)) as manifest_file:
+        return json.load(manifest_file)
+
+
+def load_table(out_dir: str, name: str, manifest: Optional[dict] = None) -> dict[str, np.ndarray]:
+    """
+    Memory-map the columns of an exported table.
+
+    Parameters:
+        out_dir (str): Directory of the exported run.
+        name (str): Table name: "tps", "tas", "taps", or "tcs".
+        manifest (dict): Already loaded manifest. Loaded from out_dir if not given.
+
+    Returns a dictionary of field name to a read-only array.
+    Empty if the run had nothing for this table.
+    """
+    if manifest is None:
+        manifest = load_manifest(out_dir)
+    table = manifest["tables"].get(name, {"length": 0, "columns": {}})
+    columns = {}
+    for field, dtype in table["columns"].items():
+        if table["length"] == 0:
+            columns[field] = np.empty(0, dtype=dtype)
+            continue
+        columns[field] = np.memmap(os.path.join(out_dir, name, f"{field}.bin"), dtype=dtype, mode='r', shape=(table["length"],))
+    return columns
+
+
+def to_records(columns: dict[str, np.ndarray], fields: Optional[list[str]] = None) -> np.ndarray:
+    """
+    Copy table columns into a structured array, like the readers return.
+
+    Parameters:
+        columns (dict[str, np.ndarray]): Columns from load_table.
+        fields (list[str]): Fields to include. Defaults to all columns.
+
+    Returns a structured array.
+    """
+    if fields is None:
+        fields = list(columns.keys())
+    length = len(columns[fields[0]]) if fields else 0
+    records = np.zeros(length, dtype=[(field, columns[field].dtype) for field in fields])
+    for field in fields:
+        records[field] = columns[field]
+    return records
@@ -0,0 +1,365 @@
+"""
+DBSCAN on TPs, for checking TAs and for making reference TAs offline.
+
+TPs are clustered on (time_start / 100, channel) with a Euclidean
+neighborhood of radius eps that includes the TP itself. A TP with at
+least min_pts neighbors is a core point. Non-core TPs next to a core
+point are border points, and the rest are noise. These are the same
+semantics that dbscan-definition-check.py verifies TAs against.
+
+TAMaker runs the same clustering over a time-sorted TP stream. It keeps
+an active window of recent TPs and emits a cluster as a TA once no later
+TP can change it.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from daq_utils.flat_taps import FlatTAPs
+
+
+# trgtools TPReader TriggerPrimitive layout.
+TP_DT = np.dtype([
+    ('adc_integral', np.uint32),
+    ('adc_peak', np.uint32),
+    ('algorithm', np.uint8),
+    ('channel', np.int32),
+    ('detid', np.uint16),
+    ('flag', np.uint16),
+    ('time_over_threshold', np.uint64),
+    ('time_peak', np.uint64),
+    ('time_start', np.uint64),
+    ('type', np.uint8),
+    ('version', np.uint16),
+])
+
+# trgtools TAReader TriggerActivity layout.
+TA_DT = np.dtype([
+    ('adc_integral', np.uint64),
+    ('adc_peak', np.uint64),
+    ('algorithm', np.uint8),
+    ('channel_end', np.int32),
+    ('channel_peak', np.int32),
+    ('channel_start', np.int32),
+    ('detid', np.uint16),
+    ('num_tps', np.uint64),
+    ('time_activity', np.uint64),
+    ('time_end', np.uint64),
+    ('time_peak', np.uint64),
+    ('time_start', np.uint64),
+    ('type', np.uint8),
+    ('version', np.uint16),
+])
+
+TIME_SCALE = 100  # Ticks per unit of clustering time.
+
+
+def get_hits(tps: np.ndarray, origin: Optional[int] = None) -> np.ndarray:
+    """
+    Get the (time, channel) positions that DBSCAN clusters on.
+
+    Parameters:
+        tps (np.ndarray): TPs to position.
+        origin (int): Time to measure from. Defaults to the earliest time_start.
+
+    Returns an (N, 2) array of relative time (100 ticks) and channel.
+    """
+    if origin is None:
+        origin = np.min(tps['time_start'])
+    time = (tps['time_start'].astype(np.int64) - np.int64(origin)) / TIME_SCALE
+    channel = tps['channel']
+    return np.array([time, channel], dtype=float).T
+
+
+def get_neighbor_pairs(hits: np.ndarray, eps: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find every pair of hits within eps of each other.
+
+    Hits are binned on a grid with cell width eps, so a hit's
+    neighbors can only be in its own cell or the 8 surrounding
+    cells. Each of those 9 cells is probed for all hits at once.
+
+    Parameters:
+        hits (np.ndarray): (N, 2) array of hit positions.
+        eps (float): Neighborhood radius.
+
+    Returns the (src, dst) indices of each neighboring pair. Both
+    orderings of a pair are included, as is each hit with itself.
+    """
+    num_hits = len(hits)
+    if num_hits == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    cells = np.floor(hits / eps).astype(np.int64)
+    cells -= np.min(cells, axis=0)
+    # Padding by 1 on each side keeps the +-1 probes from wrapping into other rows.
+    width = np.max(cells[:, 1]) + 3
+    keys = (cells[:, 0] + 1) * width + (cells[:, 1] + 1)
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    src = []
+    dst = []
+    for dt in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            probe = keys + dt * width + dc
+            lo = np.searchsorted(sorted_keys, probe, side='left')
+            hi = np.searchsorted(sorted_keys, probe, side='right')
+            counts = hi - lo
+            total = np.sum(counts)
+            if total == 0:
+                continue
+            # Expand each [lo, hi) range into explicit positions in sorted order.
+            run_starts = np.cumsum(counts) - counts
+            positions = np.arange(total) - np.repeat(run_starts - lo, counts)
+            src.append(np.repeat(np.arange(num_hits), counts))
+            dst.append(order[positions])
+
+    src = np.concatenate(src)
+    dst = np.concatenate(dst)
+    diff = hits[src] - hits[dst]
+    close = np.sum(diff * diff, axis=1) <= eps**2
+    return src[close], dst[close]
+
+
+def connected_labels(src: np.ndarray, dst: np.ndarray, members: np.ndarray) -> np.ndarray:
+    """
+    Label the connected components among the member hits.
+
+    Parameters:
+        src (np.ndarray): Source index of each edge.
+        dst (np.ndarray): Destination index of each edge.
+        members (np.ndarray): Boolean mask of hits to connect.
+
+    Returns the lowest member index in each member's component. -1 for non-members.
+    """
+    edges = members[src] & members[dst]
+    src = src[edges]
+    dst = dst[edges]
+
+    # Min-label propagation with pointer jumping.
+    labels = np.arange(len(members))
+    while True:
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, src, labels[dst])
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return np.where(members, labels, -1)
+
+
+def count_clusters(src: np.ndarray, dst: np.ndarray, members: np.ndarray) -> int:
+    """
+    Count the connected components among the member hits.
+
+    Parameters:
+        src (np.ndarray): Source index of each edge.
+        dst (np.ndarray): Destination index of each edge.
+        members (np.ndarray): Boolean mask of hits to connect.
+
+    Returns the number of connected components of the member hits.
+    """
+    if not np.any(members):
+        return 0
+    labels = connected_labels(src, dst, members)
+    return len(np.unique(labels[members]))
+
+
+def label_dbscan(tps: np.ndarray, eps: float, min_pts: int, hits: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Label each TP as a core, border, or noise point.
+
+    A TP's neighborhood includes itself.
+
+    Parameters:
+        tps (np.ndarray): TPs to label.
+        eps (float): Neighborhood radius.
+        min_pts (int): Minimum neighborhood size for a core point.
+        hits (np.ndarray): Positions of the TPs. Defaults to get_hits(tps).
+
+    Returns the boolean core and border masks and the neighbor pairs.
+    Noise points are neither core nor border.
+    """
+    if hits is None:
+        hits = get_hits(tps)
+    src, dst = get_neighbor_pairs(hits, eps)
+    neighbor_count = np.bincount(src, minlength=len(tps))
+    core = neighbor_count >= min_pts
+
+    near_core = np.zeros(len(tps), dtype=bool)
+    near_core[src[core[dst] & (src != dst)]] = True
+    border = ~core & near_core
+    return core, border, src, dst
+
+
+def cluster_dbscan(tps: np.ndarray, eps: float, min_pts: int, hits: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Assign each TP to a DBSCAN cluster.
+
+    A border point next to several clusters joins the one with the
+    earliest core point.
+
+    Parameters:
+        tps (np.ndarray): TPs to cluster.
+        eps (float): Neighborhood radius.
+        min_pts (int): Minimum neighborhood size for a core point.
+        hits (np.ndarray): Positions of the TPs. Defaults to get_hits(tps).
+
+    Returns the cluster label of each TP: the index of the first core
+    point of its cluster, or -1 for noise.
+    """
+    core, border, src, dst = label_dbscan(tps, eps, min_pts, hits)
+    labels = connected_labels(src, dst, core)
+
+    to_core = border[src] & core[dst]
+    border_labels = np.full(len(tps), len(tps), dtype=np.int64)
+    np.minimum.at(border_labels, src[to_core], labels[dst[to_core]])
+    labels[border] = border_labels[border]
+    return labels
+
+
+def make_tas(taps: FlatTAPs, ta_dtype: np.dtype = TA_DT) -> np.ndarray:
+    """
+    Fill in TAs from their TPs.
+
+    The times, channels, and ADC values follow the TAReader TAs: time_start
+    and time_end are the time_start of the first and last TP, and the peak
+    is the first TP with the largest adc_peak. Fields that the TPs do not
+    determine, e.g. algorithm and type, are left at 0.
+
+    Parameters:
+        taps (FlatTAPs): Time-sorted TPs of each TA.
+        ta_dtype (np.dtype): TA layout to fill.
+
+    Returns one TA per entry of taps.
+    """
+    tas = np.zeros(len(taps), dtype=ta_dtype)
+    if len(taps) == 0:
+        return tas
+    peak = taps.argmax('adc_peak')
+    values = {
+        'time_start': taps.first('time_start'),
+        'time_end': taps.last('time_start'),
+        'time_peak': taps.taps['time_peak'][peak],
+        'time_activity': taps.taps['time_peak'][peak],
+        'channel_start': taps.min('channel'),
+        'channel_end': taps.max('channel'),
+        'channel_peak': taps.taps['channel'][peak],
+        'adc_integral': taps.sum('adc_integral'),
+        'adc_peak': taps.max('adc_peak'),
+        'num_tps': taps.counts,
+    }
+    if 'detid' in taps.taps.dtype.names:
+        values['detid'] = taps.first('detid')
+    for field, value in values.items():
+        if field in tas.dtype.names:
+            tas[field] = value
+    return tas
+
+
+class TAMaker:
+    """
+    Make TAs by DBSCAN over a time-sorted TP stream.
+
+    TPs are added in chunks (e.g. one fragment at a time). Only the active
+    window is kept between chunks: TPs of clusters that may still grow and
+    the TPs within reach of them. Clusters are emitted once every TP in
+    them is more than 2 * eps before the latest TP. After that, no later
+    TP can make any of them core or connect them to another cluster.
+    """
+
+    def __init__(self, eps: float, min_pts: int, ta_dtype: np.dtype = TA_DT, tp_dtype: np.dtype = TP_DT) -> None:
+        """
+        Parameters:
+            eps (float): Neighborhood radius, in (time_start / 100, channel) units.
+            min_pts (int): Minimum neighborhood size for a core point, itself included.
+            ta_dtype (np.dtype): TA layout to emit.
+            tp_dtype (np.dtype): TP layout of the TAs' TPs when no TPs were added.
+                Once TPs are added, their layout is used.
+        """
+        self.eps = eps
+        self.min_pts = min_pts
+        self.ta_dtype = ta_dtype
+        self.tp_dtype = tp_dtype
+        self.origin = None
+        self.tps = None
+        self.emitted = None  # TPs in the window that already belong to an emitted TA.
+
+    def add(self, tps: np.ndarray) -> tuple[np.ndarray, FlatTAPs]:
+        """
+        Add the next TPs of the stream.
+
+        Parameter:
+            tps (np.ndarray): TPs that are not earlier than the TPs already added.
+
+        Returns the TAs completed by these TPs and their TPs.
+        """
+        self.tp_dtype = tps.dtype
+        if self.tps is None:
+            if len(tps) == 0:
+                return self._emit(tps, np.array([], dtype=np.int64))
+            self.origin = int(np.min(tps['time_start']))
+            self.tps = tps[:0]
+            self.emitted = np.zeros(0, dtype=bool)
+        return self._process(tps, final=False)
+
+    def flush(self) -> tuple[np.ndarray, FlatTAPs]:
+        """
+        Emit every cluster left in the active window and reset the maker.
+
+        Returns the remaining TAs and their TPs.
+        """
+        if self.tps is None:
+            return self._emit(np.zeros(0, dtype=self.tp_dtype), np.array([], dtype=np.int64))
+        result = self._process(self.tps[:0], final=True)
+        self.origin = self.tps = self.emitted = None
+        return result
+
+    def _process(self, tps: np.ndarray, final: bool) -> tuple[np.ndarray, FlatTAPs]:
+        window = np.concatenate((self.tps, tps))
+        emitted = np.concatenate((self.emitted, np.zeros(len(tps), dtype=bool)))
+        order = np.argsort(window['time_start'], kind='stable')
+        window, emitted = window[order], emitted[order]
+        if len(window) == 0:
+            return self._emit(window, np.array([], dtype=np.int64))
+
+        hits = get_hits(window, self.origin)
+        labels = cluster_dbscan(window, self.eps, self.min_pts, hits)
+        # TPs of emitted TAs are only context for their neighbors.
+        labels[emitted] = -1
+
+        times = hits[:, 0]
+        clustered = labels >= 0
+        last_time = np.full(len(window), -np.inf)
+        np.maximum.at(last_time, labels[clustered], times[clustered])
+        if final:
+            done = clustered
+        else:
+            done = clustered & (last_time[np.maximum(labels, 0)] < times[-1] - 2 * self.eps)
+
+        # Keep the open clusters and everything within reach of the newest TPs.
+        keep_from = times[-1] - 3 * self.eps
+        open_clusters = clustered & ~done
+        if np.any(open_clusters):
+            keep_from = min(keep_from, np.min(times[open_clusters]) - self.eps)
+        keep = times >= keep_from
+        self.tps = window[keep]
+        self.emitted = (emitted | done)[keep]
+
+        return self._emit(window[done], labels[done])
+
+    def _emit(self, tps: np.ndarray, labels: np.ndarray) -> tuple[np.ndarray, FlatTAPs]:
+        """
+        Group time-sorted TPs by cluster into TAs, in order of their first TP.
+        """
+        # Labels are first-core indices, so a stable sort groups clusters in time order.
+        order = np.argsort(labels, kind='stable')
+        _, counts = np.unique(labels[order], return_counts=True)
+        first = np.cumsum(counts) - counts
+        by_start = np.argsort(order[first], kind='stable')
+
+        taps = FlatTAPs.from_counts(tps[order], counts)[by_start]
+        return make_tas(taps, self.ta_dtype), taps
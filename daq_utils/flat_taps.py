@@ -0,0 +1,189 @@
+"""
+Flat storage for the TPs of many TAs.
+
+TAReader.tp_data is a list with one small array per TA, which leaves
+Python loops as the only way to work on it. FlatTAPs keeps every TAP
+in one contiguous structured array plus an offsets array, so that
+TA i owns taps[offsets[i]:offsets[i+1]]. Per-TA reductions are then
+single NumPy segment reductions over the whole array.
+"""
+
+from typing import Iterator, Optional
+
+import numpy as np
+
+
+class FlatTAPs:
+    """
+    The TPs of many TAs in one array with an offset index.
+
+    Indexing with an int gives that TA's TPs as a view. Indexing with
+    a slice, an index array, or a boolean mask gives a new FlatTAPs.
+    """
+
+    def __init__(self, taps: np.ndarray, offsets: np.ndarray) -> None:
+        """
+        Parameters:
+            taps (np.ndarray): TPs of all TAs, in TA order.
+            offsets (np.ndarray): Offsets of length (number of TAs + 1), starting at 0.
+        """
+        self.taps = taps
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_list(cls, tp_data: list[np.ndarray], dtype: Optional[np.dtype] = None) -> "FlatTAPs":
+        """
+        Build from a list of TPs per TA, like TAReader.tp_data.
+
+        Parameters:
+            tp_data (list[np.ndarray]): TPs for each TA.
+            dtype (np.dtype): TP dtype to use if tp_data is empty.
+
+        Returns a FlatTAPs with a copy of the TPs.
+        """
+        counts = np.array([len(tps) for tps in tp_data], dtype=np.int64)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        if len(tp_data) > 0:
+            taps = np.concatenate(tp_data)
+        else:
+            taps = np.array([], dtype=dtype)
+        return cls(taps, offsets)
+
+    @classmethod
+    def from_counts(cls, taps: np.ndarray, counts: np.ndarray) -> "FlatTAPs":
+        """
+        Build from flat TPs and the number of TPs in each TA.
+        """
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(taps, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for idx in range(len(self)):
+            yield self.taps[self.offsets[idx]:self.offsets[idx+1]]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError(f"TA index {key} out of range for {len(self)} TAs.")
+            return self.taps[self.offsets[key]:self.offsets[key+1]]
+
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, _ = key.indices(len(self))
+            stop = max(start, stop)
+            taps = self.taps[self.offsets[start]:self.offsets[stop]]
+            return FlatTAPs(taps, self.offsets[start:stop+1] - self.offsets[start])
+
+        ta_idx = np.arange(len(self))[key]
+        return self._gather(self.offsets[:-1][ta_idx], self.counts[ta_idx])
+
+    def _gather(self, starts: np.ndarray, counts: np.ndarray) -> "FlatTAPs":
+        """
+        Copy the TPs at taps[starts[i]:starts[i] + counts[i]] for each new TA i.
+        """
+        result = FlatTAPs.from_counts(None, counts)
+        positions = np.arange(result.offsets[-1]) + np.repeat(starts - result.offsets[:-1], counts)
+        result.taps = self.taps[positions]
+        return result
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Number of TPs in each TA.
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def ta_index(self) -> np.ndarray:
+        """
+        TA index of each TP.
+        """
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def slice_each(self, start: Optional[int] = None, stop: Optional[int] = None) -> "FlatTAPs":
+        """
+        Slice every TA's TPs with the same Python slice bounds.
+
+        Parameters:
+            start (int): Slice start within each TA. Negative counts from the end.
+            stop (int): Slice stop within each TA. Negative counts from the end.
+
+        Returns a new FlatTAPs where TA i has self[i][start:stop].
+        """
+        counts = self.counts
+
+        def bound(value, default):
+            if value is None:
+                return default
+            if value < 0:
+                return np.maximum(counts + value, 0)
+            return np.minimum(value, counts)
+
+        lo = bound(start, np.zeros_like(counts))
+        hi = bound(stop, counts)
+        return self._gather(self.offsets[:-1] + lo, np.maximum(hi - lo, 0))
+
+    def _reduce(self, ufunc: np.ufunc, values: np.ndarray, fill) -> np.ndarray:
+        counts = self.counts
+        non_empty = counts > 0
+        result = np.full(len(self), fill, dtype=values.dtype)
+        if np.any(non_empty):
+            # reduceat needs non-empty segments.
+            result[non_empty] = ufunc.reduceat(values, self.offsets[:-1][non_empty])
+        return result
+
+    def sum(self, field: str) -> np.ndarray:
+        """
+        Sum of a field over each TA. 0 for empty TAs.
+        Integer fields are summed in at least 64 bits.
+        """
+        values = self.taps[field]
+        if np.issubdtype(values.dtype, np.integer):
+            values = values.astype(np.uint64 if np.issubdtype(values.dtype, np.unsignedinteger) else np.int64)
+        return self._reduce(np.add, values, 0)
+
+    def min(self, field: str, fill=0) -> np.ndarray:
+        """
+        Minimum of a field over each TA. fill for empty TAs.
+        """
+        return self._reduce(np.minimum, self.taps[field], fill)
+
+    def max(self, field: str, fill=0) -> np.ndarray:
+        """
+        Maximum of a field over each TA. fill for empty TAs.
+        """
+        return self._reduce(np.maximum, self.taps[field], fill)
+
+    def argmax(self, field: str) -> np.ndarray:
+        """
+        Index into taps of the first TP with the largest field value in each TA.
+        -1 for empty TAs.
+        """
+        values = self.taps[field]
+        is_max = values == np.repeat(self.max(field), self.counts)
+        index = np.where(is_max, np.arange(len(values)), len(values))
+        return self._reduce(np.minimum, index, -1)
+
+    def first(self, field: str, fill=0) -> np.ndarray:
+        """
+        Field value of the first TP in each TA. fill for empty TAs.
+        """
+        return self._pick(self.offsets[:-1], field, fill)
+
+    def last(self, field: str, fill=0) -> np.ndarray:
+        """
+        Field value of the last TP in each TA. fill for empty TAs.
+        """
+        return self._pick(self.offsets[1:] - 1, field, fill)
+
+    def _pick(self, index: np.ndarray, field: str, fill) -> np.ndarray:
+        non_empty = self.counts > 0
+        result = np.full(len(self), fill, dtype=self.taps[field].dtype)
+        result[non_empty] = self.taps[field][index[non_empty]]
+        return result
@@ -0,0 +1,272 @@
+"""
+Cache decoded fragments across readers and runs of the scripts.
+
+Decoding a fragment through hdf5libs is the slow part of most scripts,
+and the same fragments are read again by the TP and TA readers of one
+script, by the next script, and by the next run of the same script.
+open_reader can wrap a trgtools reader so that read_fragment goes
+through a process-local cache first:
+
+    Memory: An LRU bounded by the total bytes of the cached arrays.
+            $DAQ_UTILS_FRAGMENT_CACHE_MB sets the bound of FRAGMENT_CACHE
+            (default 0, off).
+    Disk:   With $DAQ_UTILS_FRAGMENT_DISK_CACHE=1, decoded arrays are also
+            saved as .npy files in <get_cache_dir()>/fragments and loaded
+            instead of decoding on later runs. Entries are keyed by the
+            file's path and mtime, so a rewritten file is decoded again.
+
+Both are off by default, so a single pass over a file, and every
+map_fragments worker, keeps only the fragment it is reading. Scripts
+that read the same fragments again, like the browsers, ask for
+rereading_cache instead.
+
+Entries are keyed by (file, fragment path, reader type). Cached arrays
+are shared, so a reader opened with a cache returns them read-only.
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+from daq_utils.header_index import get_cache_dir
+
+
+# Data members filled by each reader type: the fragment's objects and,
+# for TA and TC readers, the list of member objects per object.
+READER_MEMBERS = {
+    "TPReader": ("tp_data", None),
+    "TAReader": ("ta_data", "tp_data"),
+    "TCReader": ("tc_data", "ta_data"),
+}
+
+
+def get_reader_type(reader) -> str:
+    """
+    Get the trgtools reader type of a reader, e.g. "TAReader" for a TAReader or a stand-in for one.
+    """
+    name = type(reader).__name__
+    for reader_type in READER_MEMBERS:
+        if name.endswith(reader_type):
+            return reader_type
+    raise ValueError(f"Unknown reader type: {name}")
+
+
+def _nbytes(entry: tuple[np.ndarray, list[np.ndarray]]) -> int:
+    objects, members = entry
+    return objects.nbytes + sum(member.nbytes for member in members)
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+class FragmentCache:
+    """
+    Decoded fragments by (file, fragment path, reader type).
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20, cache_dir: Optional[str] = None) -> None:
+        """
+        Parameters:
+            max_bytes (int): Bound on the bytes of arrays kept in memory.
+            cache_dir (str): Directory for the on-disk cache. None keeps the cache in memory only.
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._file_dirs = {}
+
+    def _disk_dir(self, key: tuple[str, str, str]) -> str:
+        file, path, reader_type = key
+        if file not in self._file_dirs:
+            source = f"{file}:{os.path.getmtime(file)}"
+            self._file_dirs[file] = hashlib.sha1(source.encode()).hexdigest()[:16]
+        digest = hashlib.sha1(path.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, "fragments", f"{os.path.basename(file)}.{self._file_dirs[file]}",
+                            reader_type, digest)
+
+    def _load(self, key: tuple[str, str, str]) -> Optional[tuple[np.ndarray, list[np.ndarray]]]:
+        entry_dir = self._disk_dir(key)
+        if not os.path.exists(os.path.join(entry_dir, "offsets.npy")):
+            return None
+        objects = np.load(os.path.join(entry_dir, "objects.npy"))
+        offsets = np.load(os.path.join(entry_dir, "offsets.npy"))
+        if len(offsets) == 0:
+            return objects, []
+        members = np.load(os.path.join(entry_dir, "members.npy"))
+        return objects, [members[lo:hi] for lo, hi in zip(offsets[:-1], offsets[1:])]
+
+    def _save(self, key: tuple[str, str, str], entry: tuple[np.ndarray, list[np.ndarray]]) -> None:
+        objects, members = entry
+        entry_dir = self._disk_dir(key)
+        if os.path.exists(os.path.join(entry_dir, "offsets.npy")):
+            return
+        os.makedirs(entry_dir, exist_ok=True)
+        arrays = {"objects": objects}
+        if len(members) > 0:
+            arrays["members"] = np.concatenate(members)
+            arrays["offsets"] = np.concatenate(([0], np.cumsum([len(member) for member in members])))
+        else:
+            arrays["offsets"] = np.zeros(0, dtype=np.int64)
+        # Write then rename so a reader never loads a partial file.
+        # offsets.npy marks a complete entry, so it is written last.
+        for name, array in arrays.items():
+            tmp_path = os.path.join(entry_dir, f"{name}.{os.getpid()}.{threading.get_ident()}.tmp.npy")
+            np.save(tmp_path, array)
+            os.replace(tmp_path, os.path.join(entry_dir, f"{name}.npy"))
+
+    def _add(self, key: tuple[str, str, str], entry: tuple[np.ndarray, list[np.ndarray]]) -> None:
+        size = _nbytes(entry)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            return
+        self._entries[key] = entry
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= _nbytes(evicted)
+
+    def get(self, key: tuple[str, str, str]) -> Optional[tuple[np.ndarray, list[np.ndarray]]]:
+        """
+        Get a cached fragment's objects and members, from memory or disk, or None.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.cache_dir is None:
+            return None
+        entry = self._load(key)
+        if entry is None:
+            return None
+        entry = (_read_only(entry[0]), [_read_only(member) for member in entry[1]])
+        with self._lock:
+            self.disk_hits += 1
+            self._add(key, entry)
+        return entry
+
+    def put(self, key: tuple[str, str, str], objects: np.ndarray, members: list[np.ndarray]) -> tuple[np.ndarray, list[np.ndarray]]:
+        """
+        Cache a decoded fragment.
+
+        Returns the cached, read-only entry.
+        """
+        entry = (_read_only(objects), [_read_only(member) for member in members])
+        with self._lock:
+            self.misses += 1
+            self._add(key, entry)
+        if self.cache_dir is not None:
+            self._save(key, entry)
+        return entry
+
+    def clear(self) -> None:
+        """
+        Empty the memory cache. The disk cache is kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+FRAGMENT_CACHE = FragmentCache(
+    max_bytes=int(float(os.environ.get("DAQ_UTILS_FRAGMENT_CACHE_MB", 0)) * 2**20),
+    cache_dir=get_cache_dir() if os.environ.get("DAQ_UTILS_FRAGMENT_DISK_CACHE", "0") == "1" else None,
+)
+
+# Memory bound of rereading_cache when $DAQ_UTILS_FRAGMENT_CACHE_MB is not set.
+REREADING_CACHE_MB = 256
+
+_rereading_cache = None
+
+
+def rereading_cache() -> FragmentCache:
+    """
+    Get the cache for scripts that read the same fragments more than once, e.g. browsers.
+
+    FRAGMENT_CACHE if $DAQ_UTILS_FRAGMENT_CACHE_MB enables its memory
+    cache, otherwise one memory cache of REREADING_CACHE_MB per process
+    that shares FRAGMENT_CACHE's disk cache.
+    """
+    global _rereading_cache
+    if FRAGMENT_CACHE.max_bytes > 0:
+        return FRAGMENT_CACHE
+    if _rereading_cache is None:
+        _rereading_cache = FragmentCache(REREADING_CACHE_MB * 2**20, cache_dir=FRAGMENT_CACHE.cache_dir)
+    return _rereading_cache
+
+
+class CachedReader:
+    """
+    A trgtools reader whose read_fragment goes through a FragmentCache.
+
+    Everything else is passed on to the wrapped reader. Like the reader,
+    read_fragment adds to the data members until clear_data is called.
+    """
+
+    def __init__(self, reader, file: str, cache: FragmentCache = FRAGMENT_CACHE) -> None:
+        self.reader = reader
+        self.file = os.path.abspath(file)
+        self.cache = cache
+        self.reader_type = get_reader_type(reader)
+        self._objects_name, self._members_name = READER_MEMBERS[self.reader_type]
+        self._empty = getattr(reader, self._objects_name)[:0]
+        self.clear_data()
+
+    def __getattr__(self, name: str):
+        return getattr(self.reader, name)
+
+    def read_fragment(self, fragment_path: str) -> np.ndarray:
+        key = (self.file, fragment_path, self.reader_type)
+        entry = self.cache.get(key)
+        if entry is None:
+            _ = self.reader.read_fragment(fragment_path)
+            objects = getattr(self.reader, self._objects_name)
+            members = list(getattr(self.reader, self._members_name)) if self._members_name else []
+            self.reader.clear_data()
+            entry = self.cache.put(key, objects, members)
+        objects, members = entry
+
+        setattr(self, self._objects_name, np.concatenate((getattr(self, self._objects_name), objects)))
+        if self._members_name is not None:
+            getattr(self, self._members_name).extend(members)
+        return objects
+
+    def read_all_fragments(self) -> None:
+        for fragment_path in self.reader.get_fragment_paths():
+            _ = self.read_fragment(fragment_path)
+
+    def clear_data(self) -> None:
+        setattr(self, self._objects_name, self._empty)
+        if self._members_name is not None:
+            setattr(self, self._members_name, [])
+
+
+def open_reader(reader_type, file: str, cache: Optional[FragmentCache] = FRAGMENT_CACHE):
+    """
+    Open a reader on a file, reading fragments through a cache.
+
+    Parameters:
+        reader_type: Reader class, e.g. trgtools.TPReader.
+        file (str): HDF5 file to read.
+        cache (FragmentCache): Cache to use. Defaults to FRAGMENT_CACHE,
+            which is off unless enabled by the environment. None, or a
+            memory bound of 0 with no disk cache, opens the plain reader.
+
+    Returns the reader.
+    """
+    reader = reader_type(file)
+    if cache is None or (cache.max_bytes <= 0 and cache.cache_dir is None):
+        return reader
+    return CachedReader(reader, file, cache)
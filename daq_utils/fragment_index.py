@@ -0,0 +1,167 @@
+"""
+Pair the fragments of a file by TriggerRecord.
+
+Fragment paths look like
+    /TriggerRecord00012.0000/RawData/Detector_Readout_0x00000064_Trigger_Primitive
+    /TriggerRecord00012.0000/RawData/Trigger_0x00000001_Trigger_Activity
+and give the record number, sequence number, subsystem, source ID, and
+fragment type. A FragmentIndex parses every path of the given readers
+once and maps each record to its fragments of each kind, so finding the
+TA fragment of a record, or the TP fragments that go with a TA
+fragment, is a dictionary lookup instead of index arithmetic that
+assumes a fixed number of readout units.
+
+Kinds:
+    readout_tp: TP fragments from the readout (Detector_Readout) subsystem.
+    trigger_tp: TP fragments from the trigger subsystem.
+    ta:         TA fragments.
+    tc:         TC fragments.
+Other fragments are kept under "<subsystem>_<fragment type>".
+"""
+
+import re
+from collections import defaultdict
+from typing import Optional
+
+FRAGMENT_PATH_REGEX = re.compile(r'TriggerRecord(\d+)\.(\d+)/RawData/(\w+?)_0x([0-9a-fA-F]+)_(\w+)$')
+
+KINDS = {
+    ("Detector_Readout", "Trigger_Primitive"): "readout_tp",
+    ("Trigger", "Trigger_Primitive"): "trigger_tp",
+    ("Trigger", "Trigger_Activity"): "ta",
+    ("Trigger", "Trigger_Candidate"): "tc",
+}
+
+
+def parse_fragment_path(path: str) -> dict:
+    """
+    Parse a fragment path.
+
+    Parameter:
+        path (str): Fragment path from get_fragment_paths().
+
+    Returns a dictionary of the record, sequence, subsystem, source_id,
+    fragment_type, and kind. Raises ValueError if the path is not a
+    fragment path.
+    """
+    match = FRAGMENT_PATH_REGEX.search(path)
+    if match is None:
+        raise ValueError(f"Not a fragment path: {path}")
+    record, sequence, subsystem, source_id, fragment_type = match.groups()
+    return {
+        "record": int(record),
+        "sequence": int(sequence),
+        "subsystem": subsystem,
+        "source_id": int(source_id, 16),
+        "fragment_type": fragment_type,
+        "kind": KINDS.get((subsystem, fragment_type), f"{subsystem}_{fragment_type}"),
+    }
+
+
+class FragmentIndex:
+    """
+    The fragments of each TriggerRecord, by kind.
+
+    Records are keyed by (record, sequence) and kept in that order. The
+    paths of a kind in a record are sorted by source ID.
+    """
+
+    def __init__(self, paths: list[str]) -> None:
+        self._fragments = defaultdict(lambda: defaultdict(list))
+        self._parsed = {}
+        for path in paths:
+            if path in self._parsed:
+                continue
+            parsed = parse_fragment_path(path)
+            self._parsed[path] = parsed
+            key = (parsed["record"], parsed["sequence"])
+            self._fragments[key][parsed["kind"]].append(path)
+
+        for kinds in self._fragments.values():
+            for kind_paths in kinds.values():
+                kind_paths.sort(key=lambda path: self._parsed[path]["source_id"])
+        self.records = sorted(self._fragments)
+
+    @classmethod
+    def from_readers(cls, *readers) -> "FragmentIndex":
+        """
+        Index the fragment paths of every given reader.
+        """
+        return cls([path for reader in readers for path in reader.get_fragment_paths()])
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def parse(self, path: str) -> dict:
+        """
+        Get the parsed fields of an indexed path. See parse_fragment_path.
+        """
+        return self._parsed[path]
+
+    def record_of(self, path: str) -> tuple[int, int]:
+        """
+        Get the (record, sequence) key of an indexed path.
+        """
+        parsed = self._parsed[path]
+        return parsed["record"], parsed["sequence"]
+
+    def get(self, record: tuple[int, int], kind: str) -> list[str]:
+        """
+        Get the paths of a kind in a record, sorted by source ID.
+        """
+        if record not in self._fragments:
+            return []
+        return list(self._fragments[record].get(kind, []))
+
+    def first(self, record: tuple[int, int], kind: str) -> Optional[str]:
+        """
+        Get the path of a kind in a record with the lowest source ID, or None.
+        """
+        paths = self.get(record, kind)
+        return paths[0] if len(paths) > 0 else None
+
+    def records_with(self, *kinds: str) -> list[tuple[int, int]]:
+        """
+        Get the records that have fragments of every given kind, in order.
+        """
+        return [record for record in self.records
+                if all(len(self._fragments[record].get(kind, [])) > 0 for kind in kinds)]
+
+    def join(self, *kinds: str) -> list[tuple[str, ...]]:
+        """
+        Pair the fragments of the given kinds in every record that has all of them.
+
+        For kinds with one fragment per record, e.g. "trigger_tp" and "ta".
+        Use group for kinds with several sources, e.g. "readout_tp".
+
+        Returns one tuple of paths per record, in the order of kinds.
+        Raises ValueError if a record has more than one fragment of a kind.
+        """
+        path_tuples = []
+        for record, paths in zip(self.records_with(*kinds), self.group(*kinds)):
+            for kind, kind_paths in zip(kinds, paths):
+                if len(kind_paths) > 1:
+                    raise ValueError(f"TriggerRecord {record[0]}.{record[1]:04} has {len(kind_paths)} {kind} fragments. "
+                                     "Use group to get every source.")
+            path_tuples.append(tuple(kind_paths[0] for kind_paths in paths))
+        return path_tuples
+
+    def group(self, *kinds: str) -> list[tuple[tuple[str, ...], ...]]:
+        """
+        Group the fragments of the given kinds in every record that has all of them.
+
+        Returns one tuple per record, in the order of kinds, of the
+        record's paths of each kind sorted by source ID.
+        """
+        return [tuple(tuple(self.get(record, kind)) for kind in kinds) for record in self.records_with(*kinds)]
+
+    def paths(self, kind: str, records: Optional[list[tuple[int, int]]] = None) -> list[str]:
+        """
+        Get every path of a kind, in record then source ID order.
+        """
+        if records is None:
+            records = self.records
+        return [path for record in records for path in self.get(record, kind)]
@@ -0,0 +1,208 @@
+"""
+Index of fragment header fields, cached on disk.
+
+Reading a fragment through hdf5libs pulls its whole payload, even when
+only the window or the payload size is needed. This builds an index
+of every fragment's header fields once, saves it in a cache directory
+keyed by the file path, reader type, and file mtime, and loads it on
+later calls.
+
+When h5py is available, only the first FRAGMENT_HEADER_DT.itemsize
+bytes of each fragment dataset are read. Otherwise the fragments are
+read through the reader's HDF5RawDataFile.
+
+The object count of a TP fragment comes from its payload size, since
+TPs have a fixed size. TAs and TCs do not, so their counts are only
+filled in when asked for with counts=True, which decodes every one of
+the reader's fragments once. That build costs as much as reading the
+whole file; later calls load the cached index. Without counts, a TA
+or TC fragment's count is -1. An empty fragment still shows up as a
+payload_size of 0.
+"""
+
+import hashlib
+import os
+from typing import Optional
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+# daqdataformats FragmentHeader (version 5) with its SourceID.
+FRAGMENT_HEADER_DT = np.dtype([
+    ('fragment_header_marker', np.uint32),
+    ('version', np.uint32),
+    ('size', np.uint64),
+    ('trigger_number', np.uint64),
+    ('trigger_timestamp', np.uint64),
+    ('window_begin', np.uint64),
+    ('window_end', np.uint64),
+    ('run_number', np.uint32),
+    ('error_bits', np.uint32),
+    ('fragment_type', np.uint32),
+    ('sequence_number', np.uint16),
+    ('detector_id', np.uint16),
+    ('source_version', np.uint16),
+    ('source_subsystem', np.uint16),
+    ('source_id', np.uint32),
+])
+FRAGMENT_HEADER_MARKER = 0x11112222
+
+INDEX_FIELDS = [
+    ('window_begin', np.uint64),
+    ('window_end', np.uint64),
+    ('trigger_number', np.uint64),
+    ('sequence_number', np.uint16),
+    ('source_subsystem', np.uint16),
+    ('source_id', np.uint32),
+    ('payload_size', np.uint64),
+    ('object_count', np.int64),
+]
+
+
+def get_cache_dir() -> str:
+    """
+    Get the directory for cached files.
+
+    Uses $DAQ_UTILS_CACHE if set, otherwise ~/.cache/daq-testing-scripts.
+    """
+    default = os.path.join(os.path.expanduser("~"), ".cache", "daq-testing-scripts")
+    return os.environ.get("DAQ_UTILS_CACHE", default)
+
+
+def get_reader_name(reader) -> str:
+    """
+    Get the name of a reader's type, e.g. "TPReader".
+
+    Wrappers such as fragment_cache.CachedReader give the type they wrap as reader_type.
+    """
+    return getattr(reader, "reader_type", type(reader).__name__)
+
+
+def _index_path(file: str, reader_name: str, cache_dir: str) -> str:
+    digest = hashlib.sha1(f"{file}:{reader_name}".encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "headers", f"{os.path.basename(file)}.{reader_name}.{digest}.npz")
+
+
+def _read_headers_h5py(file: str, paths: list[str]) -> np.ndarray:
+    headers = np.zeros(len(paths), dtype=FRAGMENT_HEADER_DT)
+    with h5py.File(file, 'r') as h5_file:
+        for idx, path in enumerate(paths):
+            raw = h5_file[path][:FRAGMENT_HEADER_DT.itemsize]
+            headers[idx] = np.frombuffer(raw.tobytes(), dtype=FRAGMENT_HEADER_DT)[0]
+    if np.any(headers['fragment_header_marker'] != FRAGMENT_HEADER_MARKER):
+        raise ValueError(f"Unexpected fragment header layout in {file}.")
+    return headers
+
+
+def _read_headers_hdf5libs(reader, paths: list[str]) -> np.ndarray:
+    headers = np.zeros(len(paths), dtype=FRAGMENT_HEADER_DT)
+    for idx, path in enumerate(paths):
+        frag = reader._h5_file.get_frag(path)
+        source = frag.get_element_id()
+        headers[idx]['size'] = frag.get_size()
+        headers[idx]['trigger_number'] = frag.get_trigger_number()
+        headers[idx]['window_begin'] = frag.get_window_begin()
+        headers[idx]['window_end'] = frag.get_window_end()
+        headers[idx]['sequence_number'] = frag.get_sequence_number()
+        headers[idx]['source_subsystem'] = int(source.subsystem)
+        headers[idx]['source_id'] = source.id
+    return headers
+
+
+def _count_objects(reader, paths: list[str], payload_sizes: np.ndarray, counts: bool) -> np.ndarray:
+    """
+    Count the objects in each fragment.
+
+    TPs have a fixed size, so TP fragments are counted from their
+    payload size. TA and TC fragments have to be decoded, so they are
+    only counted with counts, and are -1 otherwise.
+    """
+    if get_reader_name(reader) == "TPReader":
+        import trgdataformats
+        return (payload_sizes // trgdataformats.TriggerPrimitive.sizeof()).astype(np.int64)
+    if not counts:
+        return np.full(len(paths), -1, dtype=np.int64)
+
+    counts = np.zeros(len(paths), dtype=np.int64)
+    for idx, path in enumerate(paths):
+        counts[idx] = len(reader.read_fragment(path))
+        reader.clear_data()
+    return counts
+
+
+def build_header_index(file: str, reader, counts: bool = False) -> np.ndarray:
+    """
+    Build the header index for every fragment path of the reader.
+
+    Parameters:
+        file (str): HDF5 file the reader was opened on.
+        reader (trgtools.HDF5Reader): TP, TA, or TC reader.
+        counts (bool): Decode every TA or TC fragment to count its objects.
+
+    Returns a structured array with a 'path' field and INDEX_FIELDS,
+    one entry per fragment path in the reader's order.
+    """
+    paths = list(reader.get_fragment_paths())
+    if h5py is not None:
+        headers = _read_headers_h5py(file, paths)
+    else:
+        headers = _read_headers_hdf5libs(reader, paths)
+
+    path_width = max((len(path) for path in paths), default=1)
+    index = np.zeros(len(paths), dtype=[('path', f'U{path_width}')] + INDEX_FIELDS)
+    index['path'] = paths
+    for name, _ in INDEX_FIELDS:
+        if name in FRAGMENT_HEADER_DT.names:
+            index[name] = headers[name]
+    index['payload_size'] = headers['size'] - FRAGMENT_HEADER_DT.itemsize
+    index['object_count'] = _count_objects(reader, paths, index['payload_size'], counts)
+    return index
+
+
+def get_header_index(file: str, reader, cache_dir: Optional[str] = None, rebuild: bool = False,
+                     counts: bool = False) -> np.ndarray:
+    """
+    Get the header index for a reader, building and caching it if needed.
+
+    The cached index is reused while the file's path and mtime are unchanged,
+    unless counts are asked for and it was built without them.
+    Building it reads every fragment's header, and with counts decodes every
+    fragment of a TA or TC reader, so it is for whole-file use, not a few fragments.
+
+    Parameters:
+        file (str): HDF5 file the reader was opened on.
+        reader (trgtools.HDF5Reader): TP, TA, or TC reader.
+        cache_dir (str): Cache directory. Defaults to get_cache_dir().
+        rebuild (bool): Ignore any cached index.
+        counts (bool): Fill in the object count of TA and TC fragments. See build_header_index.
+
+    Returns a structured array with a 'path' field and INDEX_FIELDS,
+    one entry per fragment path in the reader's order.
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    file = os.path.abspath(file)
+    mtime = os.path.getmtime(file)
+    index_path = _index_path(file, get_reader_name(reader), cache_dir)
+
+    if not rebuild and os.path.exists(index_path):
+        with np.load(index_path) as cached:
+            # Indexes cached before counts were optional always have them.
+            has_counts = 'counts' not in cached or bool(cached['counts'])
+            if cached['source'] == file and cached['mtime'] == mtime and (has_counts or not counts):
+                index = cached['index']
+                if list(index['path']) == list(reader.get_fragment_paths()):
+                    return index
+
+    index = build_header_index(file, reader, counts)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    # Write then rename so an interrupted build never leaves a partial index.
+    tmp_path = index_path + ".tmp.npz"
+    np.savez(tmp_path, index=index, source=np.array(file), mtime=np.array(mtime), counts=np.array(counts))
+    os.replace(tmp_path, index_path)
+    return index
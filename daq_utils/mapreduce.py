@@ -0,0 +1,213 @@
+"""
+Map a per-fragment function over a file and collect columnar results.
+
+The per-fragment function is given the readers and one tuple of
+fragment paths (e.g. a TP, TA, and TC path from the same record) and
+returns a dictionary of scalars. The results are gathered into one
+NumPy array per key, in the same order as the path tuples.
+reduce_fragments instead folds the results together as they arrive,
+e.g. summing per-channel counts, so only the running result is kept.
+
+With jobs > 1, the path tuples are split into chunks and handed to a
+process pool. Each worker opens its own readers once and reuses them
+for every chunk it is given. The per-fragment function must be
+picklable, i.e. defined at the top level of a module or script.
+
+map_files does the same across files, one task per file, for runs
+that are split over many files.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+import os
+from typing import Callable, Optional
+
+import numpy as np
+
+from daq_utils.fragment_cache import open_reader
+from daq_utils.profiling import phase
+
+
+# Readers opened by _open_readers in each worker process.
+_worker_readers = None
+
+
+def open_readers(file: str, reader_types: tuple) -> tuple:
+    """
+    Open one reader of each type on the file, reading fragments through
+    FRAGMENT_CACHE if the environment enables it.
+
+    Parameters:
+        file (str): HDF5 file to read.
+        reader_types (tuple): Reader classes, e.g. (trgtools.TPReader, trgtools.TAReader).
+
+    Returns a tuple of readers in the same order as reader_types.
+    """
+    with phase("open"):
+        return tuple(open_reader(reader_type, file) for reader_type in reader_types)
+
+
+def _open_readers(file: str, reader_types: tuple) -> None:
+    global _worker_readers
+    _worker_readers = open_readers(file, reader_types)
+
+
+def _map_chunk(func: Callable, chunk: list[tuple[str, ...]], readers: Optional[tuple] = None) -> list[dict]:
+    if readers is None:
+        readers = _worker_readers
+    results = []
+    for paths in chunk:
+        with phase("fragment"):
+            results.append(func(readers, paths))
+        for reader in readers:
+            reader.clear_data()
+    return results
+
+
+def to_columns(records: list[dict]) -> dict[str, np.ndarray]:
+    """
+    Turn a list of per-fragment records into columns.
+
+    Parameter:
+        records (list[dict]): Records that all share the same keys.
+
+    Returns a dictionary of key to an array of that key's values in record order.
+    The keys are only known from the records, so this is empty when there
+    are no records. Callers check for that before indexing the columns.
+    """
+    if len(records) == 0:
+        return {}
+    return {key: np.array([record[key] for record in records]) for key in records[0]}
+
+
+def map_fragments(func: Callable, file: str, reader_types: tuple, path_tuples: list[tuple[str, ...]],
+                  jobs: int = 1, chunk_size: Optional[int] = None) -> dict[str, np.ndarray]:
+    """
+    Apply func to every tuple of fragment paths and collect the results.
+
+    Parameters:
+        func (Callable): Called as func(readers, paths) and returns a dict of scalars.
+            The readers are cleared after each call.
+        file (str): HDF5 file to read.
+        reader_types (tuple): Reader classes to open, in the order func expects them.
+        path_tuples (list[tuple[str, ...]]): Fragment paths given to each call of func.
+        jobs (int): Number of worker processes. 1 runs in this process.
+        chunk_size (int): Number of path tuples per task. Defaults to 4 tasks per worker.
+
+    Returns a dictionary of key to an array of values in path tuple order.
+    Empty when there are no path tuples.
+    """
+    path_tuples = list(path_tuples)
+    if jobs <= 1:
+        readers = open_readers(file, reader_types)
+        return to_columns(_map_chunk(func, path_tuples, readers))
+
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(path_tuples) // (jobs * 4)))
+    chunks = [path_tuples[idx:idx+chunk_size] for idx in range(0, len(path_tuples), chunk_size)]
+
+    records = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_open_readers, initargs=(file, reader_types)) as executor:
+        for chunk_records in executor.map(partial(_map_chunk, func), chunks):
+            records.extend(chunk_records)
+    return to_columns(records)
+
+
+def _reduce_chunk(func: Callable, ops: dict[str, Callable], chunk: list[tuple[str, ...]],
+                  readers: Optional[tuple] = None) -> Optional[dict]:
+    if readers is None:
+        readers = _worker_readers
+    reduced = None
+    for paths in chunk:
+        with phase("fragment"):
+            result = func(readers, paths)
+        for reader in readers:
+            reader.clear_data()
+        reduced = combine(reduced, result, ops)
+    return reduced
+
+
+def combine(reduced: Optional[dict], result: Optional[dict], ops: dict[str, Callable]) -> Optional[dict]:
+    """
+    Fold one result into a running result, key by key.
+
+    Parameters:
+        reduced (dict): Running result, or None before the first result.
+        result (dict): Result to fold in, or None for nothing.
+        ops (dict[str, Callable]): Binary function of each key, e.g. np.maximum. np.add for other keys.
+
+    Returns the running result.
+    """
+    if result is None:
+        return reduced
+    if reduced is None:
+        return {key: np.copy(value) for key, value in result.items()}
+    return {key: ops.get(key, np.add)(value, result[key]) for key, value in reduced.items()}
+
+
+def reduce_fragments(func: Callable, file: str, reader_types: tuple, path_tuples: list[tuple[str, ...]],
+                     jobs: int = 1, chunk_size: Optional[int] = None,
+                     ops: Optional[dict[str, Callable]] = None) -> dict[str, np.ndarray]:
+    """
+    Apply func to every tuple of fragment paths and fold the results together.
+
+    Like map_fragments, but only the running result is kept instead of
+    every fragment's result. With jobs > 1, each worker folds its chunk
+    and the chunks are folded as they finish.
+
+    Parameters:
+        func (Callable): Called as func(readers, paths) and returns a dict of arrays or scalars.
+        file (str): HDF5 file to read.
+        reader_types (tuple): Reader classes to open, in the order func expects them.
+        path_tuples (list[tuple[str, ...]]): Fragment paths given to each call of func.
+        jobs (int): Number of worker processes. 1 runs in this process.
+        chunk_size (int): Number of path tuples per task. Defaults to 4 tasks per worker.
+        ops (dict[str, Callable]): Binary function that folds each key. Defaults to np.add.
+
+    Returns a dictionary of key to the folded value. Empty when there are no path tuples.
+    """
+    path_tuples = list(path_tuples)
+    ops = {} if ops is None else ops
+    if jobs <= 1:
+        readers = open_readers(file, reader_types)
+        reduced = _reduce_chunk(func, ops, path_tuples, readers)
+        return {} if reduced is None else reduced
+
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(path_tuples) // (jobs * 4)))
+    chunks = [path_tuples[idx:idx+chunk_size] for idx in range(0, len(path_tuples), chunk_size)]
+
+    reduced = None
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_open_readers, initargs=(file, reader_types)) as executor:
+        futures = [executor.submit(_reduce_chunk, func, ops, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            reduced = combine(reduced, future.result(), ops)
+    return {} if reduced is None else reduced
+
+
+def map_files(func: Callable, files: list[str], jobs: int = 1) -> list:
+    """
+    Apply func to every file.
+
+    With jobs > 1, each file is one task in a process pool. The largest
+    files are started first, so a run takes about as long as its largest
+    file when there are enough workers.
+
+    Parameters:
+        func (Callable): Called as func(file). Must be picklable.
+        files (list[str]): Files to process.
+        jobs (int): Number of worker processes. 1 runs in this process.
+
+    Returns func(file) of each file, in the order of files.
+    """
+    files = list(files)
+    if jobs <= 1 or len(files) <= 1:
+        return [func(file) for file in files]
+
+    order = sorted(range(len(files)), key=lambda idx: os.path.getsize(files[idx]), reverse=True)
+    results = [None] * len(files)
+    with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as executor:
+        futures = {executor.submit(func, files[idx]): idx for idx in order}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
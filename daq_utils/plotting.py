@@ -0,0 +1,189 @@
+"""
+Record plots during an analysis and render them afterwards.
+
+A PlotQueue collects calls to plot functions instead of making them, so
+the analysis loop does not wait on matplotlib. After the loop, the queue
+is either rendered, optionally in a process pool with the Agg backend,
+or only its data is written to an NPZ to be rendered later with
+render_saved, e.g. by render-plots.py on another machine.
+
+Plot functions must be defined at the top level of a script or module
+and take their data as keyword arguments: arrays, lists of numbers,
+strings, numbers, or flat dicts of those. Plot functions that draw on
+get_figure and finish with save_figure reuse one figure per size
+instead of making and closing a new one for every plot.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import importlib.util
+import inspect
+import json
+import multiprocessing
+import os
+import sys
+from typing import Callable, Optional
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+
+
+def get_figure(figsize: tuple[float, float] = (6, 4), dpi: int = 200) -> plt.Figure:
+    """
+    Get a cleared figure of this size and make it current.
+
+    The figure is made on the first call and reused on later calls
+    with the same size, so it must not be closed by the plot function.
+    """
+    return plt.figure(num=f"{figsize[0]}x{figsize[1]}@{dpi}", figsize=figsize, dpi=dpi, clear=True)
+
+
+def save_figure(save_name: str) -> None:
+    """
+    Save the current figure and clear it for the next plot.
+    """
+    plt.savefig(save_name)
+    plt.clf()
+
+
+def _encode(value, arrays: dict):
+    """
+    Turn one plot argument into JSON, moving arrays into arrays.
+    """
+    if isinstance(value, dict):
+        return {"dict": {key: _encode(item, arrays) for key, item in value.items()}}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return {"value": value}
+    if isinstance(value, (list, tuple)) and all(isinstance(item, str) for item in value):
+        return {"value": list(value)}
+    key = f"array_{len(arrays)}"
+    arrays[key] = np.asarray(value)
+    return {"array": key}
+
+
+def _decode(encoded: dict, arrays):
+    if "dict" in encoded:
+        return {key: _decode(item, arrays) for key, item in encoded["dict"].items()}
+    if "array" in encoded:
+        return arrays[encoded["array"]]
+    return encoded["value"]
+
+
+# Scripts loaded by _load_function, by file path.
+_loaded_scripts = {}
+
+
+def _load_function(file: str, name: str) -> Callable:
+    """
+    Find a plot function by the file it is defined in, e.g. a script
+    with a '-' in its name.
+    """
+    main = sys.modules.get("__main__")
+    if os.path.abspath(getattr(main, "__file__", "")) == file:
+        return getattr(main, name)
+    if file not in _loaded_scripts:
+        module_name = os.path.splitext(os.path.basename(file))[0].replace('-', '_')
+        spec = importlib.util.spec_from_file_location(module_name, file)
+        module = importlib.util.module_from_spec(spec)
+        # Registered so its functions can be pickled for the render workers.
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+        _loaded_scripts[file] = module
+    return getattr(_loaded_scripts[file], name)
+
+
+def _use_agg() -> None:
+    matplotlib.use("Agg")
+
+
+def _render(func: Callable, kwargs: dict) -> None:
+    func(**kwargs)
+
+
+class PlotQueue:
+    """
+    Plot calls recorded during an analysis.
+    """
+
+    def __init__(self) -> None:
+        self.plots = []
+
+    def __len__(self) -> int:
+        return len(self.plots)
+
+    def add(self, func: Callable, **kwargs) -> None:
+        """
+        Record a call of func(**kwargs) to make later.
+        """
+        self.plots.append((func, kwargs))
+
+    def render(self, jobs: int = 1) -> None:
+        """
+        Make every recorded plot, in the order they were added.
+
+        Parameter:
+            jobs (int): Number of worker processes. 1 renders in this process
+                with the current backend. More render with the Agg backend.
+        """
+        if jobs <= 1 or len(self.plots) <= 1:
+            for func, kwargs in self.plots:
+                _render(func, kwargs)
+        else:
+            # Forked workers get the plot functions of a script run as __main__.
+            context = multiprocessing.get_context('fork')
+            chunk_size = max(1, -(-len(self.plots) // (jobs * 4)))
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=_use_agg) as executor:
+                funcs, kwargs = zip(*self.plots)
+                for _ in executor.map(_render, funcs, kwargs, chunksize=chunk_size):
+                    pass
+        self.plots = []
+
+    def save(self, path: str) -> None:
+        """
+        Write the recorded plots' functions and data to an NPZ.
+
+        Parameter:
+            path (str): NPZ to write. Render it later with render_saved.
+        """
+        arrays = {}
+        specs = []
+        for func, kwargs in self.plots:
+            specs.append({
+                "file": os.path.abspath(inspect.getfile(inspect.unwrap(func))),
+                "function": func.__name__,
+                "kwargs": {key: _encode(value, arrays) for key, value in kwargs.items()},
+            })
+        np.savez_compressed(path, specs=json.dumps(specs), **arrays)
+        self.plots = []
+
+    def finish(self, jobs: int = 1, data_path: Optional[str] = None) -> None:
+        """
+        Render the recorded plots, or only save their data if data_path is given.
+        """
+        if data_path is not None:
+            self.save(data_path)
+            print("Plot data written to", data_path)
+        else:
+            self.render(jobs)
+
+
+def render_saved(path: str, jobs: int = 1) -> int:
+    """
+    Render the plots saved by PlotQueue.save.
+
+    Parameters:
+        path (str): NPZ written by PlotQueue.save.
+        jobs (int): Number of worker processes.
+
+    Returns the number of plots rendered.
+    """
+    plots = PlotQueue()
+    with np.load(path) as data:
+        for spec in json.loads(str(data["specs"])):
+            func = _load_function(spec["file"], spec["function"])
+            plots.add(func, **{key: _decode(value, data) for key, value in spec["kwargs"].items()})
+    num_plots = len(plots)
+    plots.render(jobs)
+    return num_plots
@@ -0,0 +1,192 @@
+"""
+Time the phases of a script: reader open, fragment decode, compute, and plot.
+
+Scripts mark their phases with the phase context manager or the profiled
+decorator and take a --profile option with profile_option. Marking is
+free until --profile is given. Then every phase records its wall time,
+CPU time, bytes read, and the peak RSS so far, and at exit the run is
+written as:
+    <path>         JSON with per-phase totals and every phase call.
+    <path>.folded  Collapsed stacks of self wall time in microseconds,
+                   for flamegraph.pl or speedscope.
+
+Phases nest, so decode inside compute shows as main;compute;decode.
+Phases on other threads (e.g. prefetching) get their own stacks. Phases
+in map_fragments worker processes are not recorded, only the parent's
+time waiting on them.
+"""
+
+import functools
+import json
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import click
+
+
+def read_bytes() -> int:
+    """
+    Bytes this process has read so far, or 0 where /proc is not available.
+    """
+    try:
+        with open("/proc/self/io") as io:
+            for line in io:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MB.
+    """
+    # ru_maxrss is in kB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Profiler:
+    """
+    Records the nested phases of a run.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.records = []
+        self._local = threading.local()
+        self._start = time.perf_counter()
+
+    def enable(self) -> None:
+        self.enabled = True
+        self.records = []
+        self._start = time.perf_counter()
+
+    def _stack(self) -> list:
+        """
+        Open phase records of this thread, outermost first.
+        """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+            thread = threading.current_thread()
+            self._local.prefix = "" if thread is threading.main_thread() else f"{thread.name};"
+        return self._local.stack
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Record the enclosed code as one call of the named phase.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        stack = self._stack()
+        parent = stack[-1] if len(stack) > 0 else None
+        record = {
+            "phase": name,
+            "stack": f"{parent['stack']};{name}" if parent else f"{self._local.prefix}{name}",
+            "start": time.perf_counter() - self._start,
+            "children_wall": 0.0,
+        }
+        stack.append(record)
+        wall, cpu, io = time.perf_counter(), time.thread_time(), read_bytes()
+        try:
+            yield
+        finally:
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.thread_time() - cpu
+            record["bytes_read"] = read_bytes() - io
+            record["peak_rss_mb"] = peak_rss_mb()
+            stack.pop()
+            if parent is not None:
+                parent["children_wall"] += record["wall"]
+            self.records.append(record)
+
+    def profiled(self, name: str) -> Callable:
+        """
+        Decorate a function so every call is recorded as the named phase.
+        """
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self) -> dict:
+        """
+        Total calls, wall time, CPU time, and bytes read of each phase,
+        and the highest peak RSS seen in it.
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record["phase"], {"calls": 0, "wall": 0.0, "cpu": 0.0, "bytes_read": 0, "peak_rss_mb": 0.0})
+            total["calls"] += 1
+            total["wall"] += record["wall"]
+            total["cpu"] += record["cpu"]
+            total["bytes_read"] += record["bytes_read"]
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], record["peak_rss_mb"])
+        return totals
+
+    def folded(self) -> dict[str, int]:
+        """
+        Self wall time of each stack in microseconds.
+        """
+        stacks = {}
+        for record in self.records:
+            self_wall = max(record["wall"] - record["children_wall"], 0)
+            stacks[record["stack"]] = stacks.get(record["stack"], 0) + int(self_wall * 1e6)
+        return stacks
+
+    def write(self, path: str) -> None:
+        """
+        Write the JSON trace and the folded stacks.
+        """
+        with open(path, 'w') as trace:
+            json.dump({"summary": self.summary(), "phases": self.records}, trace, indent=2)
+        with open(f"{path}.folded", 'w') as folded:
+            for stack, micros in self.folded().items():
+                folded.write(f"{stack} {micros}\n")
+
+
+PROFILER = Profiler()
+
+
+def phase(name: str):
+    """
+    Record the enclosed code as one call of the named phase.
+    """
+    return PROFILER.phase(name)
+
+
+def profiled(name: str) -> Callable:
+    """
+    Decorate a function so every call is recorded as the named phase.
+    """
+    return PROFILER.profiled(name)
+
+
+def profile_option(func: Callable) -> Callable:
+    """
+    Add a --profile PATH option to a click command.
+
+    Place it below @click.command(). With --profile, the whole command
+    is recorded as the main phase and the trace is written to PATH.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, profile: Optional[str] = None, **kwargs):
+        if profile is None:
+            return func(*args, **kwargs)
+        PROFILER.enable()
+        try:
+            with PROFILER.phase("main"):
+                return func(*args, **kwargs)
+        finally:
+            PROFILER.write(profile)
+            print("Profile written to", profile)
+    return click.option("--profile", type=click.Path(), default=None)(wrapper)
@@ -0,0 +1,37 @@
+"""
+Find the files of a run.
+
+A production run is written as many files, one per file_index (and per
+data writer). Scripts that take several files accept paths, glob
+patterns, and run IDs, and expand them with find_files.
+"""
+
+import glob
+import os
+
+
+# DAQ raw data file names, e.g. np04hd_raw_run027234_0000_dataflow0_datawriter_0_20240621T120000.hdf5.
+RUN_FILE_PATTERN = "*run{run_id:06}_*.hdf5"
+
+
+def find_files(patterns: list[str], data_dir: str = ".") -> list[str]:
+    """
+    Expand file paths, glob patterns, and run IDs into files.
+
+    Parameters:
+        patterns (list[str]): File paths, glob patterns, or run IDs. A pattern
+            of only digits that is not a file is a run ID, and matches
+            RUN_FILE_PATTERN in data_dir.
+        data_dir (str): Directory to find run IDs' files in.
+
+    Returns the matching files, sorted and without duplicates.
+    """
+    files = set()
+    for pattern in patterns:
+        if os.path.isfile(pattern):
+            files.add(pattern)
+        elif pattern.isdigit():
+            files.update(glob.glob(os.path.join(data_dir, RUN_FILE_PATTERN.format(run_id=int(pattern)))))
+        else:
+            files.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+    return sorted(files)
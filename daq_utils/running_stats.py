@@ -0,0 +1,138 @@
+"""
+Statistics of a stream of values in constant memory.
+
+RunningStats keeps the count, mean, and variance (Welford's method), the
+min and max, and P² estimates of a few quantiles, so a whole run can be
+summarized, and outliers flagged as they arrive, without storing every
+value.
+
+P²: R. Jain and I. Chlamtac, "The P² algorithm for dynamic calculation
+of quantiles and histograms without storing observations",
+Communications of the ACM 28 (1985).
+"""
+
+import math
+
+
+class P2Quantile:
+    """
+    Running estimate of one quantile from five markers.
+    """
+
+    def __init__(self, quantile: float) -> None:
+        self.quantile = quantile
+        self.count = 0
+        self._heights = []
+        self._positions = [0, 1, 2, 3, 4]
+        self._desired = [0, 2 * quantile, 4 * quantile, 2 + 2 * quantile, 4]
+        self._increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+
+    def update(self, value: float) -> None:
+        self.count += 1
+        heights = self._heights
+        if self.count <= 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = next(idx for idx in range(4) if heights[idx] <= value < heights[idx + 1])
+
+        positions = self._positions
+        for idx in range(cell + 1, 5):
+            positions[idx] += 1
+        for idx in range(5):
+            self._desired[idx] += self._increments[idx]
+
+        # Move the middle markers toward their desired positions.
+        for idx in range(1, 4):
+            offset = self._desired[idx] - positions[idx]
+            if (offset >= 1 and positions[idx + 1] - positions[idx] > 1) or \
+               (offset <= -1 and positions[idx - 1] - positions[idx] < -1):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(idx, step)
+                if not heights[idx - 1] < height < heights[idx + 1]:
+                    height = heights[idx] + step * (heights[idx + step] - heights[idx]) / (positions[idx + step] - positions[idx])
+                heights[idx] = height
+                positions[idx] += step
+
+    def _parabolic(self, idx: int, step: int) -> float:
+        heights, positions = self._heights, self._positions
+        return heights[idx] + step / (positions[idx + 1] - positions[idx - 1]) * (
+            (positions[idx] - positions[idx - 1] + step) * (heights[idx + 1] - heights[idx]) / (positions[idx + 1] - positions[idx])
+            + (positions[idx + 1] - positions[idx] - step) * (heights[idx] - heights[idx - 1]) / (positions[idx] - positions[idx - 1])
+        )
+
+    @property
+    def value(self) -> float:
+        """
+        Estimated quantile, exact while there are 5 values or fewer. NaN before any value.
+        """
+        if self.count == 0:
+            return math.nan
+        if self.count <= 5:
+            return self._heights[min(int(self.quantile * self.count), self.count - 1)]
+        return self._heights[2]
+
+
+class RunningStats:
+    """
+    Count, mean, variance, min, max, and quantiles of a stream of values.
+    """
+
+    def __init__(self, quantiles: tuple[float, ...] = (0.5, 0.9, 0.99)) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.quantiles = {quantile: P2Quantile(quantile) for quantile in quantiles}
+
+    def update(self, value: float) -> None:
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for estimate in self.quantiles.values():
+            estimate.update(value)
+
+    @property
+    def variance(self) -> float:
+        """
+        Sample variance. 0 with fewer than 2 values.
+        """
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def zscore(self, value: float) -> float:
+        """
+        Number of standard deviations a value is from the mean.
+
+        While every value so far has been the same, any other value is infinitely far.
+        """
+        if self.count == 0:
+            return 0.0
+        if self.std == 0:
+            return 0.0 if value == self.mean else math.copysign(math.inf, value - self.mean)
+        return (value - self.mean) / self.std
+
+    def summary(self) -> dict:
+        """
+        The statistics as a dictionary, with quantiles keyed like "p50".
+        """
+        summary = {"count": self.count, "mean": self.mean, "std": self.std, "min": self.min, "max": self.max}
+        for quantile, estimate in self.quantiles.items():
+            summary[f"p{quantile * 100:g}"] = estimate.value
+        return summary
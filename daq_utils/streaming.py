@@ -0,0 +1,164 @@
+"""
+Stream fragments from the trgtools readers one at a time.
+
+Each generator reads a fragment, yields its contents, and
+clears the reader before the next fragment, so only the
+fragment being worked on (plus any prefetched ones) is kept
+in memory. With prefetch > 0, fragments are decoded on a
+background thread while the consumer works on the previous one.
+"""
+
+from itertools import groupby
+import threading
+from queue import Empty, Full, Queue
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from daq_utils.profiling import phase
+
+
+def prefetch(items: Iterable, depth: int) -> Iterator:
+    """
+    Produce items on a background thread, up to depth ahead.
+
+    Parameters:
+        items (Iterable): Items to produce. Only iterated on the background thread.
+        depth (int): Maximum number of produced items waiting to be consumed.
+
+    Yields the items in order. Exceptions raised while producing
+    are re-raised in the consumer.
+    """
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(message) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(message, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(("item", item)):
+                    return
+        except BaseException as exc:
+            put(("error", exc))
+            return
+        put(("done", None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, item = queue.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise item
+            yield item
+            del item  # Do not hold onto the previous item while waiting.
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting on a full queue.
+        try:
+            while True:
+                queue.get_nowait()
+        except Empty:
+            pass
+        thread.join()
+
+
+def _read_tp_fragments(reader, paths: list[str]) -> Iterator[tuple[str, np.ndarray]]:
+    for path in paths:
+        with phase("decode"):
+            tps = reader.read_fragment(path)
+        reader.clear_data()
+        yield path, tps
+
+
+def _read_ta_fragments(reader, paths: list[str]) -> Iterator[tuple[str, np.ndarray, list[np.ndarray]]]:
+    for path in paths:
+        with phase("decode"):
+            _ = reader.read_fragment(path)
+        tas, taps = reader.ta_data, reader.tp_data
+        reader.clear_data()
+        yield path, tas, taps
+
+
+def _read_tc_fragments(reader, paths: list[str]) -> Iterator[tuple[str, np.ndarray, list[np.ndarray]]]:
+    for path in paths:
+        with phase("decode"):
+            _ = reader.read_fragment(path)
+        tcs, tas = reader.tc_data, reader.ta_data
+        reader.clear_data()
+        yield path, tcs, tas
+
+
+def _stream(read, reader, paths: Optional[list[str]], depth: int) -> Iterator:
+    if paths is None:
+        paths = reader.get_fragment_paths()
+    fragments = read(reader, list(paths))
+    if depth > 0:
+        return prefetch(fragments, depth)
+    return fragments
+
+
+def stream_tp_fragments(reader, paths: Optional[list[str]] = None, depth: int = 0) -> Iterator[tuple[str, np.ndarray]]:
+    """
+    Stream the TPs of each fragment.
+
+    Parameters:
+        reader (trgtools.TPReader): Reader to stream from. Its data is cleared after each fragment.
+        paths (list[str]): Fragment paths to read. Defaults to all of the reader's paths.
+        depth (int): Number of fragments to prefetch on a background thread. 0 reads inline.
+
+    Yields (fragment path, TPs) per fragment.
+    """
+    return _stream(_read_tp_fragments, reader, paths, depth)
+
+
+def stream_ta_fragments(reader, paths: Optional[list[str]] = None, depth: int = 0) -> Iterator[tuple[str, np.ndarray, list[np.ndarray]]]:
+    """
+    Stream the TAs and their TPs of each fragment.
+
+    Parameters:
+        reader (trgtools.TAReader): Reader to stream from. Its data is cleared after each fragment.
+        paths (list[str]): Fragment paths to read. Defaults to all of the reader's paths.
+        depth (int): Number of fragments to prefetch on a background thread. 0 reads inline.
+
+    Yields (fragment path, TAs, list of TPs per TA) per fragment.
+    """
+    return _stream(_read_ta_fragments, reader, paths, depth)
+
+
+def stream_tc_fragments(reader, paths: Optional[list[str]] = None, depth: int = 0) -> Iterator[tuple[str, np.ndarray, list[np.ndarray]]]:
+    """
+    Stream the TCs and their TAs of each fragment.
+
+    Parameters:
+        reader (trgtools.TCReader): Reader to stream from. Its data is cleared after each fragment.
+        paths (list[str]): Fragment paths to read. Defaults to all of the reader's paths.
+        depth (int): Number of fragments to prefetch on a background thread. 0 reads inline.
+
+    Yields (fragment path, TCs, list of TAs per TC) per fragment.
+    """
+    return _stream(_read_tc_fragments, reader, paths, depth)
+
+
+def group_records(fragments: Iterable[tuple], index) -> Iterator[tuple[tuple[int, int], list[tuple]]]:
+    """
+    Group streamed fragments by TriggerRecord.
+
+    Parameters:
+        fragments (Iterable[tuple]): Streamed fragments, in record order, e.g. read from index.paths.
+        index (FragmentIndex): Index of the fragment paths.
+
+    Yields (record, list of the record's fragments) per record.
+    """
+    for record, record_fragments in groupby(fragments, key=lambda fragment: index.record_of(fragment[0])):
+        yield record, list(record_fragments)
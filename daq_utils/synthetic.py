@@ -0,0 +1,123 @@
+"""
+Synthetic TPs and TAs for testing and benchmarking without a run file.
+
+TPs are a mix of uncorrelated noise and straight tracks across
+neighboring channels, at a given TP rate. TAs are made from the tracks,
+so every TA has TPs that really are in the TP stream.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from daq_utils.dbscan import TP_DT, make_tas
+from daq_utils.flat_taps import FlatTAPs
+
+
+CLOCK_HZ = 62.5e6  # Timestamp ticks per second.
+TICKS_PER_SAMPLE = 32
+NUM_CHANNELS = 3072
+START_TIME = 100_000_000_000_000_000  # A realistic timestamp to start from.
+
+
+def place_tps(rng: np.random.Generator, ticks: float, num_noise: int, track_lengths: np.ndarray,
+              num_channels: int = NUM_CHANNELS, hot_channels: Optional[np.ndarray] = None,
+              num_hot: Optional[np.ndarray] = None, start: int = START_TIME) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Make a time-sorted TP stream from noise, hot channels, and tracks.
+
+    Noise and hot channel TPs are spread uniformly over the window. Tracks
+    start uniformly in the window and cross neighboring channels with a
+    steady drift in time, so they can run past its end.
+
+    Parameters:
+        rng (np.random.Generator): Random generator.
+        ticks (float): Length of the window the TPs start in.
+        num_noise (int): Number of noise TPs, on random channels.
+        track_lengths (np.ndarray): Number of TPs on each track.
+        num_channels (int): Channels to put TPs on.
+        hot_channels (np.ndarray): Channels with extra TPs.
+        num_hot (np.ndarray): Number of extra TPs on each hot channel.
+        start (int): Timestamp of the start of the window.
+
+    Returns the TPs and, for each TP, the index of its track or -1 for noise.
+    """
+    if hot_channels is None:
+        hot_channels, num_hot = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+    num_tracks = len(track_lengths)
+    track = np.repeat(np.arange(num_tracks), track_lengths)
+    step = np.arange(len(track)) - np.repeat(np.cumsum(track_lengths) - track_lengths, track_lengths)
+    track_start = rng.uniform(0, ticks, size=num_tracks)
+    track_channel = rng.integers(0, num_channels, size=num_tracks)
+    direction = rng.choice([-1, 1], size=num_tracks)
+    drift = rng.uniform(0, 4 * TICKS_PER_SAMPLE, size=num_tracks)
+
+    num_untracked = num_noise + int(np.sum(num_hot))
+    times = np.concatenate((
+        track_start[track] + step * drift[track],
+        rng.uniform(0, ticks, size=num_untracked),
+    ))
+    channels = np.concatenate((
+        (track_channel[track] + direction[track] * step) % num_channels,
+        rng.integers(0, num_channels, size=num_noise),
+        np.repeat(hot_channels, num_hot),
+    ))
+    labels = np.concatenate((track, np.full(num_untracked, -1)))
+
+    num_tps = len(times)
+    tps = np.zeros(num_tps, dtype=TP_DT)
+    tps['time_start'] = start + (times // TICKS_PER_SAMPLE * TICKS_PER_SAMPLE).astype(np.uint64)
+    tps['channel'] = channels
+    tps['time_over_threshold'] = TICKS_PER_SAMPLE * (rng.poisson(4, size=num_tps) + 1)
+    tps['time_peak'] = tps['time_start'] + TICKS_PER_SAMPLE * rng.integers(0, 4, size=num_tps).astype(np.uint64)
+    tps['adc_peak'] = rng.integers(20, 500, size=num_tps)
+    tps['adc_integral'] = tps['adc_peak'] * (tps['time_over_threshold'] // TICKS_PER_SAMPLE)
+
+    order = np.argsort(tps['time_start'], kind='stable')
+    return tps[order], labels[order]
+
+
+def make_tps(num_tps: int, rate: float = 1e6, track_fraction: float = 0.2, track_length: int = 50,
+             num_channels: int = NUM_CHANNELS, seed: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Make a time-sorted TP stream.
+
+    Parameters:
+        num_tps (int): Number of TPs to make.
+        rate (float): Average TP rate in TPs per second.
+        track_fraction (float): Fraction of TPs that are on tracks.
+        track_length (int): Average number of TPs on a track.
+        num_channels (int): Channels to put TPs on.
+        seed (int): Random seed.
+
+    Returns the TPs and, for each TP, the index of its track or -1 for noise.
+    """
+    rng = np.random.default_rng(seed)
+    num_track_tps = int(num_tps * track_fraction)
+    duration = num_tps / rate * CLOCK_HZ
+
+    lengths = rng.poisson(track_length, size=max(1, num_track_tps // max(track_length, 1))) + 1
+    lengths = lengths[np.cumsum(lengths) <= num_track_tps]
+    return place_tps(rng, duration, num_tps - np.sum(lengths), lengths, num_channels)
+
+
+def make_run(num_tps: int, rate: float = 1e6, seed: Optional[int] = None, **kwargs) -> tuple[np.ndarray, np.ndarray, FlatTAPs]:
+    """
+    Make a TP stream and a TA for each of its tracks.
+
+    Parameters:
+        num_tps (int): Number of TPs to make.
+        rate (float): Average TP rate in TPs per second.
+        seed (int): Random seed.
+        kwargs: Passed on to make_tps.
+
+    Returns the TPs, the TAs in time order, and the TPs of each TA.
+    """
+    tps, labels = make_tps(num_tps, rate, seed=seed, **kwargs)
+    on_track = np.flatnonzero(labels >= 0)
+    # TPs are time sorted, so a stable sort keeps each track in time order.
+    members = on_track[np.argsort(labels[on_track], kind='stable')]
+    counts = np.bincount(labels[on_track], minlength=np.max(labels, initial=-1) + 1)
+    taps = FlatTAPs.from_counts(tps[members], counts)
+    taps = taps[np.argsort(taps.first('time_start'), kind='stable')]
+    return tps, make_tas(taps), taps
@@ -0,0 +1,271 @@
+"""
+Synthetic run files and stand-in readers for them.
+
+generate_run makes a run record by record: noise TPs on every channel,
+extra TPs on hot channels, and track-like clusters. Each record has a
+readout TP fragment per link followed by one trigger TP fragment, like
+a file with readout and trigger fragments interleaved. TAs are made by
+DBSCAN on the trigger TPs, and each record has one TC holding its TAs.
+
+write_run saves the run to a single .npz file. SyntheticTPReader,
+SyntheticTAReader, and SyntheticTCReader read it with the same methods
+and data members the scripts use from the trgtools readers. The
+fragment headers are not stored, so daq_utils.header_index cannot index
+a synthetic run.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import numpy as np
+
+from daq_utils.dbscan import TA_DT, TAMaker
+from daq_utils.synthetic import CLOCK_HZ, NUM_CHANNELS, START_TIME, TP_DT, place_tps
+
+
+# trgtools TCReader TriggerCandidate layout.
+TC_DT = np.dtype([
+    ('algorithm', np.uint8),
+    ('detid', np.uint16),
+    ('num_tas', np.uint64),
+    ('time_candidate', np.uint64),
+    ('time_end', np.uint64),
+    ('time_start', np.uint64),
+    ('type', np.uint8),
+    ('version', np.uint16),
+])
+
+# Roughly production rates.
+NOISE_RATE = 100    # TPs per second per channel.
+TRACK_RATE = 50     # Tracks per second.
+HOT_RATE = 10000    # TPs per second on each hot channel.
+RECORD_TICKS = 2**22  # About 67 ms.
+
+TRIGGER_SOURCE_ID = 1
+
+
+def get_record_name(record: int) -> str:
+    return f"TriggerRecord{record:05}.0000"
+
+
+def get_fragment_path(record: int, subsystem: str, source_id: int, fragment_type: str) -> str:
+    return f"/{get_record_name(record)}/RawData/{subsystem}_0x{source_id:08x}_{fragment_type}"
+
+
+def make_record_tps(rng: np.random.Generator, start: int, ticks: int, num_channels: int, noise_rate: float,
+                    hot_channels: np.ndarray, hot_rate: float, track_rate: float, track_length: int) -> np.ndarray:
+    """
+    Make the TPs seen in one record window, in time order.
+
+    Rates are per second. Tracks cross about track_length neighboring
+    channels, a few samples apart. See synthetic.place_tps.
+    """
+    seconds = ticks / CLOCK_HZ
+    num_noise = rng.poisson(noise_rate * num_channels * seconds)
+    num_hot = rng.poisson(hot_rate * seconds, size=len(hot_channels))
+    num_tracks = rng.poisson(track_rate * seconds)
+    lengths = rng.poisson(track_length, size=num_tracks) + 1
+
+    tps, _ = place_tps(rng, ticks, num_noise, lengths, num_channels, hot_channels, num_hot, start)
+    # Tracks that run past the end of the window are cut there.
+    return tps[tps['time_start'] < start + ticks]
+
+
+def make_tc(tas: np.ndarray) -> np.ndarray:
+    """
+    Make one TC that holds all of the given TAs.
+    """
+    tc = np.zeros(1, dtype=TC_DT)
+    tc['num_tas'] = len(tas)
+    if len(tas) > 0:
+        tc['time_start'] = np.min(tas['time_start'])
+        tc['time_end'] = np.max(tas['time_end'])
+        tc['time_candidate'] = tas['time_peak'][np.argmax(tas['adc_peak'])]
+    return tc
+
+
+def generate_run(num_records: int = 10, num_channels: int = NUM_CHANNELS, noise_rate: float = NOISE_RATE,
+                 hot_channels: tuple[int, ...] = (), hot_rate: float = HOT_RATE, track_rate: float = TRACK_RATE,
+                 track_length: int = 50, num_links: int = 1, duplication: float = 0.0, scale: float = 1.0,
+                 record_ticks: int = RECORD_TICKS, eps: float = 10, min_pts: int = 20,
+                 seed: Optional[int] = None) -> dict:
+    """
+    Generate a synthetic run.
+
+    Parameters:
+        num_records (int): Number of TriggerRecords.
+        num_channels (int): Number of channels.
+        noise_rate (float): Noise TPs per second per channel.
+        hot_channels (tuple[int, ...]): Channels with extra TPs.
+        hot_rate (float): Extra TPs per second on each hot channel.
+        track_rate (float): Track-like clusters per second.
+        track_length (int): Average number of TPs on a track.
+        num_links (int): Number of readout links. Channels are split evenly between them.
+        duplication (float): Fraction of each link's TPs that also appear on the next link.
+        scale (float): Multiplies every rate, e.g. 10 for 10x production.
+        record_ticks (int): Length of each record window.
+        eps (float): DBSCAN radius for making TAs.
+        min_pts (int): DBSCAN minimum neighborhood size for making TAs.
+        seed (int): Random seed.
+
+    Returns a dictionary of fragment path to fragment contents for each
+    reader type ("tp", "ta", "tc"), in file order.
+    """
+    rng = np.random.default_rng(seed)
+    hot_channels = np.asarray(hot_channels, dtype=np.int32)
+    run = {"tp": {}, "ta": {}, "tc": {}}
+    for record in range(1, num_records + 1):
+        start = START_TIME + (record - 1) * record_ticks
+        tps = make_record_tps(rng, start, record_ticks, num_channels, noise_rate * scale, hot_channels,
+                              hot_rate * scale, track_rate * scale, track_length)
+
+        # Readout fragments, one per link, then the trigger's merged TPs.
+        link = (tps['channel'].astype(np.int64) * num_links) // num_channels
+        # Duplicated TPs are also read out by the next link.
+        duplicate_link = np.where(rng.random(len(tps)) < duplication, (link + 1) % num_links, -1)
+        for link_id in range(num_links):
+            in_link = (link == link_id) | (duplicate_link == link_id)
+            run["tp"][get_fragment_path(record, "Detector_Readout", link_id, "Trigger_Primitive")] = tps[in_link]
+        run["tp"][get_fragment_path(record, "Trigger", TRIGGER_SOURCE_ID, "Trigger_Primitive")] = tps
+
+        maker = TAMaker(eps, min_pts)
+        (tas, taps), (last_tas, last_taps) = maker.add(tps), maker.flush()
+        tas = np.concatenate((tas, last_tas))
+        run["ta"][get_fragment_path(record, "Trigger", TRIGGER_SOURCE_ID, "Trigger_Activity")] = (tas, list(taps) + list(last_taps))
+        run["tc"][get_fragment_path(record, "Trigger", TRIGGER_SOURCE_ID, "Trigger_Candidate")] = (make_tc(tas), [tas])
+    return run
+
+
+def _flatten(fragments: list[np.ndarray], dtype: np.dtype) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenate arrays and get the offsets into the result.
+    """
+    counts = np.array([len(fragment) for fragment in fragments], dtype=np.int64)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    data = np.concatenate(fragments) if len(fragments) > 0 else np.zeros(0, dtype=dtype)
+    return data.astype(dtype, copy=False), offsets
+
+
+def write_run(file: str, run: dict, run_id: int = 1, file_index: int = 0) -> None:
+    """
+    Save a run from generate_run to a .npz file.
+    """
+    arrays = {"run_id": np.array(run_id), "file_index": np.array(file_index)}
+    for kind, dtype, member_dtype in (("ta", TA_DT, TP_DT), ("tc", TC_DT, TA_DT)):
+        fragments = list(run[kind].values())
+        arrays[f"{kind}_data"], arrays[f"{kind}_offsets"] = _flatten([objects for objects, _ in fragments], dtype)
+        members = [member for _, fragment_members in fragments for member in fragment_members]
+        arrays[f"{kind}_members"], arrays[f"{kind}_member_offsets"] = _flatten(members, member_dtype)
+    arrays["tp_data"], arrays["tp_offsets"] = _flatten(list(run["tp"].values()), TP_DT)
+    for kind in ("tp", "ta", "tc"):
+        arrays[f"{kind}_paths"] = np.array(list(run[kind].keys()))
+    np.savez(file, **arrays)
+
+
+class SyntheticReader(ABC):
+    """
+    Common part of the synthetic readers.
+
+    Like the trgtools readers, read_fragment adds to the reader's data
+    until clear_data is called.
+    """
+
+    kind = None
+
+    def __init__(self, filename: str, verbosity: int = 0) -> None:
+        self._filename = filename
+        self.verbosity = verbosity
+        with np.load(filename) as run:
+            self.run_id = int(run["run_id"])
+            self.file_index = int(run["file_index"])
+            self._fragment_paths = [str(path) for path in run[f"{self.kind}_paths"]]
+            self._data = run[f"{self.kind}_data"]
+            self._offsets = run[f"{self.kind}_offsets"]
+            self._members = run[f"{self.kind}_members"] if f"{self.kind}_members" in run.files else None
+            self._member_offsets = run[f"{self.kind}_member_offsets"] if self._members is not None else None
+        self._path_index = {path: idx for idx, path in enumerate(self._fragment_paths)}
+        self.clear_data()
+
+    def get_fragment_paths(self) -> list[str]:
+        return list(self._fragment_paths)
+
+    def set_fragment_paths(self, fragment_paths: list[str]) -> None:
+        self._fragment_paths = list(fragment_paths)
+
+    def _get(self, fragment_path: str) -> tuple[np.ndarray, list[np.ndarray]]:
+        idx = self._path_index[fragment_path]
+        lo, hi = self._offsets[idx], self._offsets[idx+1]
+        data = self._data[lo:hi]
+        if self._members is None:
+            return data, []
+        members = [self._members[self._member_offsets[obj]:self._member_offsets[obj+1]] for obj in range(lo, hi)]
+        return data, members
+
+    def read_all_fragments(self) -> None:
+        for fragment_path in self._fragment_paths:
+            _ = self.read_fragment(fragment_path)
+
+    @abstractmethod
+    def read_fragment(self, fragment_path: str) -> np.ndarray:
+        """
+        Read a fragment, add its contents to the reader's data, and return its objects.
+        """
+
+    @abstractmethod
+    def clear_data(self) -> None:
+        """
+        Empty the reader's data.
+        """
+
+
+class SyntheticTPReader(SyntheticReader):
+    """
+    Stand-in for trgtools.TPReader.
+    """
+
+    kind = "tp"
+
+    def read_fragment(self, fragment_path: str) -> np.ndarray:
+        tps, _ = self._get(fragment_path)
+        self.tp_data = np.concatenate((self.tp_data, tps))
+        return tps
+
+    def clear_data(self) -> None:
+        self.tp_data = np.zeros(0, dtype=TP_DT)
+
+
+class SyntheticTAReader(SyntheticReader):
+    """
+    Stand-in for trgtools.TAReader.
+    """
+
+    kind = "ta"
+
+    def read_fragment(self, fragment_path: str) -> np.ndarray:
+        tas, taps = self._get(fragment_path)
+        self.ta_data = np.concatenate((self.ta_data, tas))
+        self.tp_data += taps
+        return tas
+
+    def clear_data(self) -> None:
+        self.ta_data = np.zeros(0, dtype=TA_DT)
+        self.tp_data = []
+
+
+class SyntheticTCReader(SyntheticReader):
+    """
+    Stand-in for trgtools.TCReader.
+    """
+
+    kind = "tc"
+
+    def read_fragment(self, fragment_path: str) -> np.ndarray:
+        tcs, tas = self._get(fragment_path)
+        self.tc_data = np.concatenate((self.tc_data, tcs))
+        self.ta_data += tas
+        return tcs
+
+    def clear_data(self) -> None:
+        self.tc_data = np.zeros(0, dtype=TC_DT)
+        self.ta_data = []
@@ -0,0 +1,192 @@
+"""
+Compare TPs by packed integer keys instead of structured records.
+
+A TP key is the raw bytes of the chosen fields viewed as uint64 words.
+For example, (time_start, channel, adc_peak) packs into exactly 128 bits
+(2 words). Leaving the fields unset packs the whole record, which keeps
+the same identity as comparing the records themselves.
+
+The set helpers sort on these integer words rather than on the
+void-typed records that np.unique and np.setdiff1d fall back to.
+"""
+
+from typing import Optional, Union
+
+import numpy as np
+from numpy.lib import recfunctions
+
+
+def pack_tps(tps: np.ndarray, fields: Optional[list[str]] = None) -> np.ndarray:
+    """
+    Pack the identifying fields of each TP into uint64 words.
+
+    Parameters:
+        tps (np.ndarray): Structured array of TPs.
+        fields (list[str]): Fields that identify a TP. Defaults to all fields.
+
+    Returns an (N, W) array of uint64 words. Two TPs have equal rows
+    if and only if all of their chosen fields are equal.
+    """
+    if fields is not None:
+        tps = tps[list(fields)]
+    packed = np.ascontiguousarray(recfunctions.repack_fields(tps))
+    itemsize = packed.dtype.itemsize
+    num_words = -(-itemsize // 8)
+
+    raw = np.zeros((len(packed), num_words * 8), dtype=np.uint8)
+    raw[:, :itemsize] = packed.view(np.uint8).reshape(len(packed), itemsize)
+    return raw.view(np.uint64)
+
+
+def _key_ids(keys: np.ndarray) -> np.ndarray:
+    """
+    Give each distinct key a dense integer id.
+    """
+    if len(keys) == 0:
+        return np.array([], dtype=np.int64)
+    # lexsort uses the last key as the primary sort key.
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    new_key = np.ones(len(keys), dtype=bool)
+    new_key[1:] = np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+    ids = np.empty(len(keys), dtype=np.int64)
+    ids[order] = np.cumsum(new_key) - 1
+    return ids
+
+
+def _first_index(ids: np.ndarray) -> np.ndarray:
+    """
+    Find the first occurrence of each key id, in their original order.
+    """
+    first = np.full(np.max(ids) + 1, len(ids), dtype=np.int64)
+    np.minimum.at(first, ids, np.arange(len(ids)))
+    return np.sort(first)
+
+
+def unique_index(keys: np.ndarray) -> np.ndarray:
+    """
+    Find the first occurrence of each distinct key.
+
+    Parameter:
+        keys (np.ndarray): Packed keys.
+
+    Returns the indices of the first occurrences, in their original order.
+    """
+    if len(keys) == 0:
+        return np.array([], dtype=np.int64)
+    return _first_index(_key_ids(keys))
+
+
+def isin_keys(keys0: np.ndarray, keys1: np.ndarray) -> np.ndarray:
+    """
+    Check which of keys0 are also in keys1.
+
+    Parameters:
+        keys0 (np.ndarray): Packed keys to check.
+        keys1 (np.ndarray): Packed keys to check against.
+
+    Returns a boolean mask over keys0.
+    """
+    if len(keys0) == 0 or len(keys1) == 0:
+        return np.zeros(len(keys0), dtype=bool)
+    ids = _key_ids(np.concatenate((keys0, keys1)))
+    in_keys1 = np.zeros(np.max(ids) + 1, dtype=bool)
+    in_keys1[ids[len(keys0):]] = True
+    return in_keys1[ids[:len(keys0)]]
+
+
+def count_common_keys(keys0: np.ndarray, keys1: np.ndarray) -> int:
+    """
+    Count the keys that are in both, with multiplicity.
+
+    A key that is n times in keys0 and m times in keys1 counts min(n, m) times.
+
+    Parameters:
+        keys0 (np.ndarray): Packed keys.
+        keys1 (np.ndarray): Packed keys.
+
+    Returns the number of matched pairs of keys.
+    """
+    if len(keys0) == 0 or len(keys1) == 0:
+        return 0
+    ids = _key_ids(np.concatenate((keys0, keys1)))
+    num_ids = np.max(ids) + 1
+    counts0 = np.bincount(ids[:len(keys0)], minlength=num_ids)
+    counts1 = np.bincount(ids[len(keys0):], minlength=num_ids)
+    return int(np.sum(np.minimum(counts0, counts1)))
+
+
+def unique_tps(tps: np.ndarray, fields: Optional[list[str]] = None,
+               return_inverse: bool = False) -> Union[np.ndarray, tuple[np.ndarray, np.ndarray]]:
+    """
+    Get the distinct TPs.
+
+    Parameters:
+        tps (np.ndarray): TPs to make unique.
+        fields (list[str]): Fields that identify a TP. Defaults to all fields.
+        return_inverse (bool): Also return the position of each TP in the result.
+
+    Returns the first occurrence of each distinct TP, in their original order.
+    With return_inverse, also returns for each TP the index of its distinct TP,
+    like np.unique.
+    """
+    if len(tps) == 0:
+        unique = tps[:0]
+        return (unique, np.array([], dtype=np.int64)) if return_inverse else unique
+    ids = _key_ids(pack_tps(tps, fields))
+    first = _first_index(ids)
+    if not return_inverse:
+        return tps[first]
+    position = np.empty(len(first), dtype=np.int64)
+    position[ids[first]] = np.arange(len(first))
+    return tps[first], position[ids]
+
+
+def setdiff_tps(tps0: np.ndarray, tps1: np.ndarray, fields: Optional[list[str]] = None) -> np.ndarray:
+    """
+    Get the distinct TPs in tps0 that are not in tps1.
+
+    Parameters:
+        tps0 (np.ndarray): TPs to keep from.
+        tps1 (np.ndarray): TPs to remove.
+        fields (list[str]): Fields that identify a TP. Defaults to all fields.
+
+    Returns the TPs, in their original order.
+    """
+    keys0 = pack_tps(tps0, fields)
+    first = unique_index(keys0)
+    missing = ~isin_keys(keys0[first], pack_tps(tps1, fields))
+    return tps0[first[missing]]
+
+
+def intersect_tps(tps0: np.ndarray, tps1: np.ndarray, fields: Optional[list[str]] = None) -> np.ndarray:
+    """
+    Get the distinct TPs in tps0 that are also in tps1.
+
+    Parameters:
+        tps0 (np.ndarray): TPs to keep from.
+        tps1 (np.ndarray): TPs to look for.
+        fields (list[str]): Fields that identify a TP. Defaults to all fields.
+
+    Returns the TPs, in their original order.
+    """
+    keys0 = pack_tps(tps0, fields)
+    first = unique_index(keys0)
+    found = isin_keys(keys0[first], pack_tps(tps1, fields))
+    return tps0[first[found]]
+
+
+def equal_tps(tps0: np.ndarray, tps1: np.ndarray, fields: Optional[list[str]] = None) -> bool:
+    """
+    Check that two TP arrays are the same, element by element.
+
+    Parameters:
+        tps0 (np.ndarray): One TP array.
+        tps1 (np.ndarray): Another TP array.
+        fields (list[str]): Fields that identify a TP. Defaults to all fields.
+
+    Returns True if they have the same length and every pair of TPs is equal.
+    """
+    if len(tps0) != len(tps1):
+        return False
+    return bool(np.all(pack_tps(tps0, fields) == pack_tps(tps1, fields)))
@@ -12,51 +12,100 @@ from trgtools import TAReader
 import click
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
-def dist(hit0, hit1):
-    return np.sum(np.power(hit0 - hit1, 2))
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.dbscan import count_clusters, label_dbscan
+from daq_utils.fragment_cache import open_reader
+from daq_utils.profiling import phase, profile_option
+
+
+def get_noncompliance(tps: np.ndarray, eps: float, min_pts: int) -> dict[str, int]:
+    """
+    Find the reasons the set of TPs is not DBSCAN compliant.
+
+    Parameters:
+        tps (np.ndarray): TPs from a single TA.
+        eps (float): Neighborhood radius.
+        min_pts (int): Minimum neighborhood size for a core point.
+
+    Returns a dictionary of reason to count. Empty if compliant.
+        "empty": The TA has no TPs.
+        "noise": Number of TPs not in the neighborhood of a core point.
+        "clusters": Number of disconnected clusters, if more than 1.
+    """
+    if len(tps) == 0:
+        return {"empty": 1}
+
+    core, border, src, dst = label_dbscan(tps, eps, min_pts)
+
+    reasons = {}
+    noise_count = np.sum(~core & ~border)
+    if noise_count:
+        reasons["noise"] = int(noise_count)
+    cluster_count = count_clusters(src, dst, core)
+    if cluster_count > 1:
+        reasons["clusters"] = cluster_count
+    return reasons
 
 
 def check_dbscan(tps: np.ndarray, eps: int, min_pts: int) -> bool:
     """
     Check that the set of TPs is DBSCAN compliant.
     """
-    tp_label = np.zeros(len(tps))
-    cluster_label = np.zeros(len(tps))
-    neighbor_count = np.zeros(len(tps))
-
-    time = (tps['time_start'].astype(int) - np.min(tps['time_start'])) / 100
-    channel = tps['channel']
-    hits = np.array([time, channel]).T
-    sq_eps = eps**2
-
-    for idx, hit0 in enumerate(hits):
-        for jdx, hit1 in enumerate(hits[idx:]):
-            if dist(hit0, hit1) <= sq_eps:
-                neighbor_count[idx] += 1
-                neighbor_count[jdx+idx] += 1
-    #print(neighbor_count)
-
-    for idx, count in enumerate(neighbor_count):
-        if count >= min_pts:
-            tp_label[idx] = 1
-
-    for idx, label0 in enumerate(tp_label):
-        if label0 == 1:  # Skip core points
-            continue
-        hit0 = hits[idx]
-        compliant = False  # Assume that it is not compliant
-        for label1, hit1 in zip(tp_label, hits):
-            if np.all(hit0 == hit1):
-                continue
-            if dist(hit0, hit1) <= sq_eps and label1 == 1:
-                compliant = True  # Found that it is in the neighborhood of a core point
-                break
-        if not compliant:  # TP was not in the neighborhood of a core point
-            print(neighbor_count)
-            return False
-
-    return True
+    return not get_noncompliance(tps, eps, min_pts)
+
+
+def check_fragments(file: str, paths: list[str], eps: int, min_pts: int,
+                    num_tas: Optional[int] = None) -> tuple[int, list[tuple[str, int, str]]]:
+    """
+    Check the TAs in the given fragments.
+
+    Opens its own reader, so this can run in a worker process.
+    Only one fragment is held in memory at a time.
+
+    Parameters:
+        file (str): HDF5 file to read.
+        paths (list[str]): TA fragment paths to check.
+        eps (int): Neighborhood radius.
+        min_pts (int): Minimum neighborhood size for a core point.
+        num_tas (int): Check at most this many TAs per fragment. None checks all of them.
+
+    Returns the number of TAs checked and a list of
+    (fragment path, TA index, failure type) for every failure.
+    """
+    with phase("open"):
+        data = open_reader(TAReader, file)
+    ta_count = 0
+    failures = []
+    for path in paths:
+        with phase("decode"):
+            _ = data.read_fragment(path)
+        with phase("compute"):
+            for ta_idx, tps in enumerate(data.tp_data[:num_tas]):
+                ta_count += 1
+                for reason in get_noncompliance(tps, eps, min_pts):
+                    failures.append((path, ta_idx, reason))
+        data.clear_data()
+    return ta_count, failures
+
+
+def shard_paths(paths: list[str], num_shards: int) -> list[list[str]]:
+    """
+    Split the fragment paths into contiguous shards.
+
+    Parameters:
+        paths (list[str]): Fragment paths to split.
+        num_shards (int): Number of shards to make.
+
+    Returns a list of non-empty shards in the original order.
+    """
+    shards = np.array_split(np.arange(len(paths)), num_shards)
+    return [[paths[idx] for idx in shard] for shard in shards if len(shard) > 0]
 
 
 @click.command()
@@ -64,21 +113,34 @@ def check_dbscan(tps: np.ndarray, eps: int, min_pts: int) -> bool:
 @click.option("--eps", type=click.INT)
 @click.option("--min-pts", type=click.INT)
 @click.option("--num-fragments", type=click.INT, default=1)
-@click.option("--num-tas", type=click.INT, default=10)
-def main(file, eps, min_pts, num_fragments, num_tas):
-    data = TAReader(file)
-    data._fragment_paths = data.get_fragment_paths()[:num_fragments]
-    data.read_all_fragments()
-
-    bad_count = 0
-    for idx, tps in enumerate(data.tp_data):
-        #print("="*60)
-        if not check_dbscan(tps, eps, min_pts):
-            print("Not DBSCAN compliant.")
-            print(f"Found at {idx}.")
-            bad_count += 1
-
-    print("Total # of Noncompliant TAs:", bad_count)
+@click.option("--num-tas", type=click.INT, default=None, help="Check at most this many TAs per fragment. Defaults to all.")
+@click.option("--all-frags", '-a', default=False, is_flag=True)
+@click.option("--jobs", '-j', type=click.INT, default=1)
+@profile_option
+def main(file, eps, min_pts, num_fragments, num_tas, all_frags, jobs):
+    paths = open_reader(TAReader, file).get_fragment_paths()
+    if not all_frags:
+        paths = paths[:num_fragments]
+
+    # Several shards per worker keeps the workers busy when fragment sizes vary.
+    shards = shard_paths(paths, max(jobs, 1) * 4)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(check_fragments, file, shard, eps, min_pts, num_tas) for shard in shards]
+            results = [future.result() for future in futures]
+    else:
+        results = [check_fragments(file, shard, eps, min_pts, num_tas) for shard in shards]
+
+    ta_count = 0
+    bad_tas = set()
+    for shard_ta_count, failures in results:
+        ta_count += shard_ta_count
+        for path, ta_idx, reason in failures:
+            print(f"Not DBSCAN compliant at {path}, TA {ta_idx}: {reason}")
+            bad_tas.add((path, ta_idx))
+
+    print("Total # of TAs:", ta_count)
+    print("Total # of Noncompliant TAs:", len(bad_tas))
     return
 
 
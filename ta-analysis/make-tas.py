@@ -0,0 +1,141 @@
+"""
+Make reference TAs offline by running DBSCAN
+over a file's TP stream.
+
+Uses the same eps and min_pts semantics as
+dbscan-definition-check.py. The TAs can be compared
+with the file's own TAs or with an earlier reference.
+"""
+
+from trgtools import TAReader, TPReader
+
+import click
+import numpy as np
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.dbscan import TA_DT, TAMaker
+from daq_utils.flat_taps import FlatTAPs
+from daq_utils.fragment_cache import open_reader
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.profiling import phase, profile_option
+from daq_utils.streaming import stream_ta_fragments, stream_tp_fragments
+from daq_utils.tp_keys import count_common_keys, pack_tps
+
+
+# TA fields that identify a TA when comparing.
+MATCH_FIELDS = ['time_start', 'time_end', 'channel_start', 'channel_end', 'num_tps']
+
+
+def make_run_tas(maker: TAMaker, fragments) -> tuple[np.ndarray, FlatTAPs, int, float]:
+    """
+    Feed every TP fragment to the maker and collect the TAs.
+
+    Parameters:
+        maker (TAMaker): Maker to feed.
+        fragments (Iterable): (fragment path, TPs) of each fragment, in time order.
+
+    Returns the TAs, their TPs, the number of TPs read, and the seconds spent in the maker.
+    """
+    results = []
+    num_tps = 0
+    seconds = 0
+    for _, tps in fragments:
+        num_tps += len(tps)
+        start = time.perf_counter()
+        with phase("compute"):
+            results.append(maker.add(tps))
+        seconds += time.perf_counter() - start
+    start = time.perf_counter()
+    with phase("compute"):
+        results.append(maker.flush())
+    seconds += time.perf_counter() - start
+
+    results = [(tas, taps) for tas, taps in results if len(tas) > 0]
+    if len(results) == 0:
+        return np.zeros(0, dtype=maker.ta_dtype), FlatTAPs.from_list([], dtype=maker.tp_dtype), num_tps, seconds
+    tas = np.concatenate([tas for tas, _ in results])
+    taps = FlatTAPs.from_counts(np.concatenate([taps.taps for _, taps in results]),
+                                np.concatenate([taps.counts for _, taps in results]))
+    return tas, taps, num_tps, seconds
+
+
+def read_file_tas(data: TAReader, paths: list[str], prefetch: int) -> np.ndarray:
+    """
+    Read the TAs in the given TA fragments.
+    """
+    tas = [fragment_tas for _, fragment_tas, _ in stream_ta_fragments(data, paths, depth=prefetch)]
+    if len(tas) == 0:
+        return np.zeros(0, dtype=TA_DT)
+    return np.concatenate(tas)
+
+
+def compare_tas(tas: np.ndarray, reference: np.ndarray, name: str) -> None:
+    """
+    Print how many TAs match the reference on MATCH_FIELDS.
+
+    Matches are counted with multiplicity, so a made TA that is in the
+    reference once only matches once.
+    """
+    matched = count_common_keys(pack_tps(tas, MATCH_FIELDS), pack_tps(reference, MATCH_FIELDS))
+
+    print(f"Made TAs / {name} TAs: {len(tas)} / {len(reference)}")
+    print(f"Made TAs matching {name}: {matched} out of {len(tas)}")
+    print(f"{name.capitalize()} TAs not made: {len(reference) - matched}")
+
+
+@click.command()
+@click.argument("file")
+@click.option("--eps", type=click.FLOAT)
+@click.option("--min-pts", type=click.INT)
+@click.option("--num-fragments", type=click.INT, default=1)
+@click.option("--all-frags", '-a', default=False, is_flag=True)
+@click.option("--prefetch", '-p', type=click.INT, default=0)
+@click.option("--output", '-o', type=click.Path(), default=None)
+@click.option("--compare", '-c', default=False, is_flag=True)
+@click.option("--reference", '-r', type=click.Path(exists=True), default=None)
+@profile_option
+def main(file, eps, min_pts, num_fragments, all_frags, prefetch, output, compare, reference):
+    with phase("open"):
+        tp_data = open_reader(TPReader, file)
+    file_id = f"{tp_data.run_id}.{tp_data.file_index:04}"
+    # The readout fragments hold the same TPs as the trigger fragments,
+    # so only the trigger's time-ordered stream is given to the maker.
+    index = FragmentIndex.from_readers(tp_data)
+    records = index.records_with("trigger_tp")
+    if not all_frags:
+        records = records[:num_fragments]
+    paths = index.paths("trigger_tp", records)
+
+    maker = TAMaker(eps, min_pts)
+    fragments = stream_tp_fragments(tp_data, paths, depth=prefetch)
+    tas, taps, num_tps, seconds = make_run_tas(maker, fragments)
+
+    print("Number of TPs read:", num_tps)
+    print("Number of TAs made:", len(tas))
+    if seconds > 0:
+        print(f"Throughput: {num_tps / seconds:.0f} TPs/s")
+
+    if output is None:
+        output = f"made_tas_{file_id}.npz"
+    np.savez_compressed(output, tas=tas, taps=taps.taps, offsets=taps.offsets, eps=eps, min_pts=min_pts)
+
+    if compare:
+        with phase("open"):
+            ta_data = open_reader(TAReader, file)
+        ta_paths = FragmentIndex.from_readers(ta_data).paths("ta", records)
+        compare_tas(tas, read_file_tas(ta_data, ta_paths, prefetch), "file")
+
+    if reference is not None:
+        with np.load(reference) as saved:
+            if saved['eps'] != eps or saved['min_pts'] != min_pts:
+                print(f"Reference used eps={saved['eps']} and min_pts={saved['min_pts']}.")
+            compare_tas(tas, saved['tas'], "reference")
+    return
+
+
+if __name__ == "__main__":
+    main()
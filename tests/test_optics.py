@@ -0,0 +1,54 @@
+"""
+Check that tp-analysis/optics.py clusters the same with and without --precomputed.
+
+Run with python -m unittest discover tests.
+"""
+
+import importlib.util
+import os
+import sys
+import unittest
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+def load_optics():
+    """
+    Import optics.py with the synthetic readers standing in for trgtools.
+    """
+    spec = importlib.util.spec_from_file_location("load_test", os.path.join(ROOT, "benchmarks", "load-test.py"))
+    load_test = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(load_test)
+    if "trgtools" not in sys.modules:
+        load_test.install_readers()
+
+    spec = importlib.util.spec_from_file_location("optics", os.path.join(ROOT, "tp-analysis", "optics.py"))
+    optics = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(optics)
+    return optics
+
+
+class TestPrecomputed(unittest.TestCase):
+
+    def setUp(self):
+        self.optics = load_optics()
+        rng = np.random.default_rng(0)
+        cluster = rng.integers(0, 5, size=(50, 2))
+        # Isolated TPs have fewer than min_samples neighbors within max_eps.
+        isolated = np.array([[100, 100], [200, 0], [300, 300]])
+        self.positions = np.concatenate((cluster, isolated, cluster[:3]))
+
+    def test_isolated_points(self):
+        dense = self.optics.cluster_positions(self.positions, max_eps=3)
+        precomputed = self.optics.cluster_positions(self.positions, max_eps=3, precomputed=True)
+
+        self.assertTrue(np.all(precomputed["labels"][50:53] == -1))
+        for name in ("labels", "ordering", "reachability", "core_distances"):
+            np.testing.assert_array_equal(precomputed[name], dense[name])
+
+
+if __name__ == "__main__":
+    unittest.main()
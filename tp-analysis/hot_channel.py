@@ -3,36 +3,158 @@ Find the channels that are above a certain limit.
 """
 
 from trgtools import TPReader
-from trgtools.plot import PDFPlotter
 
 import click
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.fragment_cache import open_reader
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.mapreduce import map_fragments, reduce_fragments
+from daq_utils.profiling import phase, profile_option, profiled
+
+
+NUM_CHANNELS = 3072
+
+
+def count_channels(readers: tuple, paths: tuple[str]) -> dict:
+    """
+    Count the TPs on each channel in one fragment.
+
+    Parameters:
+        readers (tuple): TP reader.
+        paths (tuple[str]): TP fragment path.
+
+    Returns a dictionary of the channel counts, the same counts again
+    to take the per-channel maximum over fragments, and the number of
+    TPs on channels at or above NUM_CHANNELS.
+    """
+    with phase("decode"):
+        tps = readers[0].read_fragment(paths[0])
+    channels = tps['channel']
+    in_range = (channels >= 0) & (channels < NUM_CHANNELS)
+    channel_counts = np.bincount(channels[in_range], minlength=NUM_CHANNELS)
+    return {
+            "channel_counts": channel_counts,
+            "max_counts": channel_counts,
+            "out_of_range": np.sum(~in_range),
+    }
+
+
+@profiled("plot")
+def plot_pdf_channel_counts(channel_counts: np.ndarray, save_name: str) -> None:
+    """
+    Plot the TP count per channel with linear and log scales.
+
+    Parameters:
+        channel_counts (np.ndarray): TP count for each channel.
+        save_name (str): PDF to save to.
+
+    Returns nothing. Saves a PDF.
+    """
+    edges = np.arange(len(channel_counts) + 1)
+    with PdfPages(save_name) as pdf:
+        fig, ax = plt.subplots(figsize=(6, 4))
+        ax.stairs(channel_counts, edges, fill=True, color='#63ACBE', alpha=0.6, label='Linear')
+        ax.set_title("Noisy Channels")
+        ax.set_xlabel("Channel")
+        ax.set_ylabel("TP Count")
+
+        log_ax = ax.twinx()
+        log_ax.stairs(channel_counts, edges, fill=True, color='#EE442F', alpha=0.6, label='Log')
+        log_ax.set_yscale('log')
+
+        fig.legend()
+        fig.tight_layout()
+        pdf.savefig(fig)
+        plt.close(fig)
+    return
+
+
+@profiled("plot")
+def plot_png_hot_channel_series(fragment_counts: np.ndarray, hot_channels: np.ndarray, file_id: str) -> None:
+    """
+    Plot the TP count of each hot channel across the fragments.
+
+    Parameters:
+        fragment_counts (np.ndarray): TP count per fragment and channel.
+        hot_channels (np.ndarray): Channels to plot.
+        file_id (str): File identifier.
+
+    Returns nothing. Saves a PNG.
+    """
+    plt.figure(figsize=(6, 4), dpi=200)
+
+    for channel in hot_channels:
+        plt.plot(fragment_counts[:, channel], '-o', ms=2, alpha=0.6, label=f"Channel {channel}")
+
+    plt.title(f"Hot Channels per Fragment\n{file_id}")
+    plt.xlabel("Fragment")
+    plt.ylabel("TP Count")
+    if 0 < len(hot_channels) <= 10:
+        plt.legend()
+
+    plt.tight_layout()
+    plt.savefig(f"hot_channels_series_{file_id}.png")
+    plt.close()
+    return
 
 
 @click.command()
 @click.argument("file")
 @click.option("--limit", type=click.INT, default=10000)
 @click.option("--fragment", '-f', type=click.INT, default=10)
-def main(file, limit, fragment):
-    data = TPReader(file)
-    tps = data.read_fragment(data.get_fragment_paths()[fragment])
-    plotter = PDFPlotter(f"hot_channels_{data.run_id}.{data.file_index}.pdf")
-    hist_style = dict(
-            title="Noisy Channels",
-            xlabel="Channel",
-            ylabel="TP Count",
-            linear=True,
-            linear_style=dict(color='#63ACBE', alpha=0.6, label='Linear'),
-            log=True,
-            log_style=dict(color='#EE442F', alpha=0.6, label='Log'),
-            bins=np.arange(0, 3072)
-    )
-
-    plotter.plot_histogram(tps['channel'], hist_style)
-    hist, _ = np.histogram(tps['channel'], bins=np.arange(0, 3072))
-    print(f"Total Number of TPs: {len(tps)}.")
-    print(f"Above Limit = {limit} Channels:", np.where(hist > limit)[0])
+@click.option("--all-frags", '-a', default=False, is_flag=True)
+@click.option("--series", '-s', default=False, is_flag=True,
+              help="With -a, also keep each fragment's counts to plot the hot channels per fragment and save them.")
+@click.option("--readout", '-r', default=False, is_flag=True, help="Count readout TPs instead of trigger TPs.")
+@click.option("--jobs", '-j', type=click.INT, default=1)
+@profile_option
+def main(file, limit, fragment, all_frags, series, readout, jobs):
+    with phase("open"):
+        data = open_reader(TPReader, file)
+    file_id = f"{data.run_id}.{data.file_index}"
+
+    # Trigger TPs repeat the readout TPs, so only one kind is counted.
+    paths = FragmentIndex.from_readers(data).paths("readout_tp" if readout else "trigger_tp")
+    if not all_frags:
+        paths = paths[fragment:fragment+1]
+    if len(paths) == 0:
+        print("No fragments to count.")
+        return
+
+    path_tuples = [(path,) for path in paths]
+    if all_frags and series:
+        counts = map_fragments(count_channels, file, (TPReader,), path_tuples, jobs=jobs)
+        fragment_counts = counts["channel_counts"]
+        counts = {"channel_counts": np.sum(fragment_counts, axis=0),
+                  "max_counts": np.max(fragment_counts, axis=0),
+                  "out_of_range": np.sum(counts["out_of_range"])}
+    else:
+        counts = reduce_fragments(count_channels, file, (TPReader,), path_tuples, jobs=jobs,
+                                  ops={"max_counts": np.maximum})
+    channel_counts = counts["channel_counts"]
+
+    plot_pdf_channel_counts(channel_counts, f"hot_channels_{file_id}.pdf")
+    print(f"Total Number of TPs: {np.sum(channel_counts) + counts['out_of_range']}.")
+    if counts['out_of_range']:
+        print(f"TPs on Channels Outside [0, {NUM_CHANNELS}):", counts['out_of_range'])
+
+    # The limit is per fragment, so the run-wide check uses the average fragment.
+    print(f"Above Limit = {limit} Channels:", np.where(channel_counts > limit * len(paths))[0])
+
+    if all_frags:
+        # Channels that are hot in any fragment, even if not on average.
+        hot_channels = np.where(counts["max_counts"] > limit)[0]
+        print(f"Above Limit = {limit} in Any Fragment:", hot_channels)
+        if series:
+            np.savez_compressed(f"hot_channels_{file_id}.npz", paths=np.array(paths), channel_counts=fragment_counts)
+            plot_png_hot_channel_series(fragment_counts, hot_channels, file_id)
     return
 
 
@@ -9,18 +9,42 @@ import click
 import matplotlib.pyplot as plt
 import numpy as np
 
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.flat_taps import FlatTAPs
+from daq_utils.fragment_cache import open_reader
+from daq_utils.profiling import phase, profile_option, profiled
+from daq_utils.streaming import stream_ta_fragments
+
 
 COLLECTION_TO_CM = 0.51  # cm per channel.
 COLLECTION_ALPHA = 0
 TICK_TO_US = 0.016  # us per tick
 DRIFT_VELOCITY = 0.16  # cm per us
 
+SUMMARY_DTYPE = np.dtype([
+    ('fragment', np.int64),
+    ('ta', np.int64),
+    ('num_tps', np.int64),
+    ('average_dtheta', np.float64),
+    ('average_dphi', np.float64),
+    ('average_ds', np.float64),
+    ('average_pair_dE', np.float64),
+    ('ds', np.float64),
+    ('total_dE', np.float64),
+    ('average_dE', np.float64),
+    ('dEds', np.float64),
+])
+
 #@plt.rcParams.update({
 #@    "text.usetex": True,
 #@    "font.family": "Helvetica"
 #@})
 
 
+@profiled("plot")
 def plot_ds(ds: list[float]) -> None:
     """
     Plot the TP ordered ds.
@@ -39,6 +63,7 @@ def plot_ds(ds: list[float]) -> None:
     plt.close()
 
 
+@profiled("plot")
 def plot_dE(dE: list[float]) -> None:
     """
     Plot the TP ordered dE.
@@ -57,6 +82,7 @@ def plot_dE(dE: list[float]) -> None:
     plt.close()
 
 
+@profiled("plot")
 def plot_dE_per_tp(dE: np.ndarray, ds: float) -> None:
     plt.figure(figsize=(6, 4), dpi=200)
     plt.grid(True)
@@ -84,6 +110,7 @@ def energy_correction(adc_integral: np.ndarray) -> np.ndarray:
     return dE
 
 
+@profiled("plot")
 def plot_adc_integral(tps: np.ndarray) -> None:
     """
     Plot the TP ordered ADC integral.
@@ -125,10 +152,7 @@ def get_average_dtheta(ta: np.ndarray) -> float:
 
     Returns the average dtheta.
     """
-    average_dtheta = 0
-    for tp0, tp1 in zip(ta[:-1], ta[1:]):
-        average_dtheta += calculate_dtheta(tp0, tp1)
-    return average_dtheta / (len(ta) - 1)
+    return np.mean(calculate_dtheta(ta[:-1], ta[1:]))
 
 
 def calculate_dphi(tp0: np.ndarray, tp1: np.ndarray) -> float:
@@ -158,10 +182,8 @@ def get_average_dphi(ta: np.ndarray) -> float:
 
     Returns the average dphi.
     """
-    average_dphi = 0
-    for tp0, tp1 in zip(ta[:-1], ta[1:]):
-        average_dphi += calculate_dphi(tp0, tp1)
-    return average_dphi / len(ta[:-1])
+    dphi = np.broadcast_to(calculate_dphi(ta[:-1], ta[1:]), (len(ta) - 1,))
+    return np.mean(dphi)
 
 
 def get_u_x(theta: float, phi: float) -> float:
@@ -194,17 +216,140 @@ def get_dE(tp0: np.ndarray, tp1: np.ndarray) -> float:
     return tp1['adc_integral'].astype(int) - tp0['adc_integral'].astype(int)
 
 
+def summarize_tracks(taps: FlatTAPs) -> np.ndarray:
+    """
+    Calculate the track summary of every TA at once.
+
+    Consecutive TP pairs are taken over the flat TPs, so every
+    per-pair quantity is one array operation over all TAs.
+
+    Parameter:
+        taps (FlatTAPs): TPs of each TA, in TP order.
+
+    Returns a SUMMARY_DTYPE array with one entry per TA. The fragment
+    field is left at 0. Averages over no pairs or no TPs are NaN.
+    """
+    summary = np.zeros(len(taps), dtype=SUMMARY_DTYPE)
+    summary['ta'] = np.arange(len(taps))
+    summary['num_tps'] = taps.counts
+
+    # TP i and TP i+1 of a TA form pair i, so both sides have count - 1 TPs per TA.
+    tp0 = taps.slice_each(None, -1)
+    tp1 = taps.slice_each(1, None)
+    pair_ta = tp0.ta_index
+    num_pairs = tp0.counts
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dtheta = calculate_dtheta(tp0.taps, tp1.taps)
+        dphi = np.broadcast_to(calculate_dphi(tp0.taps, tp1.taps), dtheta.shape)
+        ds = get_ds(tp0.taps, tp1.taps)
+        pair_dE = get_dE(tp0.taps, tp1.taps)
+
+        for field, values in (('average_dtheta', dtheta), ('average_dphi', dphi),
+                              ('average_ds', ds), ('average_pair_dE', pair_dE)):
+            summary[field] = np.bincount(pair_ta, weights=values, minlength=len(taps)) / num_pairs
+
+        dE = energy_correction(taps.taps['adc_integral'].astype(np.float64))
+        summary['total_dE'] = np.bincount(taps.ta_index, weights=dE, minlength=len(taps))
+        summary['average_dE'] = summary['total_dE'] / taps.counts
+
+        # Same track ds as the single TA mode: from the first to the last TP.
+        non_empty = taps.counts > 0
+        first = taps.taps[taps.offsets[:-1][non_empty]]
+        last = taps.taps[taps.offsets[1:][non_empty] - 1]
+        summary['ds'] = np.nan
+        summary['ds'][non_empty] = get_ds(first, last)
+        summary['dEds'] = summary['average_dE'] / summary['ds']
+    return summary
+
+
+@profiled("plot")
+def plot_dEds_distribution(summary: np.ndarray, file_id: str) -> None:
+    """
+    Plot the distribution of dE/ds over all summarized TAs.
+
+    Parameters:
+        summary (np.ndarray): Output of summarize_tracks.
+        file_id (str): File identifier.
+    """
+    dEds = summary['dEds'][np.isfinite(summary['dEds'])]
+
+    plt.figure(figsize=(6, 4))
+    plt.grid(True)
+
+    plt.hist(dEds, bins=50, color='k')
+
+    plt.title(f"TA Average $\\frac{{dE}}{{ds}}$\n{file_id}")
+    plt.xlabel(r"$\frac{dE}{ds}$")
+    plt.ylabel("Count")
+
+    plt.tight_layout()
+    plt.savefig(f"dEds_distribution_{file_id}.png")
+    plt.close()
+
+
+def run_batch(data: trgtools.TAReader, paths: list[str], skip: int, prefetch: int) -> np.ndarray:
+    """
+    Summarize every TA in the given fragments.
+
+    Parameters:
+        data (trgtools.TAReader): Reader to stream the fragments from.
+        paths (list[str]): TA fragment paths to summarize.
+        skip (int): Number of TPs to drop from the start of each TA.
+        prefetch (int): Number of fragments to prefetch.
+
+    Returns the summaries of all TAs, in fragment order.
+    """
+    fragment_index = {path: idx for idx, path in enumerate(data.get_fragment_paths())}
+    summaries = []
+    for path, _, tp_data in stream_ta_fragments(data, paths, depth=prefetch):
+        if len(tp_data) == 0:
+            continue
+        with phase("compute"):
+            summary = summarize_tracks(FlatTAPs.from_list(tp_data).slice_each(skip, None))
+        summary['fragment'] = fragment_index[path]
+        summaries.append(summary)
+    if len(summaries) == 0:
+        return np.zeros(0, dtype=SUMMARY_DTYPE)
+    return np.concatenate(summaries)
+
+
 @click.command()
 @click.argument("file")
 @click.option('-f', "--fragment", type=click.INT)
-def main(file, fragment):
-    data = trgtools.TAReader(file)
-    fragment_path = data.get_fragment_paths()[fragment]
+@click.option("--ta", type=click.INT, default=3)
+@click.option("--skip", '-s', type=click.INT, default=None)
+@click.option("--batch", '-b', default=False, is_flag=True)
+@click.option("--all-frags", '-a', default=False, is_flag=True)
+@click.option("--prefetch", '-p', type=click.INT, default=0)
+@profile_option
+def main(file, fragment, ta, skip, batch, all_frags, prefetch):
+    if fragment is None and not all_frags:
+        raise click.BadParameter("Give a fragment with -f/--fragment, or use -a/--all-frags.", param_hint="'--fragment'")
+
+    with phase("open"):
+        data = open_reader(trgtools.TAReader, file)
+
+    if batch or all_frags:
+        file_id = f"{data.run_id}.{data.file_index}"
+        paths = data.get_fragment_paths()
+        if not all_frags:
+            paths = [paths[fragment]]
+
+        summary = run_batch(data, paths, 0 if skip is None else skip, prefetch)
+        np.savez_compressed(f"energy_summary_{file_id}.npz", summary=summary)
+        plot_dEds_distribution(summary, file_id)
+
+        print("Number of TAs summarized:", len(summary))
+        print("Median TA average dE/ds:", np.nanmedian(summary['dEds']))
+        return
 
-    _ = data.read_fragment(fragment_path)
-    ta = data.ta_data[3]
-    tps = data.tp_data[3][29:]
+    fragment_path = data.get_fragment_paths()[fragment]
 
+    with phase("decode"):
+        _ = data.read_fragment(fragment_path)
+    taps = FlatTAPs.from_list(data.tp_data)
+    tps = taps[ta][29 if skip is None else skip:]
     plot_adc_integral(tps)
 
     phi = get_average_dphi(tps)
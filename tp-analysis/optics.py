@@ -1,6 +1,12 @@
 """
 Generate the OPTICS
 reachability plot.
+
+OPTICS on a whole fragment is too slow and too large, so the TPs
+can be clustered in overlapping time windows instead. Windows are
+clustered independently (optionally in worker processes) as soon as
+the fragments that fill them have been read, and clusters that share
+TPs in a window overlap are stitched together.
 """
 
 
@@ -9,39 +15,352 @@ from trgtools import TPReader
 import click
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy import sparse
 from sklearn.cluster import OPTICS
+from sklearn.neighbors import kneighbors_graph, radius_neighbors_graph
 
+from concurrent.futures import ProcessPoolExecutor
+
+import os
+import sys
+from typing import Iterable, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.fragment_cache import open_reader
+from daq_utils.fragment_index import FragmentIndex
+from daq_utils.profiling import phase, profile_option, profiled
+from daq_utils.streaming import group_records, stream_tp_fragments
+
+
+OPTICS_PARAMETERS = {
+        "min_samples": 10,
+        "xi": 0.05,
+        "metric": 'manhattan',
+        "cluster_method": 'xi',
+        "min_cluster_size": 5,
+}
+
+
+def get_positions(tps: np.ndarray, t0: Optional[int] = None) -> np.ndarray:
+    """
+    Get the (channel, time) positions that OPTICS clusters on.
+
+    Parameters:
+        tps (np.ndarray): TPs to position.
+        t0 (int): Time that relative times start from. Defaults to the earliest TP.
+
+    Returns an (N, 2) array of channel and relative time (32 ticks).
+    """
+    channels = tps['channel'].astype(int)
+    times = tps['time_start'].astype(int)
+    times = (times - (np.min(times) if t0 is None else t0)) // 32
+    return np.array([channels, times]).T
+
+
+def make_windows(times: np.ndarray, window: int, overlap: int, t0: Optional[int] = None,
+                 stop: Optional[int] = None) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Split the positions into overlapping time windows.
+
+    Window k covers [t0 + k * window, t0 + (k + 1) * window + overlap)
+    and owns the TPs in its first window ticks. Every TP from t0 on is
+    owned by exactly one window.
+
+    Parameters:
+        times (np.ndarray): Time of each position.
+        window (int): Time owned by each window.
+        overlap (int): Extra time each window shares with the next. At most window.
+        t0 (int): Start of the first window. Defaults to the earliest time.
+        stop (int): Only make the windows that start before stop. Defaults to all of them.
+
+    Returns (indices, owned) for each non-empty window, in time order.
+    """
+    if overlap > window:
+        raise ValueError(f"Window overlap {overlap} is larger than the window {window}.")
+    if len(times) == 0:
+        return []
+
+    order = np.argsort(times, kind='stable')
+    sorted_times = times[order]
+    if t0 is None:
+        t0 = sorted_times[0]
+    last = sorted_times[-1] if stop is None else min(sorted_times[-1], stop - 1)
+    num_windows = max(0, (last - t0) // window + 1)
+    starts = t0 + np.arange(num_windows) * window
+    lo = np.searchsorted(sorted_times, starts, side='left')
+    mid = np.searchsorted(sorted_times, starts + window, side='left')
+    hi = np.searchsorted(sorted_times, starts + window + overlap, side='left')
+
+    windows = []
+    for k in range(num_windows):
+        if hi[k] == lo[k]:
+            continue
+        indices = order[lo[k]:hi[k]]
+        owned = np.arange(lo[k], hi[k]) < mid[k]
+        windows.append((indices, owned))
+    return windows
+
+
+def neighbors_graph(positions: np.ndarray, max_eps: float) -> sparse.csr_matrix:
+    """
+    Get the sparse distance graph that OPTICS clusters on with --precomputed.
+
+    Only pairs within max_eps are stored, so memory scales with the
+    neighborhood sizes. OPTICS also needs every point's min_samples
+    nearest neighbors in the graph, even isolated noise TPs, so those
+    are added too. Neighbors beyond max_eps do not change the result:
+    OPTICS gives such points an infinite core distance.
+
+    Parameters:
+        positions (np.ndarray): (N, 2) positions, at least min_samples of them.
+        max_eps (float): Largest neighborhood radius OPTICS considers.
+
+    Returns an (N, N) CSR matrix of distances.
+    """
+    metric = OPTICS_PARAMETERS["metric"]
+    within_eps = radius_neighbors_graph(positions, radius=max_eps, mode='distance', metric=metric)
+    # The point itself counts as one of its min_samples neighbors.
+    nearest = kneighbors_graph(positions, n_neighbors=OPTICS_PARAMETERS["min_samples"] - 1, mode='distance', metric=metric)
+    # Shift the distances so that pairs at distance 0 survive the union.
+    within_eps.data += 1
+    nearest.data += 1
+    graph = within_eps.maximum(nearest).tocsr()
+    graph.data -= 1
+    return graph
+
+
+def cluster_positions(positions: np.ndarray, max_eps: float = np.inf, precomputed: bool = False) -> dict[str, np.ndarray]:
+    """
+    Run OPTICS on one set of positions.
+
+    Parameters:
+        positions (np.ndarray): (N, 2) positions to cluster.
+        max_eps (float): Largest neighborhood radius OPTICS considers.
+        precomputed (bool): Cluster on a sparse neighbors graph within max_eps. See neighbors_graph.
+
+    Returns the labels, reachability, core distances, and ordering.
+    Labels are in position order. The rest follow OPTICS.
+    """
+    num_positions = len(positions)
+    if num_positions < OPTICS_PARAMETERS["min_samples"]:
+        # Too few positions to have a core point.
+        return {
+                "labels": np.full(num_positions, -1),
+                "reachability": np.full(num_positions, np.inf),
+                "core_distances": np.full(num_positions, np.inf),
+                "ordering": np.arange(num_positions),
+        }
+
+    parameters = dict(OPTICS_PARAMETERS, max_eps=max_eps)
+    if precomputed:
+        parameters["metric"] = 'precomputed'
+        optics = OPTICS(**parameters).fit(neighbors_graph(positions, max_eps))
+    else:
+        optics = OPTICS(**parameters).fit(positions)
+
+    return {
+            "labels": optics.labels_,
+            "reachability": optics.reachability_,
+            "core_distances": optics.core_distances_,
+            "ordering": optics.ordering_,
+    }
 
-@click.command()
-@click.argument("file")
-def main(file):
-    data = TPReader(file)
-    data.read_fragment(data.get_fragment_paths()[0])
-    channels = data.tp_data['channel'].astype(int)
-    times = data.tp_data['time_start'].astype(int)
-    times = (times - np.min(times)) // 32
 
-    positions = np.array([channels, times]).T
-    positions = positions[:10000]
+def stitch_windows(num_positions: int, windows: list[tuple[np.ndarray, np.ndarray]], results: list[dict]) -> np.ndarray:
+    """
+    Combine the window labels into one labelling.
 
-    optics = OPTICS(min_samples=10, xi=0.05, metric='manhattan', cluster_method='xi', min_cluster_size=5)
+    Each TP takes the label from the window that owns it, or from the
+    other window it is in if the owner called it noise. Clusters from
+    neighboring windows that share a TP are merged.
 
-    optics.fit(positions)
+    Parameters:
+        num_positions (int): Total number of positions.
+        windows (list[tuple[np.ndarray, np.ndarray]]): Output of make_windows.
+        results (list[dict]): Output of cluster_positions for each window.
 
-    ordering = optics.ordering_
-    labels = optics.labels_[ordering]
-    print("Number of labels:", np.max(labels))
-    reachability = optics.reachability_[ordering]
-    core_distances = optics.core_distances_[ordering]
-    space = np.arange(len(positions))
+    Returns a dense label for each position. Noise is -1.
+    """
+    owner_label = np.full(num_positions, -1, dtype=np.int64)
+    shared_label = np.full(num_positions, -1, dtype=np.int64)
+    num_clusters = 0
+    for (indices, owned), result in zip(windows, results):
+        labels = result["labels"]
+        # Window-local labels become global cluster ids.
+        global_labels = np.where(labels >= 0, labels + num_clusters, -1)
+        num_clusters += np.max(labels) + 1 if len(labels) > 0 else 0
+        owner_label[indices[owned]] = global_labels[owned]
+        shared_label[indices[~owned]] = global_labels[~owned]
+
+    # Clusters linked by a shared TP are the same cluster.
+    linked = (owner_label >= 0) & (shared_label >= 0)
+    src = owner_label[linked]
+    dst = shared_label[linked]
+
+    # Min-label propagation with pointer jumping.
+    roots = np.arange(num_clusters)
+    while len(src) > 0:
+        new_roots = roots.copy()
+        np.minimum.at(new_roots, src, roots[dst])
+        np.minimum.at(new_roots, dst, roots[src])
+        new_roots = new_roots[new_roots]
+        if np.array_equal(new_roots, roots):
+            break
+        roots = new_roots
+
+    labels = np.where(owner_label >= 0, owner_label, shared_label)
+    clustered = labels >= 0
+    _, dense = np.unique(roots[labels[clustered]], return_inverse=True)
+    labels[clustered] = dense
+    return labels
+
+
+def cluster_windows(chunks: Iterable[np.ndarray], window: int, overlap: int, max_eps: float = np.inf,
+                    precomputed: bool = False,
+                    jobs: int = 1) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Cluster positions in overlapping time windows as they are read.
+
+    A window is clustered once a chunk starts after its end, so the
+    chunks must be in time order: a chunk may not have TPs inside a
+    window that has already been clustered. Raises ValueError if one
+    does. TriggerRecords in record order are in time order.
+
+    Parameters:
+        chunks (Iterable[np.ndarray]): (N, 2) channel and time positions, e.g. one chunk per TriggerRecord.
+        window (int): Time owned by each window.
+        overlap (int): Extra time each window shares with the next.
+        max_eps (float): Largest neighborhood radius OPTICS considers.
+        precomputed (bool): Cluster on a sparse radius-neighbors graph.
+        jobs (int): Number of worker processes. 1 runs in this process.
+
+    Returns every position, the label of each position, and an ordering
+    of the positions with their reachability for the reachability plot.
+    The ordering is each window's OPTICS ordering of the TPs it owns, in
+    window order.
+    """
+    if overlap > window:
+        raise ValueError(f"Window overlap {overlap} is larger than the window {window}.")
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+
+    positions = []
+    windows = []
+    results = []
+    # Positions that a window still to be clustered may need, and their index in positions.
+    pending = np.zeros((0, 2), dtype=int)
+    pending_indices = np.zeros(0, dtype=np.int64)
+    num_positions = 0
+    next_start = None
+
+    def submit(stop):
+        nonlocal pending, pending_indices
+        for indices, owned in make_windows(pending[:, 1], window, overlap, t0=next_start, stop=stop):
+            windows.append((pending_indices[indices], owned))
+            if executor is not None:
+                results.append(executor.submit(cluster_positions, pending[indices], max_eps, precomputed))
+            else:
+                results.append(cluster_positions(pending[indices], max_eps, precomputed))
+        if stop is not None:
+            keep = pending[:, 1] >= stop
+            pending, pending_indices = pending[keep], pending_indices[keep]
+
+    try:
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            times = chunk[:, 1]
+            earliest = np.min(times)
+            if next_start is None:
+                next_start = earliest
+            if earliest < next_start:
+                raise ValueError(f"A chunk has TPs at {earliest}, before the already clustered windows end at "
+                                 f"{next_start}. The chunks are not in time order.")
+            positions.append(chunk)
+            pending = np.concatenate((pending, chunk))
+            pending_indices = np.concatenate((pending_indices, num_positions + np.arange(len(chunk))))
+            num_positions += len(chunk)
+
+            # Windows that end before this chunk starts are complete.
+            num_ready = (earliest - overlap - next_start) // window
+            if num_ready > 0:
+                stop = next_start + num_ready * window
+                with phase("compute"):
+                    submit(stop)
+                next_start = stop
+        if len(pending) > 0:
+            with phase("compute"):
+                submit(None)
+        if executor is not None:
+            results = [future.result() for future in results]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    positions = np.concatenate([np.zeros((0, 2), dtype=int)] + positions)
+    with phase("compute"):
+        labels = stitch_windows(len(positions), windows, results)
+
+    ordering = []
+    reachability = []
+    for (indices, owned), result in zip(windows, results):
+        # Owned TPs in this window's OPTICS order.
+        window_ordering = result["ordering"][owned[result["ordering"]]]
+        ordering.append(indices[window_ordering])
+        reachability.append(result["reachability"][window_ordering])
+    if len(ordering) == 0:
+        return positions, labels, np.array([], dtype=np.int64), np.array([])
+    return positions, labels, np.concatenate(ordering), np.concatenate(reachability)
+
+
+def read_positions(data: TPReader, index: FragmentIndex, paths: list[str], prefetch: int,
+                   limit: int = 0) -> Iterable[np.ndarray]:
+    """
+    Read the positions of the TPs in the given fragments, one TriggerRecord at a time.
+
+    The links of a record overlap in time, so a record is read whole
+    before its positions are given out.
+
+    Parameters:
+        data (TPReader): TP reader.
+        index (FragmentIndex): Index of the fragment paths.
+        paths (list[str]): TP fragment paths, in record order.
+        prefetch (int): Number of fragments to read ahead.
+        limit (int): Stop after this many TPs. 0 reads every TP.
+
+    Yields the positions of each record. Times are relative to the
+    earliest TP of the first record.
+    """
+    t0 = None
+    num_positions = 0
+    for _, record_fragments in group_records(stream_tp_fragments(data, paths, depth=prefetch), index):
+        tps = np.concatenate([fragment_tps for _, fragment_tps in record_fragments])
+        if len(tps) == 0:
+            continue
+        if limit > 0:
+            tps = tps[:limit - num_positions]
+        if t0 is None:
+            t0 = np.min(tps['time_start'].astype(int))
+        positions = get_positions(tps, t0)
+        num_positions += len(positions)
+        yield positions
+        if limit > 0 and num_positions >= limit:
+            return
+
+
+@profiled("plot")
+def plot_reachability(reachability: np.ndarray, ordered_labels: np.ndarray) -> None:
+    """
+    Plot the reachability in OPTICS order, colored by cluster.
+    """
+    space = np.arange(len(reachability))
 
     plt.figure(figsize=(8, 6), dpi=200)
-    for label in np.arange(0, np.max(labels)+1):
-        xk = space[labels == label]
-        rk = reachability[labels == label]
+    for label in np.arange(0, np.max(ordered_labels, initial=-1)+1):
+        xk = space[ordered_labels == label]
+        rk = reachability[ordered_labels == label]
         plt.plot(xk, rk, ".", alpha=0.2)
 
-    plt.plot(space[labels == -1], reachability[labels == -1], 'k.', alpha=0.3)
+    plt.plot(space[ordered_labels == -1], reachability[ordered_labels == -1], 'k.', alpha=0.3)
 
     plt.title("Reachability Plot: k=5 & eps=200")
     plt.xlabel("TP Ordering")
@@ -49,8 +368,14 @@ def main(file):
     plt.savefig("optics-reachability.png")
     plt.close()
 
+
+@profiled("plot")
+def plot_clusters(positions: np.ndarray, labels: np.ndarray) -> None:
+    """
+    Plot the clustered positions. Labels are in position order.
+    """
     plt.figure(figsize=(8, 6), dpi=200)
-    for label in np.arange(0, np.max(labels)+1):
+    for label in np.arange(0, np.max(labels, initial=-1)+1):
         xk = positions[labels == label]
         plt.plot(xk[:,1], xk[:,0], '.', alpha=0.3)
 
@@ -61,5 +386,50 @@ def main(file):
     plt.close()
 
 
+@click.command()
+@click.argument("file")
+@click.option("--fragment", '-f', type=click.INT, default=0)
+@click.option("--all-frags", '-a', default=False, is_flag=True)
+@click.option("--readout", '-r', default=False, is_flag=True, help="Cluster readout TPs instead of trigger TPs.")
+@click.option("--limit", type=click.INT, default=10000, show_default=True,
+              help="Cluster only the first LIMIT TPs read. 0 clusters every TP.")
+@click.option("--window", '-w', type=click.INT, default=None)
+@click.option("--overlap", type=click.INT, default=None)
+@click.option("--max-eps", type=click.FLOAT, default=np.inf)
+@click.option("--precomputed", default=False, is_flag=True)
+@click.option("--jobs", '-j', type=click.INT, default=1)
+@click.option("--prefetch", '-p', type=click.INT, default=0)
+@profile_option
+def main(file, fragment, all_frags, readout, limit, window, overlap, max_eps, precomputed, jobs, prefetch):
+    if precomputed and np.isinf(max_eps):
+        raise click.BadParameter("--precomputed needs a finite --max-eps.")
+
+    with phase("open"):
+        data = open_reader(TPReader, file)
+    # Trigger TPs repeat the readout TPs, so only one kind is clustered.
+    index = FragmentIndex.from_readers(data)
+    paths = index.paths("readout_tp" if readout else "trigger_tp")
+    if not all_frags:
+        paths = paths[fragment:fragment+1]
+    chunks = read_positions(data, index, paths, prefetch, limit)
+
+    if window is None:
+        positions = np.concatenate([np.zeros((0, 2), dtype=int)] + list(chunks))
+        with phase("compute"):
+            optics = cluster_positions(positions, max_eps, precomputed)
+        labels = optics["labels"]
+        ordering = optics["ordering"]
+        reachability = optics["reachability"][ordering]
+    else:
+        if overlap is None:
+            # Clusters closer than max_eps across a boundary still share TPs.
+            overlap = window // 4 if np.isinf(max_eps) else min(window, int(np.ceil(max_eps)))
+        positions, labels, ordering, reachability = cluster_windows(chunks, window, overlap, max_eps, precomputed, jobs)
+
+    print("Number of labels:", np.max(labels, initial=-1) + 1)
+    plot_reachability(reachability, labels[ordering])
+    plot_clusters(positions, labels)
+
+
 if __name__ == "__main__":
     main()
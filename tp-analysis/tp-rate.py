@@ -8,7 +8,16 @@ import click
 import numpy as np
 import matplotlib.pyplot as plt
 
+import os
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.fragment_cache import open_reader
+from daq_utils.mapreduce import map_fragments
+from daq_utils.profiling import phase, profile_option, profiled
+
+
+@profiled("plot")
 def plot_png_tp_rates(num_tps: list[int]) -> None:
     """
     Plot the number of TPs per TimeSlice.
@@ -31,21 +40,50 @@ def plot_png_tp_rates(num_tps: list[int]) -> None:
     plt.close()
 
 
+def count_tps(readers: tuple, paths: tuple[str]) -> dict:
+    """
+    Count the TPs in a fragment by decoding them.
+    """
+    with phase("decode"):
+        tps = readers[0].read_fragment(paths[0])
+    return {"num_tps": len(tps)}
+
+
+def count_tps_metadata(readers: tuple, paths: tuple[str]) -> dict:
+    """
+    Count the TPs in a fragment from its payload size.
+
+    TPs have a fixed size, so the count is the payload bytes
+    over the TP size. No TPs are unpacked.
+    """
+    import trgdataformats
+    with phase("decode"):
+        frag = readers[0]._h5_file.get_frag(paths[0])
+    return {"num_tps": frag.get_data_size() // trgdataformats.TriggerPrimitive.sizeof()}
+
+
 @click.command()
 @click.argument("file")
 @click.option("--offset", '-o', default=10, type=click.INT)
 @click.option("--num", '-n', default=10, type=click.INT)
-@click.option("--all-frags", '-a', default=False)
-def main(file, offset, num, all_frags):
-    data = TPReader(file)
-    num_tps = []
+@click.option("--all-frags", '-a', default=False, is_flag=True)
+@click.option("--metadata", '-m', default=False, is_flag=True)
+@click.option("--jobs", '-j', default=1, type=click.INT)
+@profile_option
+def main(file, offset, num, all_frags, metadata, jobs):
+    with phase("open"):
+        data = open_reader(TPReader, file)
     limit = offset+num
     if all_frags:
         offset = 0
         limit = None
-    for path in data.get_fragment_paths()[offset:limit]:
-        tps = data.read_fragment(path)
-        num_tps.append(len(tps))
+    paths = data.get_fragment_paths()[offset:limit]
+    if len(paths) == 0:
+        print("No fragments in the selected range.")
+        return
+
+    count = count_tps_metadata if metadata else count_tps
+    num_tps = map_fragments(count, file, (TPReader,), [(path,) for path in paths], jobs=jobs)["num_tps"]
 
     plot_png_tp_rates(num_tps)
     return
@@ -7,6 +7,14 @@ import trgtools
 import click
 import numpy as np
 
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.flat_taps import FlatTAPs
+from daq_utils.profiling import phase, profile_option
+from daq_utils.tp_keys import pack_tps
+
 
 def fourth_tp_check(tps0: np.ndarray, tps1: np.ndarray) -> bool:
     """
@@ -22,46 +30,74 @@ def fourth_tp_check(tps0: np.ndarray, tps1: np.ndarray) -> bool:
     return tps0[3] == tps1[0]
 
 
-def check_fourth_subset(tps0: np.ndarray, tps1: np.ndarray) -> bool:
+def equal_each(taps0: FlatTAPs, taps1: FlatTAPs) -> np.ndarray:
+    """
+    Check that paired TAs have the same TPs, element by element.
+
+    Parameters:
+        taps0 (FlatTAPs) : One TP source.
+        taps1 (FlatTAPs) : One TP source. Paired by TA index, up to the shorter one.
+
+    Returns:
+        (np.ndarray) : True for each TA pair with the same TPs.
+    """
+    num_tas = min(len(taps0), len(taps1))
+    taps0, taps1 = taps0[:num_tas], taps1[:num_tas]
+    same_count = taps0.counts == taps1.counts
+
+    # Only TAs with the same count can match, and then TPs pair up directly.
+    taps0, taps1 = taps0[same_count], taps1[same_count]
+    mismatch = np.any(pack_tps(taps0.taps) != pack_tps(taps1.taps), axis=1)
+    mismatch_count = np.bincount(taps0.ta_index, weights=mismatch, minlength=len(taps0))
+
+    result = np.zeros(num_tas, dtype=bool)
+    result[same_count] = mismatch_count == 0
+    return result
+
+
+def check_fourth_subset(taps0: FlatTAPs, taps1: FlatTAPs) -> np.ndarray:
     """
     Check that the subset of fourth TP is the same.
 
     Parameters:
-        tps0 (np.ndarray) : One TP source.
-        tps1 (np.ndarray) : One TP source.
+        taps0 (FlatTAPs) : One TP source.
+        taps1 (FlatTAPs) : One TP source.
 
     Returns:
-        True if the subsets are the same.
+        (np.ndarray) : True for each TA whose subsets are the same.
     """
-    return np.all(tps0[3:] == tps1[:-3])
+    return equal_each(taps0.slice_each(3, None), taps1.slice_each(None, -3))
 
 
-def check_fourth_bleed(tps0: np.ndarray, tps1: np.ndarray) -> bool:
+def check_fourth_bleed(taps0: FlatTAPs, taps1: FlatTAPs) -> np.ndarray:
     """
     Check that the subset of fourth TP is bleeding.
 
     Parameters:
-        tps0 (np.ndarray) : One TP source. Origin TA.
-        tps1 (np.ndarray) : One TP source. One TA early.
+        taps0 (FlatTAPs) : One TP source. Origin TAs.
+        taps1 (FlatTAPs) : One TP source. One TA early.
 
     Returns:
-        True if there is blood.
+        (np.ndarray) : True for each TA where there is blood.
     """
-    return np.all(tps0[:3] == tps1[-3:])
+    return equal_each(taps0.slice_each(None, 3), taps1.slice_each(-3, None))
 
 
 @click.command()
 @click.argument('file0')
 @click.argument('file1')
+@profile_option
 def main(file0, file1):
     print("Reading data0 from", file0)  # During test, this was always a process_tpstream.cxx file.
     print("Reading data1 from", file1)  # This was always a replay application file.
 
-    data0 = trgtools.TAReader(file0)
-    data1 = trgtools.TAReader(file1)
+    with phase("open"):
+        data0 = trgtools.TAReader(file0)
+        data1 = trgtools.TAReader(file1)
 
-    data0.read_all_fragments()
-    data1.read_all_fragments()
+    with phase("decode"):
+        data0.read_all_fragments()
+        data1.read_all_fragments()
     print("Number of TAs in data0:", len(data0.ta_data))
     print("Number of TAs in data1:", len(data1.ta_data))
 
@@ -73,18 +109,18 @@ def main(file0, file1):
 #    if not np.all(time_same):
 #        print("Number of matching start times:", np.sum(time_same))
 
+    taps0 = FlatTAPs.from_list(data0.tp_data)
+    taps1 = FlatTAPs.from_list(data1.tp_data)
+
     # Found that the 4th TP in replay was the same as 1st TP in process_tpstream
-    total_tas = len(data1.tp_data)
-    matching_fourth = 0
-    for tps0, tps1 in zip(data0.tp_data[:ta_offset], data1.tp_data):
-        if check_fourth_subset(tps0, tps1):  # Was only checking the 4th; now checks an offset subset.
-            matching_fourth += 1
+    total_tas = len(taps1)
+    # Was only checking the 4th; now checks an offset subset.
+    with phase("compute"):
+        matching_fourth = np.sum(check_fourth_subset(taps0[:ta_offset], taps1))
 
     # Check if the last 3 in the "slow" file appear as the first 3 in the "fast" file.
-    matching_blood = 0
-    for idx in range(1, len(data0.tp_data[:ta_offset+1])):
-        if check_fourth_bleed(data0.tp_data[idx], data1.tp_data[idx-1]):
-            matching_blood += 1
+    with phase("compute"):
+        matching_blood = np.sum(check_fourth_bleed(taps0[:ta_offset+1][1:], taps1))
 
     print(f"Number of matching fourth subsets: {matching_fourth} out of {total_tas} TAs")
     print(f"Number of matching fourth blood: {matching_blood} out of {total_tas-1} TAs")
@@ -8,15 +8,24 @@ import trgtools
 
 import click
 
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.profiling import phase, profile_option
+
+
 def build_simultaneous(file0, file1):
     """
     Instance both files and then read one after the other.
     """
-    data0 = trgtools.TAReader(file0)
-    data1 = trgtools.TAReader(file1)
+    with phase("open"):
+        data0 = trgtools.TAReader(file0)
+        data1 = trgtools.TAReader(file1)
 
-    data0.read_fragment(data0.get_fragment_paths()[0])
-    data1.read_fragment(data1.get_fragment_paths()[0])
+    with phase("decode"):
+        data0.read_fragment(data0.get_fragment_paths()[0])
+        data1.read_fragment(data1.get_fragment_paths()[0])
 
     print("data0: Number of TAs read:", len(data0.ta_data))
     print("data0: Number of TPs read:", len(data0.tp_data))
@@ -32,14 +41,18 @@ def build_consecutively(file0, file1):
     """
     Instance and read one file. Then instance and read the next file.
     """
-    data0 = trgtools.TAReader(file0)
-    data0.read_fragment(data0.get_fragment_paths()[0])
+    with phase("open"):
+        data0 = trgtools.TAReader(file0)
+    with phase("decode"):
+        data0.read_fragment(data0.get_fragment_paths()[0])
 
     print("data0: Number of TAs read:", len(data0.ta_data))
     print("data0: Number of TPs read:", len(data0.tp_data))
 
-    data1 = trgtools.TAReader(file1)
-    data1.read_fragment(data1.get_fragment_paths()[0])
+    with phase("open"):
+        data1 = trgtools.TAReader(file1)
+    with phase("decode"):
+        data1.read_fragment(data1.get_fragment_paths()[0])
 
     print("data1: Number of TAs read:", len(data1.ta_data))
     print("data1: Number of TPs read:", len(data1.tp_data))
@@ -52,8 +65,10 @@ def build_data0(file0):
     """
     Only instance and read this file.
     """
-    data0 = trgtools.TAReader(file0)
-    data0.read_fragment(data0.get_fragment_paths()[0])
+    with phase("open"):
+        data0 = trgtools.TAReader(file0)
+    with phase("decode"):
+        data0.read_fragment(data0.get_fragment_paths()[0])
 
     print("data0: Number of TAs read:", len(data0.ta_data))
     print("data0: Number of TPs read:", len(data0.tp_data))
@@ -67,8 +82,10 @@ def build_data1(file1):
     (I know this is the same as the previous function.
     It was just nicer to read in main() this way.)
     """
-    data1 = trgtools.TAReader(file1)
-    data1.read_fragment(data1.get_fragment_paths()[0])
+    with phase("open"):
+        data1 = trgtools.TAReader(file1)
+    with phase("decode"):
+        data1.read_fragment(data1.get_fragment_paths()[0])
 
     print("data1: Number of TAs read:", len(data1.ta_data))
     print("data1: Number of TPs read:", len(data1.tp_data))
@@ -79,6 +96,7 @@ def build_data1(file1):
 @click.command()
 @click.argument("file0")
 @click.argument("file1")
+@profile_option
 def main(file0, file1):
     print("Reading data0 from", file0)
     print("Reading data1 from", file1)
@@ -12,74 +12,81 @@ import trgtools
 
 import click
 import numpy as np
-from tqdm import tqdm
 
+import os
+import sys
 
-def start_time_check(ta: np.ndarray, tps: np.ndarray) -> bool:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from daq_utils.flat_taps import FlatTAPs
+from daq_utils.profiling import phase, profile_option
+
+
+def start_time_check(ta_data: np.ndarray, taps: FlatTAPs) -> np.ndarray:
     """
-    Check the start time of TA.
+    Check the start time of every TA.
 
     Parameter:
-        ta (np.ndarray) : TA to quality check.
-        tps (np.ndarray) : TPs associated to TA.
+        ta_data (np.ndarray) : TAs to quality check.
+        taps (FlatTAPs) : TPs associated to each TA.
 
     Returns:
-        (bool) : True if the times match, otherwise false.
+        (np.ndarray) : True for each TA whose time matches. Empty TAs are False.
     """
-    return ta['time_start'] == tps[0]['time_start']
+    return (taps.counts > 0) & (ta_data['time_start'] == taps.first('time_start'))
 
 
-def end_time_check(ta: np.ndarray, tps: np.ndarray) -> bool:
+def end_time_check(ta_data: np.ndarray, taps: FlatTAPs) -> np.ndarray:
     """
-    Check the end time of TA.
+    Check the end time of every TA.
 
     Parameter:
-        ta (np.ndarray) : TA to quality check.
-        tps (np.ndarray) : TPs associated to TA.
+        ta_data (np.ndarray) : TAs to quality check.
+        taps (FlatTAPs) : TPs associated to each TA.
 
     Returns:
-        (bool) : True if the times match, otherwise false.
+        (np.ndarray) : True for each TA whose time matches. Empty TAs are False.
     """
-    return ta['time_end'] == tps[-1]['time_start']
+    return (taps.counts > 0) & (ta_data['time_end'] == taps.last('time_start'))
 
 
-def peak_time_check(ta: np.ndarray, tps: np.ndarray) -> bool:
+def peak_time_check(ta_data: np.ndarray, taps: FlatTAPs) -> np.ndarray:
     """
-    Check the peak time of TA.
+    Check the peak time of every TA.
+
+    The expected peak time is from the first TAP with the largest
+    adc_peak, or 0 if no TAP has a positive adc_peak.
 
     Parameter:
-        ta (np.ndarray) : TA to quality check.
-        tps (np.ndarray) : TPs associated to TA.
+        ta_data (np.ndarray) : TAs to quality check.
+        taps (FlatTAPs) : TPs associated to each TA.
 
     Returns:
-        (bool) : True if the times match, otherwise false.
+        (np.ndarray) : True for each TA whose time matches. Empty TAs are False.
     """
-    peak = 0
-    time_peak = 0
-    for tp in tps:
-        if tp['adc_peak'] > peak:
-            peak = tp['adc_peak']
-            time_peak = tp['time_peak']
-    return ta['time_peak'] == time_peak
+    non_empty = taps.counts > 0
+    peak_index = taps.argmax('adc_peak')[non_empty]
+    time_peak = np.where(taps.taps['adc_peak'][peak_index] > 0, taps.taps['time_peak'][peak_index], 0)
+
+    result = np.zeros(len(taps), dtype=bool)
+    result[non_empty] = ta_data['time_peak'][non_empty] == time_peak
+    return result
 
 
 @click.command()
 @click.argument("file", type=click.Path(exists=True, readable=True))
+@profile_option
 def main(file):
-    data = trgtools.TAReader(file)
+    with phase("open"):
+        data = trgtools.TAReader(file)
     # Reading all fragments for now.
-    data.read_all_fragments()
-
-    start_time_count = 0
-    end_time_count = 0
-    peak_time_count = 0
-    for ta, tps in tqdm(zip(data.ta_data, data.tp_data), total=len(data.ta_data)):
-        if not start_time_check(ta, tps):
-            start_time_count += 1
-        if not end_time_check(ta, tps):
-            end_time_count += 1
-        if not peak_time_check(ta, tps):
-            peak_time_count += 1
+    with phase("decode"):
+        data.read_all_fragments()
+
+    with phase("compute"):
+        taps = FlatTAPs.from_list(data.tp_data)
+        start_time_count = np.sum(~start_time_check(data.ta_data, taps))
+        end_time_count = np.sum(~end_time_check(data.ta_data, taps))
+        peak_time_count = np.sum(~peak_time_check(data.ta_data, taps))
 
     print("Number of incorrect TA time starts:", start_time_count)
     print("Number of incorrect TA time ends:", end_time_count)